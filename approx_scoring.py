@@ -0,0 +1,302 @@
+"""
+Pontuação aproximada: um (mode=single) ou dois (mode=bert_score_2) forwards por par e padrão em vez de um por
+subtoken, com os scores levados à escala do bert_score por uma calibração ajustada numa amostra em que os dois
+são calculados.
+
+A calibração é uma reta (a, b) por subtoken, exato ≈ a * aproximado + b, ajustada por mínimos quadrados em
+cada grupo (len_hypo, len_hyper, padrão, papel, posição). Grupo com menos de --min_samples amostras usa o
+nível seguinte: (len_hypo, len_hyper, papel, posição) de todos os padrões, depois (padrão, papel) e por fim
+(papel). O resultado calibrado tem o formato do bert_sentence_score e vai para o bert-eval.py como qualquer
+outro modelo (<output>/<modelo>_approx_<modo>/).
+
+O relatório (approx.tsv) compara com o bert_score em pares de validação da amostra (ou em todo o dataset com
+-r, resultados do bert_portuguese.py, menos os pares usados no ajuste da calibração): correlação de Spearman das
+somas por padrão, crua e calibrada, AP de cada lado e a perda de AP, e o custo em sentenças e em tempo. Com -r e
+sem --en, os padrões são os do primeiro arquivo de -r.
+
+Uso:
+    python approx_scoring.py -m <model> -d datasets/ontoPT-test.tsv -o results --mode single --calib_pairs 2000
+    python approx_scoring.py -m <model> -d datasets/ontoPT-test.tsv -o results --calibration results/calibration_single.json \\
+        -r results/<model>/ontoPT-test.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+APPROX_MODES = ["single", "bert_score_2"]
+
+# níveis de recuo da calibração, do mais específico ao mais geral
+LEVELS = ["lengths_pattern", "lengths", "pattern", "role"]
+
+
+def group_keys(len_hypo, len_hyper, pattern, role, position):
+    """ chave do subtoken em cada nível de LEVELS """
+    return ["\t".join(map(str, (len_hypo, len_hyper, pattern, role, position))),
+            "\t".join(map(str, (len_hypo, len_hyper, role, position))),
+            "\t".join(map(str, (pattern, role))),
+            str(role)]
+
+
+def fit_line(x, y):
+    """ (a, b) de mínimos quadrados; com x constante só o deslocamento """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    if len(x) < 2 or np.var(x) < 1e-12:
+        return 1.0, float(np.mean(y - x))
+    a, b = np.polyfit(x, y, 1)
+    return float(a), float(b)
+
+
+def fit_calibration(exact, approx, patterns, mode, min_samples=5):
+    """ calibração de approx para exact (resultados com as mesmas chaves e padrões) """
+    samples = [defaultdict(lambda: ([], [])) for _ in LEVELS]
+    for key, by_pattern in approx.items():
+        for pattern in patterns:
+            hypo, hyper = by_pattern[pattern]
+            for role, values in enumerate((hypo, hyper)):
+                for position, value in enumerate(values):
+                    for level, group in zip(samples, group_keys(len(hypo), len(hyper), pattern, role, position)):
+                        level[group][0].append(value)
+                        level[group][1].append(exact[key][pattern][role][position])
+    groups = [{group: [*fit_line(x, y), len(x)] for group, (x, y) in level.items() if len(x) >= min_samples}
+              for level in samples[:-1]]
+    # o último nível sempre existe, mesmo com poucas amostras
+    groups.append({group: [*fit_line(x, y), len(x)] for group, (x, y) in samples[-1].items()})
+    logger.info(f"Calibração com {len(approx)} pares: " +
+                ", ".join(f"{name}={len(level)} grupos" for name, level in zip(LEVELS, groups)))
+    return {"mode": mode, "patterns": list(patterns), "min_samples": min_samples, "pairs": len(approx),
+            "levels": dict(zip(LEVELS, groups))}
+
+
+def apply_calibration(calibration, approx):
+    """ resultado no formato do bert_sentence_score a partir do aproximado """
+    levels = [calibration["levels"][name] for name in LEVELS]
+    result = {}
+    for key, by_pattern in approx.items():
+        result[key] = {}
+        for pattern, (hypo, hyper) in by_pattern.items():
+            calibrated = [[], []]
+            for role, values in enumerate((hypo, hyper)):
+                for position, value in enumerate(values):
+                    a, b = 1.0, 0.0
+                    for level, group in zip(levels, group_keys(len(hypo), len(hyper), pattern, role, position)):
+                        if group in level:
+                            a, b = level[group][:2]
+                            break
+                    calibrated[role].append(a * value + b)
+            result[key][pattern] = calibrated
+    return result
+
+
+def save_calibration(calibration, path):
+    with open(path, mode="w", encoding="utf-8") as f_out:
+        json.dump(calibration, f_out, ensure_ascii=False, indent=1)
+
+
+def load_calibration(path):
+    with open(path, encoding="utf-8") as f_in:
+        return json.load(f_in)
+
+
+def spearman(x, y):
+    """ correlação de Spearman (postos médios nos empates) """
+    def ranks(values):
+        values = np.asarray(values, dtype=np.float64)
+        order = np.argsort(values, kind="mergesort")
+        result = np.empty(len(values))
+        result[order] = np.arange(len(values))
+        # empates recebem a média dos postos
+        _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+        sums = np.zeros(len(counts))
+        np.add.at(sums, inverse, result)
+        return sums[inverse] / counts[inverse]
+    if len(x) < 2:
+        return float("nan")
+    return float(np.corrcoef(ranks(x), ranks(y))[0, 1])
+
+
+def pattern_sums(result, patterns, keys):
+    """ soma dos scores do par em cada padrão (o all_subword do ranking.py), em uma lista só """
+    return [sum(result[key][pattern][0]) + sum(result[key][pattern][1]) for key in keys for pattern in patterns]
+
+
+def n_sentences(cloze, rows, patterns, mode):
+    per_pair = {"single": 1, "bert_score_2": 2}
+    return sum(per_pair.get(mode) or len(cloze.word_ids(row[0])) + len(cloze.word_ids(row[1]))
+               for row in rows) * len(patterns)
+
+
+def compare(exact, approx, calibrated, patterns, methods, sub_methods):
+    """ Spearman (cru e calibrado) e AP exato/aproximado/perda para cada method_sub_method """
+    from ranking import evaluate
+
+    keys = list(exact)
+    sums_exact = pattern_sums(exact, patterns, keys)
+    report = {"pairs": len(keys), "spearman_raw": spearman(sums_exact, pattern_sums(approx, patterns, keys)),
+              "spearman_calibrated": spearman(sums_exact, pattern_sums(calibrated, patterns, keys)), "AP": {}}
+    for method in methods:
+        for sub_method in sub_methods:
+            ap_exact = evaluate(exact, patterns, method, sub_method)
+            ap_approx = evaluate(calibrated, patterns, method, sub_method)
+            report["AP"][f"{method}_{sub_method}"] = {"exact": ap_exact, "approx": ap_approx,
+                                                      "loss": ap_exact - ap_approx}
+    return report
+
+
+def score_timed(cloze, rows, patterns, mode, batch_tokens):
+    from scoring import score
+
+    cloze.prepare_words(rows)
+    t0 = time.time()
+    result = score(cloze, rows, patterns, mode, batch_tokens)
+    return result, time.time() - t0
+
+
+def calibrate(cloze, rows, patterns, mode, holdout=0.2, min_samples=5, batch_tokens=8192, seed=0):
+    """
+    Pontua a amostra nos dois modos, ajusta a calibração na parte de treino e compara na de validação.
+    :return: (calibração, (chaves de validação, exato, aproximado) ou None sem validação)
+    """
+    rows = list(rows)
+    random.Random(seed).shuffle(rows)
+    exact, exact_time = score_timed(cloze, rows, patterns, "bert_score", batch_tokens)
+    approx, approx_time = score_timed(cloze, rows, patterns, mode, batch_tokens)
+    n_holdout = int(len(rows) * holdout)
+    fit_keys = [" ".join(row) for row in rows[n_holdout:]]
+    calibration = fit_calibration({k: exact[k] for k in fit_keys}, {k: approx[k] for k in fit_keys}, patterns,
+                                  mode, min_samples)
+    # pares do ajuste: ficam fora do relatório contra -r, que seria dentro da amostra
+    calibration["fit_pairs"] = fit_keys
+    calibration["cost"] = {"sentences": n_sentences(cloze, rows, patterns, mode) /
+                           n_sentences(cloze, rows, patterns, "bert_score"), "time": approx_time / exact_time}
+    if not n_holdout:
+        return calibration, None
+    holdout_keys = [" ".join(row) for row in rows[:n_holdout]]
+    return calibration, (holdout_keys, exact, approx)
+
+
+def main():
+    from bert_portuguese import ClozeBert, load_eval_file, save_bert_file
+    from hearst_patterns import BEST_BERT_SCORE, EN_BEST_PATTERNS
+    from ranking import METHODS, SUB_METHODS
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_name", type=str, help="path to bert models", required=True)
+    parser.add_argument("-d", "--datasets", type=str, nargs="+", help="dataset tsv files", required=True)
+    parser.add_argument("-o", "--output_path", type=str, help="dir output", required=True)
+    parser.add_argument("--mode", choices=APPROX_MODES, default="single",
+                        help="single: 1 forward per pair and pattern; bert_score_2: 2")
+    parser.add_argument("-c", "--calib_dataset", type=str, required=False,
+                        help="pairs to fit the calibration on (default: sampled from the datasets)")
+    parser.add_argument("--calib_pairs", type=int, default=2000, help="pairs scored both ways to fit the calibration")
+    parser.add_argument("--holdout", type=float, default=0.2, help="fraction of the calibration pairs kept to report")
+    parser.add_argument("--min_samples", type=int, default=5, help="smallest group fitted on its own")
+    parser.add_argument("--calibration", type=str, required=False, help="load this calibration instead of fitting")
+    parser.add_argument("-r", "--results", type=str, nargs="*", default=[],
+                        help="exact results of bert_portuguese.py (same order as -d) to report against")
+    parser.add_argument("--en", action="store_true",
+                        help="use EN_BEST_PATTERNS (default: the patterns of the first -r file, or BEST_BERT_SCORE)")
+    parser.add_argument("-n", "--n_patterns", type=int, default=None)
+    parser.add_argument("--batch_tokens", type=int, default=8192)
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    args = parser.parse_args()
+
+    exact_results = {}
+    if args.en:
+        best = EN_BEST_PATTERNS
+    elif args.results:
+        # os padrões do arquivo contra o qual o relatório é feito
+        with open(args.results[0], encoding="utf-8") as f_result:
+            exact_results[0] = json.load(f_result)
+        best = list(next(iter(exact_results[0].values()), {})) or BEST_BERT_SCORE
+        logger.info(f"{len(best)} padrões de {args.results[0]}")
+    else:
+        best = BEST_BERT_SCORE
+    patterns = best[:args.n_patterns] if args.n_patterns else list(best)
+    os.makedirs(args.output_path, exist_ok=True)
+    cloze = ClozeBert(args.model_name, fast_tokenizer=args.fast_tokenizer)
+    datasets = {}
+    for path in args.datasets:
+        with open(path, encoding="utf-8") as f_in:
+            datasets[os.path.basename(path)] = load_eval_file(f_in)
+
+    f_out = open(os.path.join(args.output_path, "approx.tsv"), mode="a", encoding="utf-8")
+    f_out.write("model\tmode\tdataset\tN\tspearman_raw\tspearman_calibrated\tmethod\tAP_exact\tAP_approx\t"
+                "AP_loss\tcost_sentences\tcost_time\n")
+
+    def write_report(name, report, cost):
+        for method, ap in report["AP"].items():
+            f_out.write(f"{args.model_name}\t{args.mode}\t{name}\t{report['pairs']}\t{report['spearman_raw']:.4f}\t"
+                        f"{report['spearman_calibrated']:.4f}\t{method}\t{ap['exact']:.4f}\t{ap['approx']:.4f}\t"
+                        f"{ap['loss']:.4f}\t{cost['sentences']:.4f}\t{cost['time']:.4f}\n")
+        ap = report["AP"]["all_subword_min_positional_rank"]
+        logger.info(f"{name}: Spearman {report['spearman_raw']:.4f} (cru) {report['spearman_calibrated']:.4f} "
+                    f"(calibrado), AP {ap['exact']:.4f} -> {ap['approx']:.4f}, custo {cost['sentences']:.1%} "
+                    f"das sentenças e {cost['time']:.1%} do tempo")
+
+    if args.calibration:
+        calibration = load_calibration(args.calibration)
+        if calibration["mode"] != args.mode:
+            parser.error(f"calibration was fitted for --mode {calibration['mode']}")
+    else:
+        if args.calib_dataset:
+            with open(args.calib_dataset, encoding="utf-8") as f_in:
+                sample = load_eval_file(f_in)
+        else:
+            sample = [row for dataset in datasets.values() for row in dataset]
+        random.Random(0).shuffle(sample)
+        calibration, holdout = calibrate(cloze, sample[:args.calib_pairs], patterns, args.mode, args.holdout,
+                                         args.min_samples, args.batch_tokens)
+        save_calibration(calibration, os.path.join(args.output_path, f"calibration_{args.mode}.json"))
+        if holdout is not None:
+            keys, exact, approx = holdout
+            approx = {key: approx[key] for key in keys}
+            write_report("holdout", compare({key: exact[key] for key in keys}, approx,
+                                            apply_calibration(calibration, approx), patterns, METHODS, SUB_METHODS),
+                         calibration["cost"])
+
+    fit_pairs = set(calibration.get("fit_pairs", []))
+    if args.results and "fit_pairs" not in calibration:
+        logger.warning("calibração sem a lista de pares do ajuste: o relatório contra -r pode ser dentro da amostra")
+    model_dir = f"{args.model_name}_approx_{args.mode}"
+    os.makedirs(os.path.join(args.output_path, model_dir.replace("/", "-")), exist_ok=True)
+    f_info = open(os.path.join(args.output_path, model_dir.replace("/", "-"), "info.tsv"), mode="a",
+                  encoding="utf-8")
+    for i, (name, dataset) in enumerate(datasets.items()):
+        approx, seconds = score_timed(cloze, dataset, patterns, args.mode, args.batch_tokens)
+        calibrated = apply_calibration(calibration, approx)
+        logger.info(f"{name}: {len(dataset)} pares em {seconds:.1f}s")
+        save_bert_file(calibrated, args.output_path, name, model_dir, len(dataset), 0, f_info)
+        if i < len(args.results):
+            if i in exact_results:
+                exact = exact_results.pop(i)
+            else:
+                with open(args.results[i], encoding="utf-8") as f_result:
+                    exact = json.load(f_result)
+            shared = [key for key in calibrated if key in exact]
+            keys = [key for key in shared if key not in fit_pairs]
+            if len(keys) < len(shared):
+                logger.info(f"{name}: {len(shared) - len(keys)} pares do ajuste da calibração fora do relatório")
+            common = [p for p in patterns if keys and p in exact[keys[0]]]
+            if not common:
+                logger.warning(f"{args.results[i]}: nenhum par ou padrão em comum, sem relatório")
+                continue
+            write_report(name, compare({key: exact[key] for key in keys}, {key: approx[key] for key in keys},
+                                       {key: calibrated[key] for key in keys}, common, METHODS, SUB_METHODS),
+                         calibration["cost"])
+    f_info.close()
+    f_out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+Ajuste automático de threads do torch, número de workers e orçamento de tokens por lote para a máquina atual.
+
+Pontua uma amostra do dataset alvo com o modelo alvo (motor em lote do scoring.py, workers por fork do
+shared_workers.py) para cada combinação threads x workers x batch_tokens, até acabar o --time_limit, medindo
+pares/s e o pico de memória (PSS do pai + Pss_peak de cada worker, que pelo VmHWM inclui os logits do lote). A
+melhor combinação que cabe em --max_memory_mb vai para o perfil da máquina, host_profiles/<hostname>.json, por
+modelo e modo, junto com a melhor de um processo só (workers=1, em "single").
+
+O bert_portuguese.py e o bert2.py leem o perfil ao iniciar e usam as threads de "single" (são um processo só, e
+os loops par a par não usam orçamento de lote); sem "single", threads x workers do perfil, até o número de
+núcleos. O shared_workers.py usa os três da melhor combinação quando -w/--threads/--batch_tokens não são dados.
+--no_profile desliga.
+
+Uso:
+    python autotune.py -m neuralmind/bert-base-portuguese-cased -e datasets --time_limit 600
+    python autotune.py -m snapshots/bert-base-portuguese-cased -e datasets/ontoPT-test_token_1.tsv --sample 300 \
+        --threads 1 2 4 --workers 1 2 4 --batch_tokens 4096 8192 16384 --max_memory_mb 12000
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE_ROOT = "./host_profiles"
+DEFAULT_BATCH_TOKENS = [2048, 4096, 8192, 16384]
+
+
+def profile_path(root=DEFAULT_PROFILE_ROOT, host=None):
+    return os.path.join(root, (host or socket.gethostname()) + ".json")
+
+
+def profile_key(model_name, mode):
+    return f"{model_name.replace('/', '-')}\t{mode}"
+
+
+def load_profile(model_name, mode="bert_score", root=DEFAULT_PROFILE_ROOT):
+    """ {threads, workers, batch_tokens, ...} do perfil desta máquina para o modelo e modo; None se não há """
+    path = profile_path(root)
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        profiles = json.load(f)["profiles"]
+    if profile_key(model_name, mode) in profiles:
+        return profiles[profile_key(model_name, mode)]
+    # outro modo do mesmo modelo: threads e workers valem, o orçamento de lote quase sempre também
+    same_model = [p for k, p in profiles.items() if k.split("\t")[0] == model_name.replace("/", "-")]
+    return same_model[0] if same_model else None
+
+
+def single_process_threads(profile):
+    """ threads para quem roda num processo só: a melhor com workers=1 ou, sem ela, threads x workers """
+    if profile.get("single"):
+        return profile["single"]["threads"]
+    return min(os.cpu_count() or 1, profile["threads"] * profile["workers"])
+
+
+def apply_profile(model_name, mode="bert_score", root=DEFAULT_PROFILE_ROOT):
+    """ aplica as threads de processo único do perfil (torch.set_num_threads) e devolve o perfil """
+    profile = load_profile(model_name, mode, root)
+    if profile is not None:
+        import torch
+        threads = single_process_threads(profile)
+        torch.set_num_threads(threads)
+        logger.info(f"Perfil de {socket.gethostname()}: {threads} threads (processo único; melhor com workers: "
+                    f"{profile['threads']} threads x {profile['workers']} workers, "
+                    f"batch_tokens={profile['batch_tokens']})")
+    return profile
+
+
+def save_profile(model_name, mode, best, trials, root=DEFAULT_PROFILE_ROOT):
+    import torch
+    os.makedirs(root, exist_ok=True)
+    path = profile_path(root)
+    data = {"profiles": {}}
+    if os.path.isfile(path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    data.update({"host": socket.gethostname(), "cpus": os.cpu_count(), "torch": torch.__version__,
+                 "date": time.strftime("%Y-%m-%d %H:%M:%S")})
+    data["profiles"][profile_key(model_name, mode)] = {**best, "model": model_name, "mode": mode, "trials": trials}
+    tmp = path + ".tmp"
+    with open(tmp, mode="w", encoding="utf-8") as f_out:
+        json.dump(data, f_out, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def candidate_configs(cpus, threads_list=None, workers_list=None, budgets=None):
+    """ (threads, workers, batch_tokens) com threads * workers <= cpus; as que usam todos os núcleos primeiro """
+    powers = [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= cpus]
+    threads_list = threads_list or sorted(set(powers + [cpus]))
+    workers_list = workers_list or sorted(set(powers + [cpus]))
+    budgets = budgets or DEFAULT_BATCH_TOKENS
+    configs = [(t, w, b) for t in threads_list for w in workers_list for b in budgets if t * w <= cpus]
+    # mais perto de usar todos os núcleos primeiro, depois orçamento do meio para fora
+    middle = budgets[len(budgets) // 2]
+    configs.sort(key=lambda c: (cpus - c[0] * c[1], abs(budgets.index(c[2]) - budgets.index(middle)), -c[1]))
+    return configs
+
+
+def sample_dataset(eval_path, n, seed=0):
+    """ n pares sorteados de um arquivo ou de todos os datasets de um diretório """
+    from dataset_index import dataset_files, load_eval_file
+
+    rows = []
+    paths = [eval_path] if os.path.isfile(eval_path) else [p for _, p in dataset_files(eval_path)]
+    for path in paths:
+        with open(path, encoding="utf-8") as f_in:
+            rows.extend(load_eval_file(f_in))
+    random.Random(seed).shuffle(rows)
+    return rows[:n]
+
+
+def measure(cloze, sample, patterns, mode, threads, workers, batch_tokens):
+    """ pares/s e pico de memória total (MB: PSS do pai + Pss_peak de cada worker) de uma combinação """
+    import shared_workers
+
+    t0 = time.time()
+    _, worker_memory = shared_workers.run(cloze, sample, patterns, mode, workers, threads, batch_tokens,
+                                          shards_per_worker=2)
+    seconds = time.time() - t0
+    parent = shared_workers.memory()
+    peak = parent["Pss"] + sum(m["Pss_peak"] for m in worker_memory.values())
+    return {"threads": threads, "workers": workers, "batch_tokens": batch_tokens, "seconds": seconds,
+            "pairs_per_s": len(sample) / seconds, "peak_mb": peak}
+
+
+def tune(cloze, sample, patterns, mode, configs, time_limit=600, max_memory_mb=None):
+    """ mede as combinações até time_limit; devolve (melhor, todas as medidas) """
+    logging.getLogger("shared_workers").setLevel(logging.WARNING)
+    # aquecimento: primeira alocação dos tensores e tokenização da amostra fora da conta
+    measure(cloze, sample[:max(1, len(sample) // 10)], patterns, mode, 1, 1, configs[0][2])
+    trials = []
+    t0 = time.time()
+    for threads, workers, batch_tokens in configs:
+        if trials and time.time() - t0 > time_limit:
+            logger.info(f"Limite de tempo: {len(trials)} de {len(configs)} combinações medidas")
+            break
+        trial = measure(cloze, sample, patterns, mode, threads, workers, batch_tokens)
+        trial["fits"] = max_memory_mb is None or trial["peak_mb"] <= max_memory_mb
+        trials.append(trial)
+        logger.info(f"threads={threads} workers={workers} batch_tokens={batch_tokens}: "
+                    f"{trial['pairs_per_s']:.1f} pares/s, {trial['peak_mb']:.0f} MB"
+                    f"{'' if trial['fits'] else ' (acima do limite de memória)'}")
+    fitting = [t for t in trials if t["fits"]]
+    if not fitting:
+        raise ValueError(f"nenhuma combinação coube em {max_memory_mb} MB")
+    best = max(fitting, key=lambda t: t["pairs_per_s"])
+    result = {k: best[k] for k in ("threads", "workers", "batch_tokens", "pairs_per_s", "peak_mb")}
+    # melhor de um processo só, para bert_portuguese.py e bert2.py (apply_profile)
+    single = [t for t in fitting if t["workers"] == 1]
+    if single:
+        best = max(single, key=lambda t: t["pairs_per_s"])
+        result["single"] = {k: best[k] for k in ("threads", "batch_tokens", "pairs_per_s", "peak_mb")}
+    return result, trials
+
+
+def main():
+    from bert_portuguese import ClozeBert
+    from hearst_patterns import PATTERN_SETS
+    from scoring import MODES
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_name", type=str, help="bert model or snapshot dir", required=True)
+    parser.add_argument("-e", "--eval_path", type=str, help="dataset file or dir of datasets", required=True)
+    parser.add_argument("--mode", choices=MODES, default="bert_score")
+    parser.add_argument("--patterns", choices=list(PATTERN_SETS), default="all_en",
+                        help="all_en is the list bert_portuguese.py -b uses")
+    parser.add_argument("--sample", type=int, default=200, help="pairs scored per combination")
+    parser.add_argument("--threads", type=int, nargs="+", help="default: powers of two up to the cpu count")
+    parser.add_argument("--workers", type=int, nargs="+", help="default: powers of two up to the cpu count")
+    parser.add_argument("--batch_tokens", type=int, nargs="+", default=DEFAULT_BATCH_TOKENS)
+    parser.add_argument("--time_limit", type=float, default=600, help="seconds for the whole sweep")
+    parser.add_argument("--max_memory_mb", type=float, default=None, help="discard combinations above this")
+    parser.add_argument("--profile_root", type=str, default=DEFAULT_PROFILE_ROOT)
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    args = parser.parse_args()
+
+    cloze = ClozeBert(args.model_name, fast_tokenizer=args.fast_tokenizer)
+    sample = sample_dataset(args.eval_path, args.sample)
+    configs = candidate_configs(os.cpu_count(), args.threads, args.workers, args.batch_tokens)
+    if not configs:
+        parser.error(f"no combination with threads * workers <= {os.cpu_count()} cpus")
+    logger.info(f"{len(configs)} combinações, {len(sample)} pares, limite de {args.time_limit:.0f}s")
+    best, trials = tune(cloze, sample, PATTERN_SETS[args.patterns], args.mode, configs, args.time_limit,
+                        args.max_memory_mb)
+    path = save_profile(args.model_name, args.mode, best, trials, args.profile_root)
+    logger.info(f"Melhor: {best['threads']} threads x {best['workers']} workers, batch_tokens={best['batch_tokens']}"
+                f" ({best['pairs_per_s']:.1f} pares/s, {best['peak_mb']:.0f} MB) -> {path}")
+    if "single" in best:
+        logger.info(f"Melhor com um processo: {best['single']['threads']} threads, "
+                    f"batch_tokens={best['single']['batch_tokens']} ({best['single']['pairs_per_s']:.1f} pares/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,475 @@
+"""
+Benchmarks offline: BERT minúsculo com pesos aleatórios (tiny_bert.py), datasets sintéticos no formato de
+datasets/*.tsv e um corpus sintético com padrões de Hearst, sem rede. Mede vazão, forwards, pico de memória e o
+tempo por etapa de:
+    - score: cada modo de pontuação (bert_portuguese.py, bert2.py e o lote do scoring.py)
+    - eval: output2 do bert-eval.py e as funções de AP do nb_utils.py
+    - corpus: contagem de padrões (hearst_miner.py) e de frequência de palavras (como o processing-ukwac.py)
+
+Cada benchmark roda num processo novo (spawn), então o pico de memória (ru_maxrss) é só dele. Os resultados
+são acrescentados em JSON lines (-r), uma linha por benchmark com run_id, commit e host, para comparar rodadas:
+    python benchmark.py run -w work/bench -r bench.jsonl
+    python benchmark.py run -w work/bench -r bench.jsonl --only score --modes batched bert_score --pairs 500
+    python benchmark.py compare -r bench.jsonl                   # última rodada contra a anterior
+    python benchmark.py compare -r bench.jsonl --base <run_id> --threshold 0.1
+
+packing confere que o empacotamento de sentenças (scoring.py com pack_tokens) dá os mesmos scores que o lote
+sem empacotamento, que nenhum par se perde (inclusive um sem wordpieces) e mede a vazão dos dois (sai com 1 se a
+diferença passar de --tolerance):
+    python benchmark.py packing -w work/bench -r bench.jsonl --pack_tokens 64 128
+
+Etapas do score: tokenize (prepare_words), forward (tempo dentro do modelo, medido com hooks) e other (montagem das
+sentenças, tensores, gather e cópia para a CPU); o detalhe de cada uma vem em "instrumentation" (instrumentation.py).
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from hearst_patterns import ALL_PATTERNS, PATTERN_SETS
+from tiny_bert import build_tiny_bert, synthetic_words
+
+logger = logging.getLogger(__name__)
+
+# modo: (módulo do ClozeBert, número de padrões usados)
+SCORE_MODES = {
+    "bert_score": ("bert_portuguese", None),
+    "bert_score_2": ("bert_portuguese", None),
+    "logsoftmax": ("bert_portuguese", None),
+    "batched": ("bert_portuguese", None),
+    "batched_2": ("bert_portuguese", None),
+    "packed": ("bert_portuguese", None),
+    "packed_2": ("bert_portuguese", None),
+    "bert2_score": ("bert2", None),
+    # as combinações usam as permutações dos padrões: com mais de 3 explode
+    "bert2_sep_comb": ("bert2", 3),
+    "bert2_dot_comb": ("bert2", 3),
+}
+BENCHMARKS = ["score", "eval", "corpus"]
+
+LABELS = [("True", "hyper")] * 5 + [("False", "random")] * 4 + [("False", "Synonym")]
+
+
+def synthetic_dataset(words, n_pairs, seed=0):
+    """ linhas [hipo, hyper, classe, fonte] como nos datasets/*.tsv """
+    rnd = random.Random(seed)
+    rows = []
+    seen = set()
+    while len(rows) < n_pairs:
+        hypo, hyper = rnd.choice(words), rnd.choice(words)
+        if hypo == hyper or (hypo, hyper) in seen:
+            continue
+        seen.add((hypo, hyper))
+        rows.append([hypo, hyper, *rnd.choice(LABELS)])
+    return rows
+
+
+def write_dataset(rows, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, mode="w", encoding="utf-8") as f_out:
+        for row in rows:
+            f_out.write("\t".join(row) + "\n")
+
+
+def synthetic_corpus(words, path, n_lines, patterns, seed=0):
+    """ texto com uma sentença de padrão de Hearst a cada ~5 linhas e o resto palavras soltas """
+    rnd = random.Random(seed)
+    with open(path, mode="w", encoding="utf-8") as f_out:
+        for i in range(n_lines):
+            if i % 1000 == 0:
+                f_out.write(f"CURRENT URL http://example.com/{i}\n")
+            filler = " ".join(rnd.choice(words) for _ in range(rnd.randint(5, 20)))
+            if rnd.random() < 0.2:
+                sentence = rnd.choice(patterns).format(rnd.choice(words), rnd.choice(words))
+                filler = f"{filler} {sentence} ."
+            f_out.write(filler + "\n")
+
+
+def prepare(work_dir, n_pairs, n_words, corpus_lines, layers, hidden, seed=0):
+    """ modelo, dataset e corpus sintéticos em work_dir (reaproveitados se já existirem) """
+    words = synthetic_words(n_words, seed)
+    model_path = os.path.join(work_dir, f"tiny-bert-{n_words}w-{layers}l-{hidden}h")
+    if not os.path.isfile(os.path.join(model_path, "config.json")):
+        build_tiny_bert(model_path, words, hidden=hidden, layers=layers, heads=max(1, hidden // 16),
+                        intermediate=hidden * 4, seed=seed)
+    dataset_path = os.path.join(work_dir, "datasets", f"synthetic-{n_pairs}.tsv")
+    if not os.path.isfile(dataset_path):
+        write_dataset(synthetic_dataset(words, n_pairs, seed), dataset_path)
+    corpus_path = os.path.join(work_dir, f"corpus-{corpus_lines}.txt")
+    if not os.path.isfile(corpus_path):
+        synthetic_corpus(words, corpus_path, corpus_lines, ALL_PATTERNS, seed)
+    return model_path, dataset_path, corpus_path
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ForwardMeter:
+    """ conta forwards, sentenças e tokens e soma o tempo dentro do modelo com hooks """
+
+    def __init__(self, model):
+        self.forwards = 0
+        self.sentences = 0
+        self.tokens = 0
+        self.seconds = 0.0
+        self._t0 = None
+        self.handles = [model.register_forward_pre_hook(self._pre, with_kwargs=True),
+                        model.register_forward_hook(self._post)]
+
+    def _pre(self, module, args, kwargs):
+        input_ids = args[0] if args else kwargs.get("input_ids")
+        if input_ids is not None:
+            self.sentences += input_ids.shape[0]
+            self.tokens += input_ids.numel()
+        self._t0 = time.perf_counter()
+
+    def _post(self, module, args, output):
+        self.seconds += time.perf_counter() - self._t0
+        self.forwards += 1
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+
+
+def score_call(cloze, mode, patterns, dataset, pack_tokens=128):
+    if mode == "bert_score":
+        return cloze.bert_sentence_score(patterns, dataset, [], [])
+    if mode == "bert_score_2":
+        return cloze.bert_sentence_score_2(patterns, dataset, [], [])
+    if mode == "logsoftmax":
+        return cloze.sentence_score(patterns, dataset, [], [])[0]
+    if mode in ("batched", "batched_2"):
+        import scoring
+        return scoring.score(cloze, dataset, patterns, "bert_score" if mode == "batched" else "bert_score_2")
+    if mode in ("packed", "packed_2"):
+        import scoring
+        return scoring.score(cloze, dataset, patterns, "bert_score" if mode == "packed" else "bert_score_2",
+                             pack_tokens=pack_tokens)
+    if mode == "bert2_score":
+        return cloze.bert_sentence_score(patterns, dataset)
+    if mode == "bert2_sep_comb":
+        return cloze.bert_sentence_score_multi_pattern(patterns, dataset)
+    if mode == "bert2_dot_comb":
+        return cloze.bert_sentence_score_multi_pattern_one_sentence(patterns, dataset)
+    raise ValueError(mode)
+
+
+def bench_score(options):
+    import importlib
+
+    import torch
+    torch.set_num_threads(options["threads"])
+    module_name, n_patterns = SCORE_MODES[options["mode"]]
+    from dataset_index import load_eval_file
+    from instrumentation import METRICS
+    with open(options["dataset"], encoding="utf-8") as f_in:
+        dataset = load_eval_file(f_in)
+    patterns = options["patterns"][:n_patterns] if n_patterns else options["patterns"]
+
+    t = time.perf_counter()
+    ClozeBert = importlib.import_module(module_name).ClozeBert
+    cloze = ClozeBert(options["model"], fast_tokenizer=options["fast_tokenizer"])
+    load_seconds = time.perf_counter() - t
+
+    t = time.perf_counter()
+    cloze.prepare_words(dataset)
+    tokenize_seconds = time.perf_counter() - t
+
+    meter = ForwardMeter(cloze.model)
+    t = time.perf_counter()
+    result = score_call(cloze, options["mode"], patterns, dataset, options.get("pack_tokens", 128))
+    score_seconds = time.perf_counter() - t
+    meter.remove()
+    seconds = tokenize_seconds + score_seconds
+    return {"pairs": len(result), "patterns": len(patterns), "seconds": seconds,
+            "pairs_per_s": len(result) / seconds, "forwards": meter.forwards,
+            "forwards_per_s": meter.forwards / seconds, "sentences": meter.sentences,
+            "sentences_per_s": meter.sentences / seconds, "tokens": meter.tokens,
+            "stages": {"load": load_seconds, "tokenize": tokenize_seconds, "forward": meter.seconds,
+                       "other": score_seconds - meter.seconds},
+            "instrumentation": METRICS.report()}
+
+
+def fake_result(dataset, patterns, seed=0):
+    """ resultado no formato do bert_sentence_score com scores aleatórios (sem modelo) """
+    rnd = random.Random(seed)
+    result = {}
+    for row in dataset:
+        n_hypo, n_hyper = rnd.randint(1, 3), rnd.randint(1, 3)
+        result[" ".join(row)] = {p: [[rnd.gauss(-5, 2) for _ in range(n_hypo)], [rnd.gauss(-5, 2) for _ in range(n_hyper)]]
+                                 for p in patterns}
+    return result
+
+
+def bench_eval(options):
+    import importlib.util
+
+    from dataset_index import load_eval_file
+    with open(options["dataset"], encoding="utf-8") as f_in:
+        dataset = load_eval_file(f_in)
+    patterns = options["patterns"]
+    result = fake_result(dataset, patterns)
+    stages = {}
+    if options["mode"] == "output2":
+        spec = importlib.util.spec_from_file_location("bert_eval", os.path.join(os.path.dirname(__file__),
+                                                                                "bert-eval.py"))
+        bert_eval = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(bert_eval)
+        logging.getLogger("bert_eval").setLevel(logging.WARNING)
+        t = time.perf_counter()
+        with open(os.devnull, mode="w") as f_out:
+            bert_eval.output2(result, "synthetic", "tiny", f_out, patterns, "bench")
+        stages["output2"] = time.perf_counter() - t
+    elif options["mode"] == "nb_utils":
+        import nb_utils
+        t = time.perf_counter()
+        df = nb_utils.create_dataframe(result, separator=" ")
+        stages["create_dataframe"] = time.perf_counter() - t
+        t = time.perf_counter()
+        nb_utils.compute_dataframe_AP_by_pattern(df, "bert_soma_total", patterns)
+        stages["AP_by_pattern"] = time.perf_counter() - t
+        t = time.perf_counter()
+        nb_utils.compute_AP_by_rank(df, "bert_soma_total", patterns)
+        stages["AP_by_rank"] = time.perf_counter() - t
+    else:
+        raise ValueError(options["mode"])
+    seconds = sum(stages.values())
+    return {"pairs": len(result), "patterns": len(patterns), "seconds": seconds,
+            "pairs_per_s": len(result) / seconds, "stages": stages}
+
+
+def word_frequency(path, stopwords=(), encoding="utf-8"):
+    """ a contagem do processing-ukwac.py: minúsculas, sem stopwords, só palavras alfabéticas """
+    counter = Counter()
+    with open(path, encoding=encoding) as f:
+        for line in f:
+            if not line.startswith("CURRENT URL"):
+                counter.update(w for w in line.lower().split() if w not in stopwords and w.isalpha())
+    return counter
+
+
+def bench_corpus(options):
+    import hearst_miner
+    size_mb = os.path.getsize(options["corpus"]) / (1 << 20)
+    with open(options["corpus"], encoding="utf-8") as f:
+        n_lines = sum(1 for _ in f)
+    t = time.perf_counter()
+    if options["mode"] == "hearst":
+        logging.getLogger("hearst_miner").setLevel(logging.WARNING)
+        counts = hearst_miner.mine([options["corpus"]], ALL_PATTERNS, workers=options["workers"])
+        rows = hearst_miner.aggregate(counts)
+        items = len(rows)
+    elif options["mode"] == "word_frequency":
+        items = len(word_frequency(options["corpus"]))
+    else:
+        raise ValueError(options["mode"])
+    seconds = time.perf_counter() - t
+    return {"lines": n_lines, "items": items, "seconds": seconds, "lines_per_s": n_lines / seconds,
+            "mb_per_s": size_mb / seconds, "stages": {options["mode"]: seconds}}
+
+
+def _run_one(benchmark, options, queue):
+    function = {"score": bench_score, "eval": bench_eval, "corpus": bench_corpus}[benchmark]
+    try:
+        result = function(options)
+        result["peak_rss_mb"] = peak_rss_mb()
+        queue.put(result)
+    except Exception as e:
+        queue.put(e)
+        raise
+
+
+def run_isolated(benchmark, options):
+    """ roda o benchmark num interpretador novo (spawn) e devolve as medidas """
+    # spawn e não fork: o filho herdaria o pico de memória do pai (que construiu o modelo); e não é daemon
+    # porque o hearst_miner cria o próprio Pool
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_one, args=(benchmark, options, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def packing_parity(model_path, dataset_path, patterns, pack_tokens, fast_tokenizer=False):
+    """ maior diferença absoluta entre os scores com e sem empacotamento, por modo """
+    import scoring
+    from bert_portuguese import ClozeBert, load_eval_file
+
+    with open(dataset_path, encoding="utf-8") as f_in:
+        dataset = load_eval_file(f_in)
+    # par cujas palavras não têm wordpieces no meio do dataset: tem de sair na ordem, com listas vazias
+    middle = len(dataset) // 2
+    dataset = dataset[:middle] + [["\u200b", "\u200b", "False", "random"]] + dataset[middle:]
+    keys = list(dict.fromkeys(" ".join(row) for row in dataset))
+    cloze = ClozeBert(model_path, fast_tokenizer=fast_tokenizer)
+    cloze.prepare_words(dataset)
+    diffs = {}
+    for mode in scoring.MODES:
+        batched = scoring.score(cloze, dataset, patterns, mode)
+        packed = scoring.score(cloze, dataset, patterns, mode, pack_tokens=pack_tokens)
+        if list(batched) != keys or list(packed) != keys:
+            raise AssertionError(f"{mode}: pares perdidos ou fora de ordem (pack_tokens={pack_tokens})")
+        diffs[mode] = max(abs(x - y) for key in batched for pattern in patterns for role in (0, 1)
+                          for x, y in zip(batched[key][pattern][role], packed[key][pattern][role]))
+    return diffs
+
+
+def packing(args):
+    """ igualdade dos scores e vazão com e sem empacotamento; devolve False se algum modo diverge """
+    model_path, dataset_path, _ = prepare(args.work_dir, args.pairs, args.n_words, args.corpus_lines, args.layers,
+                                          args.hidden, args.seed)
+    patterns = PATTERN_SETS[args.patterns]
+    equal = True
+    for pack_tokens in args.pack_tokens:
+        for mode, diff in packing_parity(model_path, dataset_path, patterns, pack_tokens,
+                                         args.fast_tokenizer).items():
+            equal = equal and diff <= args.tolerance
+            logger.info(f"pack_tokens={pack_tokens} {mode}: diferença máxima {diff:.2e}"
+                        f"{'' if diff <= args.tolerance else ' (acima de --tolerance)'}")
+    args.only, args.modes = ["score"], ["batched", "batched_2", "packed", "packed_2"]
+    for pack_tokens in args.pack_tokens:
+        run_id = run(args, pack_tokens)
+        records = load_runs(args.results)[run_id]
+        for mode in ("", "_2"):
+            batched, packed = records[("score", "batched" + mode)], records[("score", "packed" + mode)]
+            logger.info(f"pack_tokens={pack_tokens} bert_score{mode}: {batched['pairs_per_s']:.1f} -> "
+                        f"{packed['pairs_per_s']:.1f} pares/s (x{packed['pairs_per_s'] / batched['pairs_per_s']:.2f})"
+                        f", {batched['tokens']} -> {packed['tokens']} tokens com padding")
+    return equal
+
+
+def run(args, pack_tokens=None):
+    model_path, dataset_path, corpus_path = prepare(args.work_dir, args.pairs, args.n_words, args.corpus_lines,
+                                                    args.layers, args.hidden, args.seed)
+    patterns = PATTERN_SETS[args.patterns]
+    run_id = time.strftime("%Y%m%d-%H%M%S")
+    base = {"run_id": run_id, "date": time.strftime("%Y-%m-%d %H:%M:%S"), "host": socket.gethostname(),
+            "commit": git_commit(), "python": platform.python_version(), "cpus": os.cpu_count(),
+            "threads": args.threads, "model": {"layers": args.layers, "hidden": args.hidden, "words": args.n_words}}
+    tasks = []
+    for benchmark in args.only or BENCHMARKS:
+        if benchmark == "score":
+            for mode in args.modes or list(SCORE_MODES):
+                tasks.append((benchmark, {"mode": mode, "model": model_path, "dataset": dataset_path,
+                                          "patterns": patterns, "threads": args.threads,
+                                          "fast_tokenizer": args.fast_tokenizer,
+                                          "pack_tokens": pack_tokens or args.pack_tokens[0]}))
+        elif benchmark == "eval":
+            for mode in ["output2", "nb_utils"]:
+                tasks.append((benchmark, {"mode": mode, "dataset": dataset_path, "patterns": patterns}))
+        else:
+            for mode in ["hearst", "word_frequency"]:
+                tasks.append((benchmark, {"mode": mode, "corpus": corpus_path, "workers": args.threads}))
+
+    with open(args.results, mode="a", encoding="utf-8") as f_out:
+        for benchmark, options in tasks:
+            result = run_isolated(benchmark, options)
+            record = {**base, "benchmark": benchmark, "mode": options["mode"], **result}
+            if options["mode"].startswith("packed"):
+                record["pack_tokens"] = options["pack_tokens"]
+            f_out.write(json.dumps(record) + "\n")
+            f_out.flush()
+            rate = f"{result['pairs_per_s']:.1f} pares/s" if "pairs_per_s" in result else \
+                f"{result['lines_per_s']:.0f} linhas/s"
+            logger.info(f"{benchmark} {options['mode']}: {result['seconds']:.2f}s, {rate}, "
+                        f"pico {result['peak_rss_mb']:.0f} MB")
+    logger.info(f"Rodada {run_id} em {args.results}")
+    return run_id
+
+
+def load_runs(path):
+    runs = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                runs.setdefault(record["run_id"], {})[(record["benchmark"], record["mode"])] = record
+    return runs
+
+
+def compare(path, base=None, run_id=None, threshold=0.1, f_out=sys.stdout):
+    """ vazão e pico de memória de uma rodada contra outra; devolve as regressões acima de threshold """
+    runs = load_runs(path)
+    order = sorted(runs)
+    run_id = run_id or order[-1]
+    base = base or (order[order.index(run_id) - 1] if order.index(run_id) > 0 else run_id)
+    regressions = []
+    f_out.write(f"base={base} run={run_id}\n")
+    f_out.write("benchmark\tmode\tmetric\tbase\trun\tratio\n")
+    for key, record in sorted(runs[run_id].items()):
+        if key not in runs[base]:
+            continue
+        old = runs[base][key]
+        metric = "pairs_per_s" if "pairs_per_s" in record else "lines_per_s"
+        for name, higher_is_better in [(metric, True), ("peak_rss_mb", False)]:
+            ratio = record[name] / old[name] if old[name] else float("nan")
+            f_out.write(f"{key[0]}\t{key[1]}\t{name}\t{old[name]:.2f}\t{record[name]:.2f}\t{ratio:.3f}\n")
+            if (higher_is_better and ratio < 1 - threshold) or (not higher_is_better and ratio > 1 + threshold):
+                regressions.append((key, name, ratio))
+    return regressions
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["run", "compare", "packing"])
+    parser.add_argument("-r", "--results", type=str, help="json lines file with the results", required=True)
+    parser.add_argument("-w", "--work_dir", type=str, help="dir for the synthetic model, datasets and corpus",
+                        default="work/bench")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="default: all")
+    parser.add_argument("--modes", nargs="+", choices=list(SCORE_MODES), help="scoring modes (default: all)")
+    parser.add_argument("--pairs", type=int, default=200)
+    parser.add_argument("--patterns", choices=list(PATTERN_SETS), default="en_best")
+    parser.add_argument("--n_words", type=int, default=2000, help="synthetic words in the vocab")
+    parser.add_argument("--corpus_lines", type=int, default=100000)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--hidden", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=1, help="torch threads / miner workers")
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--base", type=str, help="run_id to compare against (compare)")
+    parser.add_argument("--run", type=str, help="run_id to compare (compare, default: the last one)")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    parser.add_argument("--pack_tokens", type=int, nargs="+", default=[128],
+                        help="row size of the packed modes (packing: one run per size)")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="largest score difference accepted (packing)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    elif args.command == "packing":
+        sys.exit(0 if packing(args) else 1)
+    else:
+        regressions = compare(args.results, args.base, args.run, args.threshold)
+        for (benchmark, mode), name, ratio in regressions:
+            logger.warning(f"regressão em {benchmark} {mode}: {name} x{ratio:.2f}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,4 @@
 import datetime
-from transformers import BertConfig, BertForMaskedLM, BertTokenizer
 import torch
 import logging
 import argparse
@@ -7,11 +6,19 @@ import json
 import os
 import itertools
 
+import instrumentation
+from autotune import apply_profile
+from dataset_index import dataset_files
+from hearst_patterns import ALL_EN_PATTERNS, ALL_PATTERNS, EN_BEST_PATTERNS, HYPENET_BEST_PATTERNS
+from instrumentation import METRICS
+from snapshot import is_snapshot, load_snapshot
+from wordpiece_table import batch_tokenize, load_tokenizer
+
 logger = logging.getLogger(__name__)
 
 
 class ClozeBert:
-    def __init__(self, model_name):
+    def __init__(self, model_name, fast_tokenizer=False):
         logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
                             datefmt='%m/%d/%Y %H:%M:%S',
                             level=logging.INFO)
@@ -20,21 +27,37 @@ class ClozeBert:
         else:
             self.device = torch.device('cpu')
 
-        self.config = BertConfig.from_pretrained(model_name)
-        self.tokenizer = BertTokenizer.from_pretrained(model_name, do_lower_case=model_name.endswith("-uncased"))
-        self.model = BertForMaskedLM.from_pretrained(model_name, config=self.config)
+        # ids das palavras do dataset atual, tokenizadas em lote por prepare_words
+        self.word_cache = {}
+        if is_snapshot(model_name):
+            self.config, self.tokenizer, self.model = load_snapshot(model_name, fast_tokenizer)
+        else:
+            from transformers import BertConfig, BertForMaskedLM
+            self.config = BertConfig.from_pretrained(model_name)
+            self.tokenizer = load_tokenizer(model_name, fast_tokenizer)
+            self.model = BertForMaskedLM.from_pretrained(model_name, config=self.config)
         self.model.to(self.device)
 
+    def word_ids(self, word):
+        if word in self.word_cache:
+            return list(self.word_cache[word])
+        return self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(word))
+
+    def prepare_words(self, dataset, batch_size=2048):
+        words = [w for w in dict.fromkeys(w for row in dataset for w in row[:2]) if w not in self.word_cache]
+        for word, ids in zip(words, batch_tokenize(self.tokenizer, words, batch_size)):
+            self.word_cache[word] = ids
+
     def most_probabable_words(self, texts):
         words_probs_s = []
         for text in texts:
-            logger.info("Tokenizing...")
+            logger.debug("Tokenizing...")
             tokenized_text = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(text))
             example = self.tokenizer.build_inputs_with_special_tokens(tokenized_text)
 
             idx_mask = example.index(self.tokenizer.mask_token_id)
 
-            logger.info("Predicting...")
+            logger.debug("Predicting...")
             self.model.eval()
             with torch.no_grad():
                 examples = torch.tensor([example], device=self.device)
@@ -43,10 +66,10 @@ class ClozeBert:
             # outputs shape is (batch_example, words, scores).
             probs_mask = outputs[0, idx_mask]
 
-            logger.info("Zipping...")
+            logger.debug("Zipping...")
             words_probs = zip(probs_mask, self.tokenizer.vocab.keys())
 
-            logger.info("Sorting...")
+            logger.debug("Sorting...")
             # pair words with their scores (score, word) and sort them by score
             words_probs = sorted(words_probs, reverse=True)
 
@@ -55,32 +78,48 @@ class ClozeBert:
         return words_probs_s
 
     def bert_sentence_score(self, patterns, dataset):
+        stats = METRICS.mode("bert2_score")
+        progress = stats.progress(len(dataset))
+        with stats.time("tokenize"):
+            self.prepare_words(dataset)
         words_probs_s = {}
         for row in dataset:
             pair = row[0:2]
             words_probs_s["\t".join(row)] = {}
             for pattern in patterns:
-                sentences, hyponym_idx, hypernym_idx, idx_mask = self.build_sentences_n_subtoken(pattern, pair)
+                with stats.time("build"):
+                    sentences, hyponym_idx, hypernym_idx, idx_mask = self.build_sentences_n_subtoken(pattern, pair)
                 idx_all = hyponym_idx + hypernym_idx
-                logger.info("Predicting...")
+                logger.debug("Predicting...")
                 self.model.eval()
                 with torch.no_grad():
-                    examples = torch.tensor(sentences, device=self.device)
+                    with stats.time("tensor"):
+                        examples = torch.tensor(sentences, device=self.device)
                     # segments_tensors = torch.tensor([segments_ids])
-                    outputs = self.model(examples)  # , segments_tensors)
+                    with stats.time("forward"), METRICS.profile("bert2_score"):
+                        outputs = self.model(examples)  # , segments_tensors)
                 predict = outputs[0]
-                predict = predict[torch.arange(len(sentences), device=self.device), idx_mask, idx_all]
+                with stats.time("gather"):
+                    predict = predict[torch.arange(len(sentences), device=self.device), idx_mask, idx_all]
 
                 predict_hypon = predict[:len(hyponym_idx)]
                 predict_hyper = predict[-len(hypernym_idx):]
 
-                words_probs_s["\t".join(row)][pattern] = []
-                words_probs_s["\t".join(row)][pattern].append(predict_hypon.cpu().numpy().tolist())
-                words_probs_s["\t".join(row)][pattern].append(predict_hyper.cpu().numpy().tolist())
-
+                with stats.time("copy"):
+                    words_probs_s["\t".join(row)][pattern] = []
+                    words_probs_s["\t".join(row)][pattern].append(predict_hypon.cpu().numpy().tolist())
+                    words_probs_s["\t".join(row)][pattern].append(predict_hyper.cpu().numpy().tolist())
+                stats.count("forwards")
+                stats.count("sentences", len(sentences))
+            progress.update()
+        progress.finish()
         return words_probs_s
 
     def bert_sentence_score_multi_pattern_one_sentence(self, patterns, dataset):
+        stats = METRICS.mode("bert2_dot_comb")
+        progress = stats.progress(len(dataset))
+        with stats.time("tokenize"):
+            self.prepare_words(dataset)
         perm_pattern = []
         for i in range(2, len(patterns) + 1):
             tmp_p = list(map(list, itertools.permutations(patterns, r=i)))
@@ -90,56 +129,72 @@ class ClozeBert:
             pair = row[0:2]
             words_probs_s["\t".join(row)] = {}
             for pattern_list in perm_pattern:
-                sentences, hyponym_idx, hypernym_idx, idx_mask, idx_all = self.build_sentences_n_subtoken_multi_pattern_one_sentence(
-                    pattern_list, pair)
+                with stats.time("build"):
+                    sentences, hyponym_idx, hypernym_idx, idx_mask, idx_all = self.build_sentences_n_subtoken_multi_pattern_one_sentence(
+                        pattern_list, pair)
                 segments_ids = [0] * len(sentences[0])
-                logger.info("Predicting...")
+                logger.debug("Predicting...")
                 self.model.eval()
                 with torch.no_grad():
-                    examples = torch.tensor(sentences, device=self.device)
-                    segments_tensors = torch.tensor(segments_ids, device=self.device)
+                    with stats.time("tensor"):
+                        examples = torch.tensor(sentences, device=self.device)
+                        segments_tensors = torch.tensor(segments_ids, device=self.device)
                     # segments_tensors = torch.tensor([segments_ids])
-                    outputs = self.model(examples, token_type_ids=segments_tensors)  # , segments_tensors)
+                    with stats.time("forward"), METRICS.profile("bert2_dot_comb"):
+                        outputs = self.model(examples, token_type_ids=segments_tensors)  # , segments_tensors)
                 predict = outputs[0]
-                predict = predict[torch.arange(len(sentences), device=self.device), idx_mask, idx_all]
+                with stats.time("gather"):
+                    predict = predict[torch.arange(len(sentences), device=self.device), idx_mask, idx_all]
 
                 hypo = predict[:len(hyponym_idx)]
                 hyper = predict[len(hyponym_idx):len(hyponym_idx) + len(hypernym_idx) - 1]
                 rest_hyper = predict[len(hyponym_idx) + len(hypernym_idx) - 1:]
 
-                hypo = hypo.cpu().numpy().tolist()
-                hyper = hyper.cpu().numpy().tolist()
-                rest_hyper = rest_hyper.sum().cpu().numpy().item()
+                with stats.time("copy"):
+                    hypo = hypo.cpu().numpy().tolist()
+                    hyper = hyper.cpu().numpy().tolist()
+                    rest_hyper = rest_hyper.sum().cpu().numpy().item()
 
                 hyper = hyper + [rest_hyper]
 
                 words_probs_s["\t".join(row)]["_".join(pattern_list)] = []
                 words_probs_s["\t".join(row)]["_".join(pattern_list)].append(hypo)
                 words_probs_s["\t".join(row)]["_".join(pattern_list)].append(hyper)
-
+                stats.count("forwards")
+                stats.count("sentences", len(sentences))
+            progress.update()
+        progress.finish()
         return words_probs_s
 
     def bert_sentence_score_multi_pattern(self, patterns, dataset):
+        stats = METRICS.mode("bert2_sep_comb")
+        progress = stats.progress(len(dataset))
+        with stats.time("tokenize"):
+            self.prepare_words(dataset)
         perm_pattern = list(map(list, itertools.permutations(patterns, r=2)))
         words_probs_s = {}
         for row in dataset:
             pair = row[0:2]
             words_probs_s["\t".join(row)] = {}
             for pattern in perm_pattern:
-                sentences, hyponym_idx, hypernym_idx, idx_mask, segments_ids = self.build_sentences_n_subtoken_multi_pattern(
-                    pattern,
-                    pair)
+                with stats.time("build"):
+                    sentences, hyponym_idx, hypernym_idx, idx_mask, segments_ids = self.build_sentences_n_subtoken_multi_pattern(
+                        pattern,
+                        pair)
                 idx_all = hyponym_idx + hypernym_idx
                 idx_all = idx_all * 2
-                logger.info("Predicting...")
+                logger.debug("Predicting...")
                 self.model.eval()
                 with torch.no_grad():
-                    examples = torch.tensor(sentences, device=self.device)
-                    segments_tensors = torch.tensor(segments_ids, device=self.device)
+                    with stats.time("tensor"):
+                        examples = torch.tensor(sentences, device=self.device)
+                        segments_tensors = torch.tensor(segments_ids, device=self.device)
                     # segments_tensors = torch.tensor([segments_ids])
-                    outputs = self.model(examples, token_type_ids=segments_tensors)  # , segments_tensors)
+                    with stats.time("forward"), METRICS.profile("bert2_sep_comb"):
+                        outputs = self.model(examples, token_type_ids=segments_tensors)  # , segments_tensors)
                 predict = outputs[0]
-                predict = predict[torch.arange(len(sentences), device=self.device), idx_mask, idx_all]
+                with stats.time("gather"):
+                    predict = predict[torch.arange(len(sentences), device=self.device), idx_mask, idx_all]
 
                 size = 0
                 hipo_1stsen = predict[size:len(hyponym_idx)]
@@ -151,18 +206,22 @@ class ClozeBert:
                 hiper_2ndsen = predict[size:size + len(hypernym_idx)]
 
                 # [[hipo 1st sen], [hipo 2nd sen], [hyper 1st sen], [hyper 2nd sen]]
-                words_probs_s["\t".join(row)]["_".join(pattern)] = []
-                words_probs_s["\t".join(row)]["_".join(pattern)].append(hipo_1stsen.cpu().numpy().tolist())
-                words_probs_s["\t".join(row)]["_".join(pattern)].append(hipo_2ndsen.cpu().numpy().tolist())
-                words_probs_s["\t".join(row)]["_".join(pattern)].append(hiper_1stsen.cpu().numpy().tolist())
-                words_probs_s["\t".join(row)]["_".join(pattern)].append(hiper_2ndsen.cpu().numpy().tolist())
-
+                with stats.time("copy"):
+                    words_probs_s["\t".join(row)]["_".join(pattern)] = []
+                    words_probs_s["\t".join(row)]["_".join(pattern)].append(hipo_1stsen.cpu().numpy().tolist())
+                    words_probs_s["\t".join(row)]["_".join(pattern)].append(hipo_2ndsen.cpu().numpy().tolist())
+                    words_probs_s["\t".join(row)]["_".join(pattern)].append(hiper_1stsen.cpu().numpy().tolist())
+                    words_probs_s["\t".join(row)]["_".join(pattern)].append(hiper_2ndsen.cpu().numpy().tolist())
+                stats.count("forwards")
+                stats.count("sentences", len(sentences))
+            progress.update()
+        progress.finish()
         return words_probs_s
 
     def build_sentences_n_subtoken_multi_pattern(self, patterns, pair):
-        logger.info("Tokenizing...")
-        hyponym_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[0]))
-        hypernym_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[1]))
+        logger.debug("Tokenizing...")
+        hyponym_tokenize = self.word_ids(pair[0])
+        hypernym_tokenize = self.word_ids(pair[1])
         pattern_tokenize1 = self.tokenizer.convert_tokens_to_ids(
             self.tokenizer.tokenize(patterns[0].format("", "").strip()))
         pattern_tokenize2 = self.tokenizer.convert_tokens_to_ids(
@@ -221,9 +280,9 @@ class ClozeBert:
         return sentences, hyponym_tokenize, hypernym_tokenize, idx, seg0 + seg1
 
     def build_sentences_n_subtoken_multi_pattern_one_sentence(self, patterns_list, pair):
-        logger.info("Tokenizing...")
-        hyponym_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[0]))
-        hypernym_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[1]))
+        logger.debug("Tokenizing...")
+        hyponym_tokenize = self.word_ids(pair[0])
+        hypernym_tokenize = self.word_ids(pair[1])
         dot_token = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize("."))
 
         patterns_tokenize = []
@@ -269,9 +328,9 @@ class ClozeBert:
         return sentences, hyponym_tokenize, hypernym_tokenize, idx_sentence, idx_all
 
     def build_sentences_n_subtoken(self, pattern, pair):
-        logger.info("Tokenizing...")
-        hyponym_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[0]))
-        hypernym_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[1]))
+        logger.debug("Tokenizing...")
+        hyponym_tokenize = self.word_ids(pair[0])
+        hypernym_tokenize = self.word_ids(pair[1])
         pattern_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pattern.format("", "").strip()))
         sentences = []
 
@@ -316,10 +375,11 @@ def save_bert_file(dict_values, output, dataset_name, model_name, hyper_num, oov
     f_info_out.write(f'{model_name}\t{dataset_name}\t{len(dict_values)}\t{oov_num}\t{hyper_num}\t{include_oov}\n')
     logger.info("save json...")
     dname = os.path.splitext(dataset_name)[0]
-    fjson = json.dumps(dict_values, ensure_ascii=False)
-    f = open(os.path.join(output, save_json, dname + ".json"), mode="w", encoding="utf-8")
-    f.write(fjson)
-    f.close()
+    with METRICS.current().time("serialize"):
+        fjson = json.dumps(dict_values, ensure_ascii=False)
+        f = open(os.path.join(output, save_json, dname + ".json"), mode="w", encoding="utf-8")
+        f.write(fjson)
+        f.close()
 
 
 def main():
@@ -328,6 +388,10 @@ def main():
     parser.add_argument("-e", "--eval_path", type=str, help="path to datasets", required=True)
     parser.add_argument("-o", "--output_path", type=str, help="path to dir output", required=False)
 
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    parser.add_argument("-i", "--index", type=str, required=False,
+                        help="index.json of dataset_index.py: score only the deduplicated union of the datasets")
+
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-l", "--logsoftmax", action="store_true")
     group.add_argument("-z", "--zscore", action="store_true")
@@ -335,9 +399,15 @@ def main():
     group.add_argument("--bert_score_dot_comb", action="store_true")
     group.add_argument("--bert_score_sep_comb", action="store_true")
     group.add_argument("--bert_score", action="store_true")
+    parser.add_argument("--no_profile", action="store_true", help="ignore the host profile of autotune.py")
+    instrumentation.add_arguments(parser)
     args = parser.parse_args()
+    instrumentation.configure(args)
     print("Iniciando bert...")
-    cloze_model = ClozeBert(args.model_name)
+    cloze_model = ClozeBert(args.model_name, args.fast_tokenizer)
+    if not args.no_profile:
+        # threads do perfil da máquina (autotune.py)
+        apply_profile(args.model_name, "bert_score")
     try:
         if args.bert_score_sep_comb:
             dir_name = "bert_score_sep_comb"
@@ -364,34 +434,10 @@ def main():
     f_out = open(os.path.join(args.output_path, dir_name, "info.tsv"), mode="a")
     f_out.write("model\tdataset\tN\toov\thyper_num\tinclude_oov\n")
 
-    patterns = ["{} é um tipo de {}", "{} é um {}", "{} e outros {}", "{} ou outro {}", "{} , um {}"]
-    en_patterns = ["{} is a type of {}", "{} is a {}", "{} and others {}", "{} or others {}", "{} , a {}"]
-
-    # 2018 RoolerEtal - Hearst Patterns Revisited
-    patterns2 = ["{} que é um exemplo de {}", "{} que é uma classe de {}", "{} que é um tipo de {}",
-                 "{} e qualquer outro {}", "{} e algum outro {}", "{} ou qualquer outro {}", "{} ou algum outro {}",
-                 "{} que é chamado de {}",
-                 "{} é um caso especial de {}",
-                 "{} incluindo {}"]
-
-    en_pattern2 = ["{} which is a example of {}", "{} which is a class of {}", "{} which is kind of {}",
-                   "{} and any other {}", "{} and some other {}", "{} or any other {}", "{} or some other {}",
-                   "{} which is called {}",
-                   "{} a special case of {}",
-                   "{} including {}"]
-
-    patterns.extend(patterns2)
-    en_patterns.extend(en_pattern2)
-
-    en_best_patterns = ['{} or some other {}', '{} or any other {}', '{} and any other {}', '{} is a type of {}',
-                        '{} and some other {}', '{} which is kind of {}', '{} a special case of {}', '{} is a {}',
-                        '{} which is a example of {}', '{} and others {}', '{} which is called {}',
-                        '{} which is a class of {}', '{} or others {}', '{} , a {}', '{} including {}']
-
-    hypeNet_best_patterns = ['{} or some other {}', '{} or any other {}', '{} and any other {}', '{} is a type of {}',
-                             '{} which is kind of {}', '{} and some other {}', '{} is a {}', '{} a special case of {}',
-                             '{} which is a example of {}', '{} and others {}', '{} which is called {}',
-                             '{} or others {}', '{} which is a class of {}', '{} , a {}', '{} including {}']
+    patterns = list(ALL_PATTERNS)
+    en_patterns = list(ALL_EN_PATTERNS)
+    en_best_patterns = EN_BEST_PATTERNS
+    hypeNet_best_patterns = HYPENET_BEST_PATTERNS
 
     pairs = [['tigre', 'animal', 'True', 'hyper'], ['casa', 'moradia', 'True', 'hyper'],
              ['banana', 'abacate', 'False', 'random']]
@@ -424,9 +470,9 @@ def main():
     # print(args)
     # f_out.close()
     comb_n_best = 4
-    for file_dataset in os.listdir(args.eval_path):
-        if os.path.isfile(os.path.join(args.eval_path, file_dataset)):
-            with open(os.path.join(args.eval_path, file_dataset)) as f_in:
+    for file_dataset, path_dataset in dataset_files(args.eval_path, args.index):
+        if os.path.isfile(path_dataset):
+            with open(path_dataset) as f_in:
                 logger.info("Loading dataset ...")
                 eval_data = load_eval_file(f_in)
                 if args.bert_score_dot_comb:
@@ -455,6 +501,8 @@ def main():
                                oov_num, f_out, dir_name, True)
                 logger.info(f"result_size={len(result)}")
     f_out.close()
+    if args.metrics:
+        METRICS.dump(args.metrics)
     logger.info("Done")
     print("Done!")
 
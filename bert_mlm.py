@@ -0,0 +1,187 @@
+"""
+BertForMaskedLM só com torch, para carregar snapshots (snapshot.py) sem importar o transformers.
+
+Os nomes dos módulos são os mesmos do transformers (bert.embeddings..., bert.encoder.layer.N..., cls.predictions...),
+então o state_dict do BertForMaskedLM entra direto e o resto do código (truncated_depth.py, hooks na cabeça MLM)
+funciona igual. Só inferência: sem dropout, sem cache, sem cross-attention.
+"""
+import math
+from collections import namedtuple
+from types import SimpleNamespace
+
+import torch
+import torch.nn.functional as f
+from torch import nn
+
+EncoderOutput = namedtuple("EncoderOutput", ["last_hidden_state", "hidden_states"])
+
+ACTIVATIONS = {"gelu": f.gelu, "relu": f.relu, "gelu_new": lambda x: f.gelu(x, approximate="tanh")}
+
+
+def embedding(n, size):
+    # pesos vazios: vêm todos do state_dict, e o normal_ do reset_parameters no device meta custa ~1.5s de import
+    return nn.Embedding(n, size, _weight=torch.empty(n, size))
+
+
+class Embeddings(nn.Module):
+    def __init__(self, config):
+        super().__init__()
+        self.word_embeddings = embedding(config.vocab_size, config.hidden_size)
+        self.position_embeddings = embedding(config.max_position_embeddings, config.hidden_size)
+        self.token_type_embeddings = embedding(config.type_vocab_size, config.hidden_size)
+        self.LayerNorm = nn.LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
+
+    def forward(self, input_ids, token_type_ids=None, position_ids=None):
+        if position_ids is None:
+            position_ids = torch.arange(input_ids.shape[1], device=input_ids.device).unsqueeze(0)
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+        embeddings = self.word_embeddings(input_ids) + self.position_embeddings(position_ids) + \
+            self.token_type_embeddings(token_type_ids)
+        return self.LayerNorm(embeddings)
+
+
+class SelfAttention(nn.Module):
+    def __init__(self, config):
+        super().__init__()
+        self.n_heads = config.num_attention_heads
+        self.query = nn.Linear(config.hidden_size, config.hidden_size)
+        self.key = nn.Linear(config.hidden_size, config.hidden_size)
+        self.value = nn.Linear(config.hidden_size, config.hidden_size)
+
+    def forward(self, hidden, mask):
+        batch, length, size = hidden.shape
+
+        def heads(x):
+            return x.view(batch, length, self.n_heads, size // self.n_heads).transpose(1, 2)
+
+        context = f.scaled_dot_product_attention(heads(self.query(hidden)), heads(self.key(hidden)),
+                                                 heads(self.value(hidden)), attn_mask=mask,
+                                                 scale=1 / math.sqrt(size // self.n_heads))
+        return context.transpose(1, 2).reshape(batch, length, size)
+
+
+class DenseLayerNorm(nn.Module):
+    def __init__(self, size_in, size_out, eps):
+        super().__init__()
+        self.dense = nn.Linear(size_in, size_out)
+        self.LayerNorm = nn.LayerNorm(size_out, eps=eps)
+
+    def forward(self, hidden, residual):
+        return self.LayerNorm(self.dense(hidden) + residual)
+
+
+class Attention(nn.Module):
+    def __init__(self, config):
+        super().__init__()
+        self.self = SelfAttention(config)
+        self.output = DenseLayerNorm(config.hidden_size, config.hidden_size, config.layer_norm_eps)
+
+    def forward(self, hidden, mask):
+        return self.output(self.self(hidden, mask), hidden)
+
+
+class Intermediate(nn.Module):
+    def __init__(self, config):
+        super().__init__()
+        self.dense = nn.Linear(config.hidden_size, config.intermediate_size)
+        self.act = ACTIVATIONS[config.hidden_act]
+
+    def forward(self, hidden):
+        return self.act(self.dense(hidden))
+
+
+class Layer(nn.Module):
+    def __init__(self, config):
+        super().__init__()
+        self.attention = Attention(config)
+        self.intermediate = Intermediate(config)
+        self.output = DenseLayerNorm(config.intermediate_size, config.hidden_size, config.layer_norm_eps)
+
+    def forward(self, hidden, mask):
+        attention = self.attention(hidden, mask)
+        return self.output(self.intermediate(attention), attention)
+
+
+class Encoder(nn.Module):
+    def __init__(self, config):
+        super().__init__()
+        self.layer = nn.ModuleList([Layer(config) for _ in range(config.num_hidden_layers)])
+
+    def forward(self, hidden, mask, output_hidden_states=False):
+        all_hidden = [hidden]
+        for layer in self.layer:
+            hidden = layer(hidden, mask)
+            if output_hidden_states:
+                all_hidden.append(hidden)
+        return hidden, tuple(all_hidden) if output_hidden_states else None
+
+
+class Bert(nn.Module):
+    def __init__(self, config):
+        super().__init__()
+        self.embeddings = Embeddings(config)
+        self.encoder = Encoder(config)
+
+    def forward(self, input_ids, attention_mask=None, token_type_ids=None, position_ids=None,
+                output_hidden_states=False):
+        mask = None
+        if attention_mask is not None:
+            if attention_mask.dim() == 2:
+                # [batch, len] -> [batch, 1, 1, len], True = pode atender
+                mask = attention_mask[:, None, None, :].bool()
+            elif attention_mask.dim() == 3:
+                # máscara já completa [batch, len, len] (ex.: blocos diagonais)
+                mask = attention_mask[:, None, :, :].bool()
+            else:
+                # [batch, 1, len, len], o formato que o transformers aceita pronto (scoring.py com pack_tokens)
+                mask = attention_mask.bool()
+        hidden = self.embeddings(input_ids, token_type_ids, position_ids)
+        hidden, all_hidden = self.encoder(hidden, mask, output_hidden_states)
+        return EncoderOutput(hidden, all_hidden)
+
+
+class PredictionHead(nn.Module):
+    def __init__(self, config):
+        super().__init__()
+        self.transform = nn.Module()
+        self.transform.dense = nn.Linear(config.hidden_size, config.hidden_size)
+        self.transform.LayerNorm = nn.LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
+        self.act = ACTIVATIONS[config.hidden_act]
+        self.decoder = nn.Linear(config.hidden_size, config.vocab_size)
+        self.bias = nn.Parameter(torch.zeros(config.vocab_size))
+
+    def forward(self, hidden):
+        hidden = self.transform.LayerNorm(self.act(self.transform.dense(hidden)))
+        return self.decoder(hidden)
+
+
+class MLMHead(nn.Module):
+    def __init__(self, config):
+        super().__init__()
+        self.predictions = PredictionHead(config)
+
+    def forward(self, sequence_output):
+        return self.predictions(sequence_output)
+
+
+class BertMLM(nn.Module):
+    """ equivalente ao BertForMaskedLM em inferência; devolve (logits,) """
+
+    def __init__(self, config):
+        super().__init__()
+        self.config = config
+        self.bert = Bert(config)
+        self.cls = MLMHead(config)
+
+    def forward(self, input_ids, attention_mask=None, token_type_ids=None, position_ids=None):
+        hidden = self.bert(input_ids, attention_mask, token_type_ids, position_ids).last_hidden_state
+        return (self.cls(hidden),)
+
+
+def load_config(path):
+    import json
+    with open(path, encoding="utf-8") as f_config:
+        config = json.load(f_config)
+    defaults = {"hidden_act": "gelu", "layer_norm_eps": 1e-12, "type_vocab_size": 2}
+    return SimpleNamespace(**{**defaults, **config})
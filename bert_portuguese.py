@@ -1,4 +1,3 @@
-from transformers import BertConfig, BertForMaskedLM, BertTokenizer, BertModel
 import torch
 import torch.nn.functional as f
 import logging
@@ -10,11 +9,24 @@ import os
 import itertools
 import sys
 
+import instrumentation
+from autotune import apply_profile
+from dataset_index import dataset_files, load_eval_file
+from hearst_patterns import ALL_EN_PATTERNS, ALL_PATTERNS
+from instrumentation import METRICS
+from score_table import ScoreTable
+from scoring import score_table
+from topk_capture import TopKCapture
+from snapshot import is_snapshot, load_snapshot, load_tokenizer_snapshot
+from truncated_depth import load_calibration, set_calibration, set_depth
+from wordpiece_table import DEFAULT_TABLE_ROOT, batch_tokenize, load_or_build, load_tokenizer
+
 logger = logging.getLogger(__name__)
 
 
 class ClozeBert:
-    def __init__(self, model_name, exp=False, oov=True):
+    def __init__(self, model_name, exp=False, oov=True, fast_tokenizer=False, n_layers=None, calibration=None,
+                 load_model=True):
         logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
                             datefmt='%m/%d/%Y %H:%M:%S',
                             level=logging.INFO)
@@ -26,28 +38,72 @@ class ClozeBert:
         else:
             self.device = torch.device('cpu')
 
-        self.config = BertConfig.from_pretrained(model_name)
-        self.tokenizer = BertTokenizer.from_pretrained(model_name, do_lower_case=model_name.endswith("-uncased"))
-
-        # self.tokenizer = BertTokenizer.from_pretrained(model_name + "/vocab.txt", do_lower_case=False)
-        # self.models = BertForMaskedLM.from_pretrained(model_name, config=self.config)
-        self.model = BertForMaskedLM.from_pretrained(model_name, config=self.config)
-        self.model.to(self.device)
+        self.model_name = model_name
+        if not load_model:
+            # só o tokenizer (sweep.py, snapshot.py startup): o modelo pode ser atribuído depois em self.model
+            self.config, self.model = None, None
+            if is_snapshot(model_name):
+                self.tokenizer = load_tokenizer_snapshot(model_name, fast_tokenizer)
+            else:
+                self.tokenizer = load_tokenizer(model_name, fast_tokenizer)
+        elif is_snapshot(model_name):
+            # pesos mapeados do disco e tokenizer já construído (snapshot.py)
+            self.config, self.tokenizer, self.model = load_snapshot(model_name, fast_tokenizer)
+        else:
+            # transformers só é importado aqui: as ferramentas que não carregam o modelo não pagam o import
+            from transformers import BertConfig, BertForMaskedLM
+            self.config = BertConfig.from_pretrained(model_name)
+            self.tokenizer = load_tokenizer(model_name, fast_tokenizer)
+
+            # self.tokenizer = BertTokenizer.from_pretrained(model_name + "/vocab.txt", do_lower_case=False)
+            # self.models = BertForMaskedLM.from_pretrained(model_name, config=self.config)
+            self.model = BertForMaskedLM.from_pretrained(model_name, config=self.config)
+        if self.model is not None:
+            self.model.to(self.device)
+        # só as n_layers primeiras camadas do encoder (truncated_depth.py), com calibração opcional da cabeça MLM
+        if n_layers is not None and self.model is not None:
+            set_depth(self.model, n_layers)
+            set_calibration(self.model, calibration)
 
         self.z_score = []
         for i in range(20):
             self.z_score.append([0] * 20)
 
+        # tabela palavra -> wordpieces (wordpiece_table.py), opcional
+        self.wordpiece_table = None
+        # ids das palavras do dataset atual, tokenizadas em lote por prepare_words
+        self.word_cache = {}
+
+    def set_wordpiece_table(self, table):
+        if table.meta["model_name"] != self.model_name:
+            logger.warning(f"tabela wordpiece construída com {table.meta['model_name']}, modelo é {self.model_name}")
+        self.wordpiece_table = table
+
+    def word_ids(self, word):
+        if word in self.word_cache:
+            return list(self.word_cache[word])
+        if self.wordpiece_table is not None and word in self.wordpiece_table:
+            return self.wordpiece_table.token_ids(word)
+        return self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(word))
+
+    def prepare_words(self, dataset, batch_size=2048):
+        # tokeniza de uma vez (em lote) as palavras do dataset que não estão na tabela
+        words = [w for row in dataset for w in row[:2]]
+        words = [w for w in dict.fromkeys(words) if w not in self.word_cache and
+                 (self.wordpiece_table is None or w not in self.wordpiece_table)]
+        for word, ids in zip(words, batch_tokenize(self.tokenizer, words, batch_size)):
+            self.word_cache[word] = ids
+
     def most_probabable_words(self, texts):
         words_probs_s = []
         for text in texts:
-            logger.info("Tokenizing...")
+            logger.debug("Tokenizing...")
             tokenized_text = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(text))
             example = self.tokenizer.build_inputs_with_special_tokens(tokenized_text)
 
             idx_mask = example.index(self.tokenizer.mask_token_id)
 
-            logger.info("Predicting...")
+            logger.debug("Predicting...")
             self.model.eval()
             with torch.no_grad():
                 examples = torch.tensor([example], device=self.device)
@@ -56,10 +112,10 @@ class ClozeBert:
             # outputs shape is (batch_example, words, scores).
             probs_mask = outputs[0, idx_mask]
 
-            logger.info("Zipping...")
+            logger.debug("Zipping...")
             words_probs = zip(probs_mask, self.tokenizer.vocab.keys())
 
-            logger.info("Sorting...")
+            logger.debug("Sorting...")
             # pair words with their scores (score, word) and sort them by score
             words_probs = sorted(words_probs, reverse=True)
 
@@ -69,58 +125,84 @@ class ClozeBert:
 
 
     def bert_sentence_score(self, patterns, dataset, vocab_dive, vocab_tokens):
+        stats = METRICS.mode("bert_score")
+        progress = stats.progress(len(dataset))
+        with stats.time("tokenize"):
+            self.prepare_words(dataset)
         words_probs_s = {}
         for row in dataset:
             pair = row[0:2]
             words_probs_s[" ".join(row)] = {}
             for pattern in patterns:
-                sentences, hyponym_idx, hypernym_idx, idx_mask = self.build_sentences_n_subtoken(pattern, pair)
+                with stats.time("build"):
+                    sentences, hyponym_idx, hypernym_idx, idx_mask = self.build_sentences_n_subtoken(pattern, pair)
                 idx_all = hyponym_idx + hypernym_idx
-                logger.info("Predicting...")
+                logger.debug("Predicting...")
                 self.model.eval()
                 with torch.no_grad():
-                    examples = torch.tensor(sentences, device=self.device)
+                    with stats.time("tensor"):
+                        examples = torch.tensor(sentences, device=self.device)
                     # segments_tensors = torch.tensor([segments_ids])
-                    outputs = self.model(examples)  # , segments_tensors)
+                    with stats.time("forward"), METRICS.profile("bert_score"):
+                        outputs = self.model(examples)  # , segments_tensors)
                 predict = outputs[0]
-                predict = predict[torch.arange(len(sentences), device=self.device), idx_mask, idx_all]
+                with stats.time("gather"):
+                    predict = predict[torch.arange(len(sentences), device=self.device), idx_mask, idx_all]
 
                 predict_hypon = predict[:len(hyponym_idx)]
                 predict_hyper = predict[-len(hypernym_idx):]
 
-                words_probs_s[" ".join(row)][pattern] = []
-                words_probs_s[" ".join(row)][pattern].append(predict_hypon.cpu().numpy().tolist())
-                words_probs_s[" ".join(row)][pattern].append(predict_hyper.cpu().numpy().tolist())
-
+                with stats.time("copy"):
+                    words_probs_s[" ".join(row)][pattern] = []
+                    words_probs_s[" ".join(row)][pattern].append(predict_hypon.cpu().numpy().tolist())
+                    words_probs_s[" ".join(row)][pattern].append(predict_hyper.cpu().numpy().tolist())
+                stats.count("forwards")
+                stats.count("sentences", len(sentences))
+            progress.update()
+        progress.finish()
         return words_probs_s
 
 
     def bert_sentence_score_2(self, patterns, dataset, vocab_dive, vocab_tokens):
+        stats = METRICS.mode("bert_score_2")
+        progress = stats.progress(len(dataset))
+        with stats.time("tokenize"):
+            self.prepare_words(dataset)
         words_probs_s = {}
         for row in dataset:
             pair = row[0:2]
             words_probs_s[" ".join(row)] = {}
             for pattern in patterns:
-                sentences, hyponym_idx, hypernym_idx, idx_mask = self.build_sentences_n_subtoken_2(pattern, pair)
+                with stats.time("build"):
+                    sentences, hyponym_idx, hypernym_idx, idx_mask = self.build_sentences_n_subtoken_2(pattern, pair)
                 idx_all = hyponym_idx + hypernym_idx
-                logger.info("Predicting...")
+                logger.debug("Predicting...")
                 self.model.eval()
                 with torch.no_grad():
-                    examples = torch.tensor(sentences, device=self.device)
+                    with stats.time("tensor"):
+                        examples = torch.tensor(sentences, device=self.device)
                     # segments_tensors = torch.tensor([segments_ids])
-                    outputs = self.model(examples)  # , segments_tensors)
+                    with stats.time("forward"), METRICS.profile("bert_score_2"):
+                        outputs = self.model(examples)  # , segments_tensors)
                 predict = outputs[0]
-                predict_hypon = predict[0, idx_mask[0], hyponym_idx]
-                predict_hyper = predict[1, idx_mask[1], hypernym_idx]
-
-                words_probs_s[" ".join(row)][pattern] = []
-                words_probs_s[" ".join(row)][pattern].append(predict_hypon.cpu().numpy().tolist())
-                words_probs_s[" ".join(row)][pattern].append(predict_hyper.cpu().numpy().tolist())
-
+                with stats.time("gather"):
+                    predict_hypon = predict[0, idx_mask[0], hyponym_idx]
+                    predict_hyper = predict[1, idx_mask[1], hypernym_idx]
+
+                with stats.time("copy"):
+                    words_probs_s[" ".join(row)][pattern] = []
+                    words_probs_s[" ".join(row)][pattern].append(predict_hypon.cpu().numpy().tolist())
+                    words_probs_s[" ".join(row)][pattern].append(predict_hyper.cpu().numpy().tolist())
+                stats.count("forwards")
+                stats.count("sentences", len(sentences))
+            progress.update()
+        progress.finish()
         return words_probs_s
 
 
     def sentence_score(self, patterns, dataset, vocab_dive, vocab_tokens):
+        stats = METRICS.mode("logsoftmax")
+        progress = stats.progress(len(dataset))
         words_probs_s = {}
         hyper = True
         oov = 0
@@ -140,6 +222,7 @@ class ClozeBert:
             if (not self.include_oov) and (pair[0] not in vocab_dive or pair[1] not in vocab_dive):
                 oov += 1
                 # par nao está no vocab do dive e calculo NÃO deverá incluí-lo
+                progress.update()
                 continue
 
             words_probs_s[" ".join(row)] = {}
@@ -147,21 +230,25 @@ class ClozeBert:
                 hyper_num += 1
 
             for pattern in patterns:
-                sentences, idx_h, idx_mask = self.build_sentences(pattern, pair)
+                with stats.time("build"):
+                    sentences, idx_h, idx_mask = self.build_sentences(pattern, pair)
                 idx_all = idx_h[0].copy()
                 idx_all.extend(idx_h[1])
                 hyponym_idx, hypernym_idx = idx_h[0], idx_h[1]
                 sentences_hyponym = sentences[:len(hyponym_idx)]
                 sentences_hypernym = sentences[-len(hypernym_idx):]
-                logger.info("Predicting...")
+                logger.debug("Predicting...")
                 self.model.eval()
                 with torch.no_grad():
-                    examples = torch.tensor(sentences, device=self.device)
+                    with stats.time("tensor"):
+                        examples = torch.tensor(sentences, device=self.device)
                     # segments_tensors = torch.tensor([segments_ids])
-                    outputs = self.model(examples)  # , segments_tensors)
+                    with stats.time("forward"), METRICS.profile("logsoftmax"):
+                        outputs = self.model(examples)  # , segments_tensors)
                 predict = outputs[0]
-                predict = f.log_softmax(predict, dim=2)
-                predict = predict[torch.arange(len(sentences), device=self.device), idx_mask, idx_all]
+                with stats.time("gather"):
+                    predict = f.log_softmax(predict, dim=2)
+                    predict = predict[torch.arange(len(sentences), device=self.device), idx_mask, idx_all]
 
                 # predict = torch.diagonal(predict[:, idx_mask, idx_all], 0)
 
@@ -171,11 +258,15 @@ class ClozeBert:
                 # print(predict_hyper)
                 # predict for sentences. shape( len(sentences) )
                 # print(predict)
-                words_probs_s[" ".join(row)][pattern] = []
-                words_probs_s[" ".join(row)][pattern].append(predict_hypon.cpu().numpy().tolist())
-                words_probs_s[" ".join(row)][pattern].append(predict_hyper.cpu().numpy().tolist())
+                with stats.time("copy"):
+                    words_probs_s[" ".join(row)][pattern] = []
+                    words_probs_s[" ".join(row)][pattern].append(predict_hypon.cpu().numpy().tolist())
+                    words_probs_s[" ".join(row)][pattern].append(predict_hyper.cpu().numpy().tolist())
                 # words_probs_s[" ".join(row)][pattern] = torch.sum(predict).item()
-
+                stats.count("forwards")
+                stats.count("sentences", len(sentences))
+            progress.update()
+        progress.finish()
         return words_probs_s, hyper_num, oov
 
 
@@ -218,7 +309,7 @@ class ClozeBert:
                 hyponym_idx, hypernym_idx = idx_h[0], idx_h[1]
                 sentences_hyponym = sentences[:len(hyponym_idx)]
                 sentences_hypernym = sentences[-len(hypernym_idx):]
-                logger.info("Predicting...")
+                logger.debug("Predicting...")
                 self.model.eval()
                 with torch.no_grad():
                     examples = torch.tensor(sentences, device=self.device)
@@ -254,11 +345,11 @@ class ClozeBert:
     def z_score_1(self, pattern, tokens_dataset, len_hypo, len_hyper):
         # calcular para diversos tamanhos de subtoken
         p = pattern.format("", "").strip()
-        logger.info("Tokenizing for Z...")
+        logger.debug("Tokenizing for Z...")
         p_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(p))
 
         sentences_mask_all, idx_mask_all = self.get_sentence_z_score(tokens_dataset,len_hypo, len_hyper, p_tokenize)
-        logger.info("Z Score calc...")
+        logger.debug("Z Score calc...")
         self.model.eval()
         with torch.no_grad():
             examples = torch.tensor(sentences_mask_all, device=self.device)
@@ -281,8 +372,10 @@ class ClozeBert:
 
 
     def get_len_subtoken(self, pair):
-        hyponym = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[0]))
-        hypernym = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[1]))
+        if self.wordpiece_table is not None and pair[0] in self.wordpiece_table and pair[1] in self.wordpiece_table:
+            return self.wordpiece_table.get_len_subtoken(pair)
+        hyponym = self.word_ids(pair[0])
+        hypernym = self.word_ids(pair[1])
         return len(hyponym), len(hypernym)
 
 
@@ -315,7 +408,7 @@ class ClozeBert:
     def build_sentences(self, pattern, pair):  # feito, agora falta tratar onde isso eh chamado
         sentence1 = pattern.format("[MASK]", pair[1])
         sentence2 = pattern.format(pair[0], "[MASK]")
-        logger.info("Tokenizing...")
+        logger.debug("Tokenizing...")
         hyponym_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[0]))
         hypernym_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[1]))
         pattern1_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(sentence1))
@@ -363,9 +456,9 @@ class ClozeBert:
 
 
     def build_sentences_n_subtoken(self, pattern, pair):
-        logger.info("Tokenizing...")
-        hyponym_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[0]))
-        hypernym_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[1]))
+        logger.debug("Tokenizing...")
+        hyponym_tokenize = self.word_ids(pair[0])
+        hypernym_tokenize = self.word_ids(pair[1])
         pattern_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pattern.format("", "").strip()))
 
         sentences = []
@@ -402,9 +495,9 @@ class ClozeBert:
         :param pair:
         :return:
         '''
-        logger.info("Tokenizing...")
-        hyponym_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[0]))
-        hypernym_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[1]))
+        logger.debug("Tokenizing...")
+        hyponym_tokenize = self.word_ids(pair[0])
+        hypernym_tokenize = self.word_ids(pair[1])
         pattern_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pattern.format("", "").strip()))
 
         sentences = []
@@ -442,6 +535,15 @@ class ClozeBert:
 
 
     def subtoken_dataset(self, dataset):
+        if self.wordpiece_table is not None:
+            histogram = self.wordpiece_table.histogram(dataset)
+            size = []
+            for i in range(20):
+                size.append([0] * 20)
+            for (hypo, hyper), n in histogram.items():
+                size[hypo][hyper] = n
+            return size
+
         size = []
         for i in range(20):
             size.append([0] * 20)
@@ -457,9 +559,9 @@ class ClozeBert:
         dataset_by_token_size = {}
         logger.info("Contando subtoken")
         for pair in dataset:
-            hypo_size, hyper_size = self.get_len_subtoken(pair[:2])
-            hypo_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[0]))
-            hyper_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pair[1]))
+            hypo_tokenize = self.word_ids(pair[0])
+            hyper_tokenize = self.word_ids(pair[1])
+            hypo_size, hyper_size = len(hypo_tokenize), len(hyper_tokenize)
             tokens = hypo_tokenize + hyper_tokenize
             if (hypo_size, hyper_size) in dataset_by_token_size:
                 dataset_by_token_size[(hypo_size, hyper_size)].append(tokens)
@@ -504,28 +606,19 @@ class ClozeBert:
 
         return dataset_by_token_size
 
-def load_eval_file(f_in):
-    eval_data = []
-    for line in f_in:
-        child_pos, parent_pos, is_hyper, rel = line.strip().split('\t')
-        child = child_pos.strip()
-        parent = parent_pos.strip()
-        is_hyper = is_hyper.strip()
-        rel = rel.strip()
-        eval_data.append([child, parent, is_hyper, rel])
-    # random.shuffle(eval_data)
-    return eval_data
-
-
 def save_bert_file(dict, output, dataset_name, model_name, hyper_num, oov_num, f_info_out, include_oov=True):
     logger.info("save info...")
     f_info_out.write(f'{model_name}\t{dataset_name}\t{len(dict)}\t{oov_num}\t{hyper_num}\t{include_oov}\n')
     logger.info("save json...")
     dname = os.path.splitext(dataset_name)[0]
-    fjson = json.dumps(dict, ensure_ascii=False)
-    f = open(os.path.join(output, model_name.replace("/", "-"), dname + ".json"), mode="w", encoding="utf-8")
-    f.write(fjson)
-    f.close()
+    with METRICS.current().time("serialize"):
+        f = open(os.path.join(output, model_name.replace("/", "-"), dname + ".json"), mode="w", encoding="utf-8")
+        if isinstance(dict, ScoreTable):
+            # grava par a par, sem montar o dict inteiro
+            dict.dump(f)
+        else:
+            f.write(json.dumps(dict, ensure_ascii=False))
+        f.close()
 
 
 def main2():
@@ -571,35 +664,26 @@ def main2():
     return cloze_model
 
 
-def subtoken_size():
-    print("Iniciando bert...")
-    model_name = "neuralmind/bert-base-portuguese-cased"
-    cloze_model = ClozeBert(model_name)
-    out_path = "results/subtoken_size/subtoken_dataset.tsv"
-    dataset_path = "/home/gabrielescobar/Documentos/dive-pytorch/datasets"
+def subtoken_size(model_name="neuralmind/bert-base-portuguese-cased",
+                  dataset_path="/home/gabrielescobar/Documentos/dive-pytorch/datasets",
+                  out_path="results/subtoken_size/subtoken_dataset.tsv", table_dir=DEFAULT_TABLE_ROOT):
+    # so o tokenizer é necessário: os tamanhos saem da tabela wordpiece
+    print("Carregando tabela wordpiece...")
+    table = load_or_build(load_tokenizer(model_name), model_name, dataset_path, table_dir)
     f_out = open(out_path, encoding="utf-8", mode="w")
     f_out.write("model\tdataset\tsubtoken\tN\n")
 
-    pairs_token_1 = [['acampamento', 'lugar', 'True', 'hyper'],
-                     ['acidente', 'acontecimento', 'True', 'hyper'],
-                     ['pessoa', 'discurso', 'False', 'random'],
-                     ['pessoa', 'discurso', 'False', 'random'],
-                     ["banana", "fruta", "True", "hyper"]]
-
-
     for file_dataset in os.listdir(dataset_path):
         if os.path.isfile(os.path.join(dataset_path, file_dataset)):
             with open(os.path.join(dataset_path, file_dataset)) as f_in:
                 logger.info("Loading dataset ...")
                 eval_data = load_eval_file(f_in)
-                size = cloze_model.subtoken_dataset(eval_data)
-                for i in range(len(size)):
-                    for j in range(len(size)):
-                        if size[i][j] != 0:
-                            f_out.write(f"{model_name}\t{file_dataset}\t{i},{j}\t{size[i][j]}\n")
+                size = table.histogram(eval_data)
+                for i, j in sorted(size):
+                    f_out.write(f"{model_name}\t{file_dataset}\t{i},{j}\t{size[(i, j)]}\n")
 
     f_out.close()
-    return cloze_model
+    return table
 
 
 def main():
@@ -610,16 +694,41 @@ def main():
     parser.add_argument("-v", "--vocab", type=str, help="dir of vocab", required=False)
     parser.add_argument("-u", "--include_oov", action="store_true", help="to include oov on results",
                         default=True)  # sempre True
+    parser.add_argument("-t", "--table_dir", type=str, help="dir of wordpiece tables (wordpiece_table.py)",
+                        required=False)
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    parser.add_argument("-i", "--index", type=str, required=False,
+                        help="index.json of dataset_index.py: score only the deduplicated union of the datasets")
+    parser.add_argument("--layers", type=int, required=False, help="score with the first k encoder layers")
+    parser.add_argument("--calibration", type=str, required=False,
+                        help="calibration of the MLM head for --layers (truncated_depth.py)")
 
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-l", "--logsoftmax", action="store_true")
     group.add_argument("-z", "--zscore", action="store_true")
     group.add_argument("-x", "--zscore_exp", action="store_true")
     group.add_argument("-b", "--bert_score", action="store_true")
+    parser.add_argument("--no_profile", action="store_true", help="ignore the host profile of autotune.py")
+    parser.add_argument("--compact", action="store_true",
+                        help="with -b: batched scoring into a float32 table (scoring.score_table), far less memory")
+    parser.add_argument("--topk", type=int, default=0,
+                        help="with --compact: save the k best tokens of each masked slot (topk_capture.py)")
+    instrumentation.add_arguments(parser)
 
     args = parser.parse_args()
+    if args.topk and not args.compact:
+        parser.error("--topk needs --compact")
+    instrumentation.configure(args)
     print("Iniciando bert...")
-    cloze_model = ClozeBert(args.model_name, args.zscore_exp)
+    calibration = load_calibration(args.calibration) if args.calibration else None
+    cloze_model = ClozeBert(args.model_name, args.zscore_exp, fast_tokenizer=args.fast_tokenizer,
+                            n_layers=args.layers, calibration=calibration)
+    if not args.no_profile:
+        # threads do perfil da máquina (autotune.py)
+        apply_profile(args.model_name, "bert_score")
+    if args.table_dir:
+        cloze_model.set_wordpiece_table(load_or_build(cloze_model.tokenizer, args.model_name, args.eval_path,
+                                                      args.table_dir))
     try:
         os.mkdir(os.path.join(args.output_path, args.model_name.replace("/", "-")))
     except:
@@ -628,24 +737,8 @@ def main():
     f_out = open(os.path.join(args.output_path, args.model_name.replace('/', '-'), "info.tsv"), mode="a")
     f_out.write("model\tdataset\tN\toov\thyper_num\tinclude_oov\n")
 
-    patterns = ["{} é um tipo de {}", "{} é um {}", "{} e outros {}", "{} ou outro {}", "{} , um {}"]
-    en_patterns = ["{} is a type of {}", "{} is a {}", "{} and others {}", "{} or others {}", "{} , a {}"]
-
-    # 2018 RoolerEtal - Hearst Patterns Revisited
-    patterns2 = ["{} que é um exemplo de {}", "{} que é uma classe de {}", "{} que é um tipo de {}",
-                 "{} e qualquer outro {}", "{} e algum outro {}", "{} ou qualquer outro {}", "{} ou algum outro {}",
-                 "{} que é chamado de {}",
-                 "{} é um caso especial de {}",
-                 "{} incluindo {}"]
-
-    en_pattern2 = ["{} which is a example of {}", "{} which is a class of {}", "{} which is kind of {}",
-                    "{} and any other {}", "{} and some other {}", "{} or any other {}", "{} or some other {}",
-                    "{} which is called {}",
-                    "{} a special case of {}",
-                    "{} including {}"]
-
-    patterns.extend(patterns2)
-    en_patterns.extend(en_pattern2)
+    patterns = list(ALL_PATTERNS)
+    en_patterns = list(ALL_EN_PATTERNS)
 
     pairs = [['tigre', 'animal', 'True', 'hyper'], ['casa', 'moradia', 'True', 'hyper'],
              ['banana', 'abacate', 'False', 'random']]
@@ -688,9 +781,9 @@ def main():
     # f_out.close()
     # sys.exit(0)
 
-    for file_dataset in os.listdir(args.eval_path):
-        if os.path.isfile(os.path.join(args.eval_path, file_dataset)):
-            with open(os.path.join(args.eval_path, file_dataset)) as f_in:
+    for file_dataset, path_dataset in dataset_files(args.eval_path, args.index):
+        if os.path.isfile(path_dataset):
+            with open(path_dataset) as f_in:
                 logger.info("Loading dataset ...")
                 eval_data = load_eval_file(f_in)
                 vocab_dataset_tokens = []
@@ -698,7 +791,15 @@ def main():
                 # com bert score
                 if args.bert_score:
                     logger.info(f"Run BERT score = {args.bert_score}")
-                    result = cloze_model.bert_sentence_score(en_patterns, eval_data, [], vocab_dataset_tokens)
+                    if args.compact:
+                        capture = TopKCapture(args.topk) if args.topk else None
+                        result = score_table(cloze_model, eval_data, en_patterns, "bert_score", capture=capture)
+                        logger.info(f"Tabela de scores: {result.nbytes / 2 ** 20:.1f} MB")
+                        if capture is not None:
+                            capture.save(os.path.join(args.output_path, args.model_name.replace('/', '-'),
+                                                      os.path.splitext(file_dataset)[0] + ".topk.npz"), en_patterns)
+                    else:
+                        result = cloze_model.bert_sentence_score(en_patterns, eval_data, [], vocab_dataset_tokens)
                     hyper_total = 0
                     oov_num = 0
                 # # com zscore
@@ -714,6 +815,8 @@ def main():
                                oov_num, f_out, args.include_oov)
                 # logger.info(f"result_size={len(result)}")
     f_out.close()
+    if args.metrics:
+        METRICS.dump(args.metrics)
     logger.info("Done")
     print("Done!")
 
@@ -0,0 +1,183 @@
+"""
+Ranking em cascata: o AP só depende da ordem perto do topo, então nem todo par precisa dos 15 padrões.
+
+    estágio 1: todos os pares com 1-2 padrões baratos (ou com o build_sentences_n_subtoken_2, 2 sentenças por par)
+    estágio 2: só a fração do topo do estágio 1 é repontuada com o best_bert_score inteiro e reordenada com o
+               sub_method do bert-eval.py; o resto fica abaixo, na ordem do estágio 1
+
+O estágio 2 repontua só a maior fração pedida; as menores são prefixos dela. O relatório mostra, para cada
+fração, o AP e o custo (forwards e sentenças do modelo) relativo à execução exaustiva (todos os padrões em todos
+os pares). O AP exaustivo só é calculado com --exhaustive (o estágio 2 passa a repontuar todos os pares), com a
+fração 1 ou com -r; sem eles a coluna sai "-". Os scores do estágio 2 podem vir de um resultado já pontuado pelo
+bert_portuguese.py (-r), e então a curva inteira e a referência saem só com o custo do estágio 1.
+
+Uso:
+    python cascade.py -m <model> -d datasets/ontoPT-test.tsv -o results/cascade
+    python cascade.py -m <model> -d datasets/ontoPT-test.tsv --fractions 0.01 0.05 -o results/cascade
+    python cascade.py -m <model> -d datasets/ontoPT-test.tsv --exhaustive -o results/cascade
+    python cascade.py -m <model> -d datasets/ontoPT-test.tsv -r results/<model>/ontoPT-test.json -o results/cascade
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import time
+
+from bert_portuguese import ClozeBert, load_eval_file
+from hearst_patterns import BEST_BERT_SCORE, EN_BEST_PATTERNS
+from ranking import METHODS, SUB_METHODS, aggregate, compute_AP, pattern_scores
+
+logger = logging.getLogger(__name__)
+
+MODES = ["bert_score", "bert_score_2"]
+
+
+class CascadeScorer:
+    def __init__(self, cloze, mode="bert_score"):
+        self.cloze = cloze
+        self.mode = mode
+
+    def n_sentences(self, row, mode):
+        # bert_score: uma sentença por wordpiece (hipônimo e hiperônimo); bert_score_2: uma por palavra
+        if mode == "bert_score_2":
+            return 2
+        return len(self.cloze.word_ids(row[0])) + len(self.cloze.word_ids(row[1]))
+
+    def cost(self, rows, patterns, mode):
+        return len(rows) * len(patterns), sum(self.n_sentences(row, mode) for row in rows) * len(patterns)
+
+    def score(self, rows, patterns, mode):
+        if not rows or not patterns:
+            return {}
+        self.cloze.prepare_words(rows)
+        if mode == "bert_score_2":
+            return self.cloze.bert_sentence_score_2(patterns, rows, [], [])
+        return self.cloze.bert_sentence_score(patterns, rows, [], [])
+
+
+def cascade_order(order_stage1, full_scores, full_patterns, k, method, sub_method):
+    """ top k do estágio 1 reordenado com todos os padrões, seguido do resto na ordem do estágio 1 """
+    top = {key: full_scores[key] for key, _ in order_stage1[:k]}
+    order_top = aggregate(pattern_scores(top, full_patterns, method), full_patterns, sub_method)
+    return order_top + order_stage1[k:]
+
+
+def run(scorer, dataset, stage1_patterns, full_patterns, fractions, stage1_mode, method, sub_method,
+        stage1_sub_method="mean_pattern", precomputed=None, exhaustive=False):
+    """
+    :param precomputed: resultado do bert_portuguese.py ({'a b True hyper': {padrão: [[..], [..]]}}) com os padrões
+                        de full_patterns; quando presente o estágio 2 não chama o modelo
+    :param exhaustive: repontua todos os pares no estágio 2 para ter o AP exaustivo (sem precomputed)
+    :return: [dict] uma linha do relatório por fração
+    """
+    rows = {" ".join(row): row for row in dataset}
+    keys = list(rows)
+    n = len(keys)
+
+    t0 = time.time()
+    stage1_forwards, stage1_sentences = scorer.cost(list(rows.values()), stage1_patterns, stage1_mode)
+    stage1 = scorer.score(list(rows.values()), stage1_patterns, stage1_mode)
+    order_stage1 = aggregate(pattern_scores(stage1, stage1_patterns, method), stage1_patterns, stage1_sub_method)
+    stage1_time = time.time() - t0
+    logger.info(f"Estágio 1: {n} pares, {stage1_forwards} forwards em {stage1_time:.1f}s")
+
+    # estágio 2 só na maior fração (ou em todos os pares, para a referência exaustiva)
+    k_max = n if exhaustive and precomputed is None else min(n, math.ceil(max(fractions) * n))
+    top_keys = [key for key, _ in order_stage1[:k_max]]
+    if precomputed is not None:
+        full_scores = {key: precomputed[key] for key in top_keys}
+    else:
+        # padrões do estágio 1 já pontuados no mesmo modo não são repetidos
+        reuse = [p for p in stage1_patterns if stage1_mode == scorer.mode]
+        missing = [p for p in full_patterns if p not in reuse]
+        t0 = time.time()
+        full_scores = scorer.score([rows[key] for key in top_keys], missing, scorer.mode)
+        for key in top_keys:
+            full_scores.setdefault(key, {}).update({p: stage1[key][p] for p in reuse if p in full_patterns})
+        logger.info(f"Estágio 2: {k_max} pares em {time.time() - t0:.1f}s")
+
+    exhaustive_forwards, exhaustive_sentences = scorer.cost(list(rows.values()), full_patterns, scorer.mode)
+    exhaustive_ap = None
+    if precomputed is not None:
+        exhaustive_ap = compute_AP(aggregate(pattern_scores({key: precomputed[key] for key in keys}, full_patterns,
+                                                            method), full_patterns, sub_method), empty=0.0)
+    elif k_max == n:
+        exhaustive_ap = compute_AP(cascade_order(order_stage1, full_scores, full_patterns, n, method, sub_method),
+                                   empty=0.0)
+
+    report = []
+    stage1_ap = compute_AP(order_stage1, empty=0.0)
+    for fraction in [0] + sorted(fractions):
+        k = min(n, math.ceil(fraction * n))
+        order = cascade_order(order_stage1, full_scores, full_patterns, k, method, sub_method) if k else order_stage1
+        # custo do estágio 2 para estes k pares, sem os padrões reaproveitados do estágio 1
+        reused = len([p for p in stage1_patterns if p in full_patterns]) if stage1_mode == scorer.mode else 0
+        forwards, sentences = scorer.cost([rows[key] for key in top_keys[:k]], full_patterns, scorer.mode)
+        share = (len(full_patterns) - reused) / len(full_patterns)
+        forwards = stage1_forwards + forwards * share
+        sentences = stage1_sentences + sentences * share
+        ap = compute_AP(order, empty=0.0) if k else stage1_ap
+        report.append({"fraction": fraction, "rescored": k, "forwards": int(forwards), "sentences": int(sentences),
+                       "cost": sentences / exhaustive_sentences, "AP": ap, "AP_exhaustive": exhaustive_ap,
+                       "exhaustive_forwards": exhaustive_forwards, "exhaustive_sentences": exhaustive_sentences})
+    return report
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_name", type=str, help="path to bert models", required=True)
+    parser.add_argument("-d", "--datasets", type=str, nargs="+", help="dataset tsv files", required=True)
+    parser.add_argument("-o", "--output_path", type=str, help="dir output", required=True)
+    parser.add_argument("-r", "--results", type=str, nargs="*", default=[],
+                        help="results of bert_portuguese.py (same order as -d) to take the stage 2 scores from")
+    parser.add_argument("--en", action="store_true", help="use EN_BEST_PATTERNS instead of BEST_BERT_SCORE")
+    parser.add_argument("-n", "--n_patterns", type=int, default=None, help="use the n best patterns (stage 2)")
+    parser.add_argument("--stage1_patterns", type=int, default=1, help="number of best patterns of stage 1")
+    parser.add_argument("--stage1_mode", choices=MODES, default="bert_score",
+                        help="bert_score_2 masks the whole word (2 sentences per pair)")
+    parser.add_argument("--mode", choices=MODES, default="bert_score", help="scorer of stage 2")
+    parser.add_argument("--fractions", type=float, nargs="+", default=[0.05, 0.1, 0.2, 0.5])
+    parser.add_argument("--exhaustive", action="store_true",
+                        help="rescore every pair in stage 2 to report the exhaustive AP (not needed with -r)")
+    parser.add_argument("--method", choices=METHODS, default="all_subword")
+    parser.add_argument("--sub_method", choices=SUB_METHODS, default="min_positional_rank")
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    args = parser.parse_args()
+
+    best = EN_BEST_PATTERNS if args.en else BEST_BERT_SCORE
+    full_patterns = best[:args.n_patterns] if args.n_patterns else list(best)
+    stage1_patterns = best[:args.stage1_patterns]
+
+    os.makedirs(args.output_path, exist_ok=True)
+    scorer = CascadeScorer(ClozeBert(args.model_name, fast_tokenizer=args.fast_tokenizer), args.mode)
+    f_out = open(os.path.join(args.output_path, "cascade.tsv"), mode="a", encoding="utf-8")
+    f_out.write("model\tdataset\tN\tstage1\tmethod\tfraction\trescored\tforwards\tsentences\tcost\tAP\t"
+                "AP_exhaustive\tdelta_AP\n")
+    for i, path_dataset in enumerate(args.datasets):
+        with open(path_dataset, encoding="utf-8") as f_in:
+            dataset = load_eval_file(f_in)
+        precomputed = None
+        if i < len(args.results):
+            with open(args.results[i], encoding="utf-8") as f_result:
+                precomputed = json.load(f_result)
+        dataset_name = os.path.basename(path_dataset)
+        report = run(scorer, dataset, stage1_patterns, full_patterns, args.fractions, args.stage1_mode, args.method,
+                     args.sub_method, precomputed=precomputed, exhaustive=args.exhaustive)
+        for line in report:
+            exhaustive = line["AP_exhaustive"]
+            delta = "-" if exhaustive is None else f"{line['AP'] - exhaustive:.4f}"
+            exhaustive = "-" if exhaustive is None else f"{exhaustive:.4f}"
+            f_out.write(f"{args.model_name}\t{dataset_name}\t{len(dataset)}\t{args.stage1_mode}:{len(stage1_patterns)}"
+                        f"\t{args.method}_{args.sub_method}\t{line['fraction']}\t{line['rescored']}\t{line['forwards']}"
+                        f"\t{line['sentences']}\t{line['cost']:.4f}\t{line['AP']:.4f}\t{exhaustive}\t{delta}\n")
+            logger.info(f"{dataset_name} fração={line['fraction']} custo={line['cost']:.1%} AP={line['AP']:.4f} "
+                        f"exaustivo={exhaustive}")
+    f_out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -26,7 +26,9 @@ import random
 
 import numpy as np
 import torch
-from transformers import BertConfig, BertForMaskedLM, BertTokenizer
+from transformers import BertConfig, BertForMaskedLM
+
+from wordpiece_table import batch_tokenize, load_tokenizer
 
 logger = logging.getLogger(__name__)
 
@@ -40,24 +42,24 @@ def set_seed(args):
 
 
 class ClozeBert:
-    def __init__(self, model_name):
+    def __init__(self, model_name, fast_tokenizer=False):
         logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
                             datefmt='%m/%d/%Y %H:%M:%S',
                             level=logging.INFO)
         self.config = BertConfig.from_pretrained(model_name)
-        self.tokenizer = BertTokenizer.from_pretrained(model_name, do_lower_case=model_name.endswith("-uncased"))
+        self.tokenizer = load_tokenizer(model_name, fast_tokenizer)
         self.model = BertForMaskedLM.from_pretrained(model_name, config=self.config)
 
     def most_probabable_words(self, texts):
         words_probs_s = []
-        for text in texts:
-            logger.info("Tokenizing...")
-            tokenized_text = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(text))
+        logger.debug("Tokenizing...")
+        tokenized_texts = list(batch_tokenize(self.tokenizer, texts))
+        for text, tokenized_text in zip(texts, tokenized_texts):
             example = self.tokenizer.build_inputs_with_special_tokens(tokenized_text)
 
             idx_mask = example.index(self.tokenizer.mask_token_id)
 
-            logger.info("Predicting...")
+            logger.debug("Predicting...")
             self.model.eval()
             with torch.no_grad():
                 examples = torch.tensor([example])
@@ -66,10 +68,10 @@ class ClozeBert:
             # outputs shape is (batch_example, words, scores).
             probs_mask = outputs[0, idx_mask]
 
-            logger.info("Zipping...")
+            logger.debug("Zipping...")
             words_probs = zip(probs_mask, self.tokenizer.vocab.keys())
 
-            logger.info("Sorting...")
+            logger.debug("Sorting...")
             # pair words with their scores (score, word) and sort them by score
             words_probs = sorted(words_probs, reverse=True)
 
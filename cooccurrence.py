@@ -0,0 +1,325 @@
+"""
+Co-ocorrências de palavras num corpus e baselines distribucionais de hiperonímia (inclusão distribucional e os
+scores de soma do DIVE), no lugar dos números fixos do nb_utils.get_df_dive, para rodar em corpus e datasets novos.
+
+count: o corpus é dividido em faixas de bytes (as do hearst_miner.py) e cada faixa é contada por um processo. As
+palavras fora do vocabulário (vocabs/*/vocab.txt, "palavra contagem") viram -1; cada par (palavra, contexto) a até
+--window posições na mesma linha vira o código palavra * V + contexto (int64). Cada faixa devolve os códigos únicos e
+as contagens, e a soma das faixas é gravada como matriz esparsa CSR (indptr, indices, data) num .npz.
+
+score: pesa a matriz (PPMI ou contagem) e calcula os scores de todos os pares de um dataset de uma vez: as entradas
+da linha do hipônimo de cada par são buscadas na linha do hiperônimo com um searchsorted nos códigos da matriz, e
+as somas por par saem de np.bincount, sem laço em Python por par. Quanto maior o score, mais provável o hiperônimo:
+    dot_product            cosseno (o C do DIVE)
+    summation              soma do vetor do hiperônimo - soma do vetor do hipônimo (o ΔS do DIVE)
+    summation_dot_product  ΔS * C
+    weeds_prec             peso do hipônimo nos contextos que o hiperônimo também tem / peso total do hipônimo
+    clarke_de              soma dos mínimos / peso total do hipônimo
+    inv_cl                 sqrt(clarke_de(hipo, hyper) * (1 - clarke_de(hyper, hipo)))
+
+A saída tem o formato dos scorers BERT, com cada método no lugar de um padrão ({"a b True hyper": {"summation":
+[[score], [0.0]], ...}}), em <output>/<nome>/<dataset>.json com info.tsv. Pares com palavra fora do vocabulário
+ficam no fim do ranking, com score OOV_SCORE (-inf, como no bert_portuguese.py) em todos os métodos, e são
+contados na coluna oov do info.tsv. O bert-eval.py --baseline dá o AP de cada método.
+
+Uso:
+    python cooccurrence.py count -c wikipedia_15M.txt -v vocabs/wikipedia15M/vocab.txt -o work/wikipedia15M.npz
+    python cooccurrence.py score -x work/wikipedia15M.npz -e datasets -o results
+    python bert-eval.py -i results/wikipedia15M_cooc -e datasets -o results --vocabs vocabs --baseline
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from hearst_miner import WORD, read_range, split_ranges
+
+logger = logging.getLogger(__name__)
+
+SCORES = ["dot_product", "summation", "summation_dot_product", "weeds_prec", "clarke_de", "inv_cl"]
+WEIGHTINGS = ["ppmi", "count"]
+# score dos pares com palavra fora do vocabulário (o json grava -Infinity, que o json.load lê de volta)
+OOV_SCORE = float("-inf")
+
+TOKEN = re.compile(WORD)
+
+
+def read_vocab(path, max_vocab=None):
+    """ palavras do vocab.txt ("palavra contagem" por linha), na ordem do arquivo """
+    words = []
+    with open(path, mode="r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                words.append(line.split()[0])
+            if max_vocab and len(words) >= max_vocab:
+                break
+    return words
+
+
+def merge_counts(parts):
+    """ soma de várias listas (códigos, contagens) """
+    if not parts:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    codes, inverse = np.unique(np.concatenate([c for c, _ in parts]), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([n for _, n in parts]), minlength=len(codes))
+    return codes, counts.astype(np.int64)
+
+
+def window_codes(ids, n_words, window):
+    """ códigos (palavra * V + contexto) dos pares a até window posições; -1 é palavra fora do vocabulário """
+    ids = np.asarray(ids, dtype=np.int64)
+    codes = []
+    for d in range(1, window + 1):
+        left, right = ids[:-d], ids[d:]
+        keep = (left >= 0) & (right >= 0)
+        left, right = left[keep], right[keep]
+        codes.append(left * n_words + right)
+        codes.append(right * n_words + left)
+    codes = np.concatenate(codes) if codes else np.zeros(0, np.int64)
+    return np.unique(codes, return_counts=True)
+
+
+_vocab = None
+_window = 5
+_lower = True
+
+
+def _init_worker(words, window, lower):
+    global _vocab, _window, _lower
+    _vocab = {w: i for i, w in enumerate(words)}
+    _window = window
+    _lower = lower
+
+
+def count_range(task, flush_tokens=1 << 20, max_parts=16):
+    path, start, end, encoding = task
+    parts = []
+    ids = []
+    # separador entre linhas: a janela não passa de uma linha para a outra
+    gap = [-1] * _window
+    for line in read_range(path, start, end, encoding):
+        if line.startswith("CURRENT URL"):
+            continue
+        if _lower:
+            line = line.lower()
+        ids.extend(_vocab.get(w, -1) for w in TOKEN.findall(line))
+        ids.extend(gap)
+        if len(ids) >= flush_tokens:
+            parts.append(window_codes(ids, len(_vocab), _window))
+            ids = []
+            if len(parts) >= max_parts:
+                parts = [merge_counts(parts)]
+    parts.append(window_codes(ids, len(_vocab), _window))
+    return merge_counts(parts), end - start
+
+
+def count(corpus_paths, words, window=5, workers=None, chunk_mb=64, encoding="utf-8", lower=True):
+    """ Cooccurrence com as contagens de todos os arquivos """
+    tasks = []
+    for path in corpus_paths:
+        n_chunks = max(1, os.path.getsize(path) // (chunk_mb << 20))
+        tasks.extend((p, s, e, encoding) for p, s, e in split_ranges(path, n_chunks))
+    total_bytes = sum(e - s for _, s, e, _ in tasks)
+    parts = []
+    done = 0
+    t0 = time.time()
+    with Pool(workers, initializer=_init_worker, initargs=(words, window, lower)) as pool:
+        for chunk_counts, n_bytes in pool.imap_unordered(count_range, tasks):
+            parts.append(chunk_counts)
+            if len(parts) >= 8:
+                parts = [merge_counts(parts)]
+            done += n_bytes
+            elapsed = time.time() - t0
+            logger.info(f"{done / max(total_bytes, 1):.1%} do corpus, "
+                        f"{done / (1 << 20) / max(elapsed, 1e-9):.1f} MB/s")
+    codes, counts = merge_counts(parts)
+    return Cooccurrence.from_codes(words, codes, counts)
+
+
+class Cooccurrence:
+    """ matriz esparsa V x V em CSR; as colunas de cada linha em ordem crescente """
+
+    def __init__(self, words, indptr, indices, data):
+        self.words = list(words)
+        self.index = {w: i for i, w in enumerate(self.words)}
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.float64)
+
+    @classmethod
+    def from_codes(cls, words, codes, values):
+        """ codes ordenados (palavra * V + contexto), como os de merge_counts """
+        n_words = len(words)
+        rows = codes // n_words
+        indptr = np.zeros(n_words + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_words), out=indptr[1:])
+        return cls(words, indptr, codes % n_words, values)
+
+    def __len__(self):
+        return len(self.words)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def rows(self):
+        """ linha de cada entrada """
+        return np.repeat(np.arange(len(self.words), dtype=np.int64), np.diff(self.indptr))
+
+    def codes(self):
+        return self.rows() * len(self.words) + self.indices
+
+    def row_sums(self, power=1):
+        return np.bincount(self.rows(), weights=self.data ** power, minlength=len(self.words))
+
+    def ppmi(self):
+        """ max(0, log(c(w, c) * total / (c(w) * c(c)))), só com as entradas positivas """
+        totals = self.row_sums()
+        rows = self.rows()
+        with np.errstate(divide="ignore"):
+            pmi = np.log(self.data) + np.log(totals.sum()) - np.log(totals[rows]) - np.log(totals[self.indices])
+        keep = pmi > 0
+        codes = rows[keep] * len(self.words) + self.indices[keep]
+        return Cooccurrence.from_codes(self.words, codes, pmi[keep])
+
+    def save(self, path):
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, words=np.array(self.words, dtype=str), indptr=self.indptr, indices=self.indices,
+                 data=self.data)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["words"].tolist(), data["indptr"], data["indices"], data["data"])
+
+
+def _row_entries(indptr, rows):
+    """ (par, entrada) de todas as entradas das linhas rows[par] """
+    lengths = indptr[rows + 1] - indptr[rows]
+    pair = np.repeat(np.arange(len(rows)), lengths)
+    first = np.repeat(indptr[rows] - (np.cumsum(lengths) - lengths), lengths)
+    return pair, first + np.arange(lengths.sum())
+
+
+def pair_scores(matrix, hypo, hyper):
+    """
+    :param hypo: ids do hipônimo de cada par (idem hyper)
+    :return: {método: array com o score de cada par}
+    """
+    hypo = np.asarray(hypo, dtype=np.int64)
+    hyper = np.asarray(hyper, dtype=np.int64)
+    n = len(hypo)
+    pair, entry = _row_entries(matrix.indptr, hypo)
+    v_hypo = matrix.data[entry]
+    # o mesmo contexto na linha do hiperônimo
+    codes = matrix.codes()
+    target = hyper[pair] * len(matrix) + matrix.indices[entry]
+    position = np.minimum(np.searchsorted(codes, target), max(len(codes) - 1, 0))
+    found = codes[position] == target if len(codes) else np.zeros(len(target), bool)
+    v_hyper = np.where(found, matrix.data[position] if len(codes) else 0.0, 0.0)
+
+    shared_min = np.bincount(pair, weights=np.minimum(v_hypo, v_hyper), minlength=n)
+    dot = np.bincount(pair, weights=v_hypo * v_hyper, minlength=n)
+    included = np.bincount(pair, weights=v_hypo * found, minlength=n)
+    sums = matrix.row_sums()
+    norms = np.sqrt(matrix.row_sums(2))
+    sum_hypo, sum_hyper = sums[hypo], sums[hyper]
+
+    def ratio(a, b):
+        return np.divide(a, b, out=np.zeros(n), where=b > 0)
+
+    cosine = ratio(dot, norms[hypo] * norms[hyper])
+    summation = sum_hyper - sum_hypo
+    clarke_de = ratio(shared_min, sum_hypo)
+    return {"dot_product": cosine, "summation": summation, "summation_dot_product": summation * cosine,
+            "weeds_prec": ratio(included, sum_hypo), "clarke_de": clarke_de,
+            "inv_cl": np.sqrt(clarke_de * (1 - ratio(shared_min, sum_hyper)))}
+
+
+def score_dataset(matrix, rows, methods=SCORES, lower=True):
+    """ ({chave: {método: [[score], [0.0]]}} de todos os pares, OOV_SCORE nos de fora do vocabulário; quantos são) """
+    rows = {" ".join(row): row for row in rows}
+    keys, hypo, hyper = [], [], []
+    for key, row in rows.items():
+        a, b = (row[0].lower(), row[1].lower()) if lower else (row[0], row[1])
+        if a in matrix.index and b in matrix.index:
+            keys.append(key)
+            hypo.append(matrix.index[a])
+            hyper.append(matrix.index[b])
+    scores = pair_scores(matrix, hypo, hyper)
+    result = {key: {m: [[float(scores[m][i])], [0.0]] for m in methods} for i, key in enumerate(keys)}
+    oov_pair = {m: [[OOV_SCORE], [0.0]] for m in methods}
+    # na ordem do dataset, com os pares fora do vocabulário no lugar deles
+    return {key: result.get(key, oov_pair) for key in rows}, len(rows) - len(keys)
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["count", "score"])
+    parser.add_argument("-c", "--corpus", type=str, nargs="+", help="corpus text files (count)")
+    parser.add_argument("-v", "--vocab", type=str, help="vocab.txt with 'word count' lines (count)")
+    parser.add_argument("--max_vocab", type=int, default=None, help="keep the first n words of the vocab")
+    parser.add_argument("--window", type=int, default=5, help="context words on each side")
+    parser.add_argument("--encoding", type=str, default="utf-8")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="default: all cores")
+    parser.add_argument("--chunk_mb", type=int, default=64)
+    parser.add_argument("--cased", action="store_true", help="do not lower case the corpus and the pairs")
+    parser.add_argument("-x", "--matrix", type=str, help="co-occurrence npz (output of count, input of score)")
+    parser.add_argument("-o", "--output", type=str, help="npz (count) or dir of the results (score)",
+                        required=True)
+    parser.add_argument("-e", "--eval_path", type=str, help="dataset file or dir of datasets (score)")
+    parser.add_argument("-i", "--index", type=str, required=False, help="dataset index (dataset_index.py)")
+    parser.add_argument("-n", "--name", type=str, help="name of the results dir (default: <matrix>_cooc)")
+    parser.add_argument("--weighting", choices=WEIGHTINGS, default="ppmi")
+    parser.add_argument("--methods", choices=SCORES, nargs="+", default=SCORES)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    if args.command == "count":
+        if not args.corpus or not args.vocab:
+            parser.error("count needs --corpus and --vocab")
+        words = read_vocab(args.vocab, args.max_vocab)
+        matrix = count(args.corpus, words, args.window, args.workers, args.chunk_mb, args.encoding, not args.cased)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        matrix.save(args.output)
+        size = sum(os.path.getsize(p) for p in args.corpus)
+        elapsed = time.time() - t0
+        logger.info(f"{len(words)} palavras, {matrix.nnz} co-ocorrências em {elapsed:.1f}s "
+                    f"({size / (1 << 30) / (elapsed / 3600):.2f} GB/h) -> {args.output}")
+        return
+
+    from dataset_index import dataset_files, read_dataset
+
+    if not args.matrix or not args.eval_path:
+        parser.error("score needs --matrix and --eval_path")
+    matrix = Cooccurrence.load(args.matrix)
+    if args.weighting == "ppmi":
+        matrix = matrix.ppmi()
+    name = args.name or os.path.splitext(os.path.basename(args.matrix))[0] + "_cooc"
+    out_dir = os.path.join(args.output, name)
+    os.makedirs(out_dir, exist_ok=True)
+    f_info = open(os.path.join(out_dir, "info.tsv"), mode="a", encoding="utf-8")
+    f_info.write("model\tdataset\tN\toov\thyper_num\tinclude_oov\n")
+    for file_dataset, path_dataset in dataset_files(args.eval_path, args.index):
+        result, oov = score_dataset(matrix, read_dataset(path_dataset), args.methods, not args.cased)
+        hyper_num = sum(1 for key in result if key.split()[-1] == "hyper")
+        with open(os.path.join(out_dir, os.path.splitext(file_dataset)[0] + ".json"), mode="w",
+                  encoding="utf-8") as f_out:
+            f_out.write(json.dumps(result, ensure_ascii=False))
+        f_info.write(f"{name}\t{file_dataset}\t{len(result)}\t{oov}\t{hyper_num}\tTrue\n")
+        logger.info(f"{file_dataset}: {len(result)} pares ({oov} fora do vocabulário)")
+    f_info.close()
+    logger.info(f"Done! {time.time() - t0:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+Índice de pares (hipônimo, hiperônimo) de todos os datasets de um diretório.
+
+    - duplicatas dentro de cada arquivo (mesmo par repetido, com o mesmo rótulo ou com rótulos diferentes)
+    - sobreposição entre arquivos (ex.: conceptnet-hypernym-1 vs conceptnet-hypernym-allrelation)
+    - lista única (union.tsv) com cada par uma só vez, para ser pontuada uma única vez pelos scorers
+    - index.json, que o bert-eval.py usa para distribuir o resultado da união de volta para cada dataset
+
+Uso:
+    python dataset_index.py -e datasets -o work/union
+    python bert_portuguese.py -m <model> -b -e datasets -i work/union/index.json -o results
+    python bert-eval.py -i results/<model> -e datasets --index work/union/index.json -o results --vocabs vocabs
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import uuid
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+UNION_NAME = "union.tsv"
+INFO_HEADER = "model\tdataset\tN\toov\thyper_num\tinclude_oov\n"
+
+
+def pair_hash(hypo, hyper):
+    return int.from_bytes(hashlib.blake2b(f"{hypo}\t{hyper}".encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def load_eval_file(f_in):
+    """ linhas [hipônimo, hiperônimo, is_hyper, relação] de um tsv de avaliação já aberto """
+    eval_data = []
+    for line in f_in:
+        child, parent, is_hyper, rel = line.strip().split('\t')
+        eval_data.append([child.strip(), parent.strip(), is_hyper.strip(), rel.strip()])
+    return eval_data
+
+
+def read_dataset(path):
+    with open(path, mode="r", encoding="utf-8") as f:
+        return load_eval_file(f)
+
+
+class DatasetIndex:
+    def __init__(self):
+        # hash do par -> posição na união
+        self.pair_position = {}
+        self.union = []
+        # nome do dataset -> posição na união de cada linha, na ordem do arquivo
+        self.datasets = {}
+        self.paths = {}
+        self.duplicates = {}
+        self.conflicts = {}
+
+    def add(self, name, dataset, path=None):
+        positions = []
+        labels = {}
+        rows = Counter()
+        for row in dataset:
+            h = pair_hash(row[0], row[1])
+            if h not in self.pair_position:
+                self.pair_position[h] = len(self.union)
+                self.union.append(row)
+            positions.append(self.pair_position[h])
+            rows[h] += 1
+            labels.setdefault(h, set()).add((row[2], row[3]))
+        self.datasets[name] = positions
+        if path is not None:
+            self.paths[name] = os.path.abspath(path)
+        self.duplicates[name] = sum(c - 1 for c in rows.values())
+        self.conflicts[name] = sum(1 for v in labels.values() if len(v) > 1)
+
+    def overlap(self, name_a, name_b):
+        return len(set(self.datasets[name_a]) & set(self.datasets[name_b]))
+
+    def report(self, f_out):
+        f_out.write("dataset\tN\tunique\tduplicates\tlabel_conflicts\n")
+        for name, positions in self.datasets.items():
+            f_out.write(f"{name}\t{len(positions)}\t{len(set(positions))}\t{self.duplicates[name]}\t"
+                        f"{self.conflicts[name]}\n")
+        f_out.write("\ndataset_a\tdataset_b\toverlap\tfrac_a\tfrac_b\n")
+        names = list(self.datasets)
+        for i, name_a in enumerate(names):
+            for name_b in names[i + 1:]:
+                n = self.overlap(name_a, name_b)
+                f_out.write(f"{name_a}\t{name_b}\t{n}\t{n / len(set(self.datasets[name_a])):.4f}\t"
+                            f"{n / len(set(self.datasets[name_b])):.4f}\n")
+        total = sum(len(p) for p in self.datasets.values())
+        f_out.write(f"\ntotal\t{total}\tunion\t{len(self.union)}\n")
+
+    def save(self, output_path):
+        os.makedirs(output_path, exist_ok=True)
+        with open(os.path.join(output_path, UNION_NAME), mode="w", encoding="utf-8") as f:
+            for row in self.union:
+                f.write("\t".join(row) + "\n")
+        with open(os.path.join(output_path, "index.json"), mode="w", encoding="utf-8") as f:
+            json.dump({"union": UNION_NAME, "datasets": self.datasets, "dataset_paths": self.paths}, f)
+
+
+def build_index(eval_path):
+    index = DatasetIndex()
+    for filename in sorted(os.listdir(eval_path)):
+        if os.path.isfile(os.path.join(eval_path, filename)):
+            logger.info(f"Indexando {filename}")
+            index.add(filename, read_dataset(os.path.join(eval_path, filename)), os.path.join(eval_path, filename))
+    return index
+
+
+def load_index(path_index):
+    with open(path_index, encoding="utf-8") as f:
+        index = json.load(f)
+    index["union_path"] = os.path.join(os.path.dirname(path_index), index["union"])
+    return index
+
+
+def fan_out(index, union_result, sep=" "):
+    """
+    Distribui o resultado da união para cada dataset do índice.
+
+    :param union_result: {'hipo hyper True hyper': {...}} com as chaves das linhas de union.tsv
+    :return: {dataset_name: {'hipo hyper True hyper': {...}}} com as chaves das linhas de cada dataset
+    """
+    union = read_dataset(index["union_path"])
+    union_values = [union_result.get(sep.join(row)) for row in union]
+    results = {}
+    for name, positions in index["datasets"].items():
+        rows = read_dataset_rows(index, name, union)
+        results[name] = {}
+        for row, p in zip(rows, positions):
+            if union_values[p] is not None:
+                results[name][sep.join(row)] = union_values[p]
+    return results
+
+
+def read_dataset_rows(index, name, union):
+    # linhas originais do dataset (com os rótulos dele); sem o arquivo, usa a linha da união
+    # (mesmo par, rótulo da primeira ocorrência)
+    dataset_path = index.get("dataset_paths", {}).get(name)
+    if dataset_path and os.path.isfile(dataset_path):
+        return read_dataset(dataset_path)
+    return [union[p] for p in index["datasets"][name]]
+
+
+def dataset_files(eval_path, path_index=None):
+    """ (nome, caminho) dos arquivos que um scorer deve pontuar: só a união quando há índice """
+    if path_index:
+        index = load_index(path_index)
+        return [(index["union"], index["union_path"])]
+    if os.path.isfile(eval_path):
+        return [(os.path.basename(eval_path), eval_path)]
+    return [(name, os.path.join(eval_path, name)) for name in os.listdir(eval_path)
+            if os.path.isfile(os.path.join(eval_path, name))]
+
+
+def model_output_dir(model_name, mode="bert_score"):
+    """ diretório dos resultados de um modelo em <output>: <model>[_<mode>], como o bert-eval.py espera """
+    model_dir = model_name.replace("/", "-")
+    return model_dir if mode == "bert_score" else f"{model_dir}_{mode}"
+
+
+def write_atomic(path, text):
+    """ grava num temporário e renomeia: quem lê nunca vê o arquivo pela metade """
+    tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+    with open(tmp, mode="w", encoding="utf-8") as f_out:
+        f_out.write(text)
+        f_out.flush()
+        os.fsync(f_out.fileno())
+    os.replace(tmp, path)
+
+
+def append_info(out_dir, model_name, dataset_name, n, oov_num=0, hyper_num=0, include_oov=True):
+    """ uma linha no info.tsv do diretório do modelo; o cabeçalho só é escrito num arquivo novo """
+    with open(os.path.join(out_dir, "info.tsv"), mode="a", encoding="utf-8") as f_info:
+        if f_info.tell() == 0:
+            f_info.write(INFO_HEADER)
+        f_info.write(f"{model_name.replace('/', '-')}\t{dataset_name}\t{n}\t{oov_num}\t{hyper_num}\t{include_oov}\n")
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--eval_path", type=str, help="dir datasets", required=True)
+    parser.add_argument("-o", "--output_path", type=str, help="dir output (union.tsv, index.json, report.tsv)",
+                        required=True)
+    args = parser.parse_args()
+
+    index = build_index(args.eval_path)
+    index.save(args.output_path)
+    with open(os.path.join(args.output_path, "report.tsv"), mode="w", encoding="utf-8") as f_out:
+        index.report(f_out)
+    total = sum(len(p) for p in index.datasets.values())
+    logger.info(f"{total} linhas em {len(index.datasets)} datasets, {len(index.union)} pares únicos "
+                f"({1 - len(index.union) / max(total, 1):.1%} a menos para pontuar)")
+
+
+if __name__ == '__main__':
+    main()
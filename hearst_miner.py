@@ -0,0 +1,191 @@
+"""
+Minerador de pares candidatos (hipônimo, hiperônimo) com padrões de Hearst em corpus bruto (ukWaC, BrWaC).
+
+Todos os padrões ("{} é um tipo de {}", ...) viram uma única expressão regular com as partes fixas em
+alternação (as mais longas primeiro), então cada linha é percorrida uma só vez. O corpus é dividido em
+faixas de bytes alinhadas em fim de linha e cada faixa é lida e minerada por um processo.
+
+Saída (-o pares.tsv), ordenada por contagem, no formato de 4 colunas dos datasets para ir direto ao scorer:
+    hipônimo  hiperônimo  contagem  id_padrão:contagem,id_padrão:contagem
+e patterns/pares.json, num subdiretório para não entrar na lista de datasets do scorer, com a lista de padrões
+(o id é a posição na lista).
+
+Uso:
+    python hearst_miner.py -c ukwac_subset_100M.txt --encoding ISO-8859-1 --en -o mined/ukwac.tsv
+    python bert_portuguese.py -m <model> -b -e mined -o results
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from multiprocessing import Pool
+
+from hearst_patterns import ALL_EN_PATTERNS, ALL_PATTERNS
+
+logger = logging.getLogger(__name__)
+
+WORD = r"[^\W\d_]+(?:-[^\W\d_]+)*"
+
+
+class PatternMatcher:
+    def __init__(self, patterns, lower=True, stopwords=()):
+        self.patterns = list(patterns)
+        self.lower = lower
+        self.stopwords = set(stopwords)
+        self.middle_id = {}
+        for i, pattern in enumerate(self.patterns):
+            middle = " ".join(pattern.format("", "").split())
+            if lower:
+                middle = middle.lower()
+            self.middle_id[middle] = i
+        middles = sorted(self.middle_id, key=len, reverse=True)
+        alternation = "|".join(r"\s+".join(re.escape(w) for w in m.split()) for m in middles)
+        # lookahead para achar também casamentos sobrepostos ("a é um b é um c")
+        self.regex = re.compile(rf"(?<!\S)(?=({WORD})\s+({alternation})\s+({WORD})(?!\S))")
+
+    def match(self, line):
+        if self.lower:
+            line = line.lower()
+        # o lookahead tenta um casamento em cada palavra, então uma palavra de dentro de um padrão longo abre um
+        # mais curto ("casa que é um exemplo de moradia" -> "que é um exemplo"); fica só o que não está contido
+        # num casamento que começou antes. Os encadeados ("a é um b é um c") se sobrepõem sem estar contidos.
+        end = -1
+        for m in self.regex.finditer(line):
+            if m.end(3) <= end:
+                continue
+            end = m.end(3)
+            hypo, middle, hyper = m.group(1), m.group(2), m.group(3)
+            if hypo in self.stopwords or hyper in self.stopwords:
+                continue
+            yield hypo, hyper, self.middle_id[" ".join(middle.split())]
+
+
+def split_ranges(path, n_chunks):
+    size = os.path.getsize(path)
+    step = max(1, size // max(1, n_chunks))
+    return [(path, start, min(start + step, size)) for start in range(0, size, step)]
+
+
+def read_range(path, start, end, encoding):
+    # a linha que começa antes de `start` pertence à faixa anterior
+    with open(path, mode="rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line.decode(encoding, errors="replace")
+
+
+_matcher = None
+
+
+def _init_worker(patterns, lower, stopwords):
+    global _matcher
+    _matcher = PatternMatcher(patterns, lower, stopwords)
+
+
+def mine_range(task):
+    path, start, end, encoding = task
+    counts = Counter()
+    for line in read_range(path, start, end, encoding):
+        if line.startswith("CURRENT URL"):
+            continue
+        counts.update(_matcher.match(line))
+    return counts, end - start
+
+
+def mine(corpus_paths, patterns, workers=None, chunk_mb=64, encoding="utf-8", lower=True, stopwords=()):
+    """ Counter {(hipo, hyper, id_padrão): contagem} de todos os arquivos """
+    tasks = []
+    for path in corpus_paths:
+        n_chunks = max(1, os.path.getsize(path) // (chunk_mb << 20))
+        tasks.extend((p, s, e, encoding) for p, s, e in split_ranges(path, n_chunks))
+    total_bytes = sum(e - s for _, s, e, _ in tasks)
+    counts = Counter()
+    done = 0
+    t0 = time.time()
+    with Pool(workers, initializer=_init_worker, initargs=(patterns, lower, set(stopwords))) as pool:
+        for chunk_counts, n_bytes in pool.imap_unordered(mine_range, tasks):
+            counts.update(chunk_counts)
+            done += n_bytes
+            elapsed = time.time() - t0
+            logger.info(f"{done / total_bytes:.1%} do corpus, {done / (1 << 20) / max(elapsed, 1e-9):.1f} MB/s, "
+                        f"{len(counts)} candidatos")
+    return counts
+
+
+def aggregate(counts, min_count=1):
+    """ [(hipo, hyper, total, {id_padrão: contagem})] ordenado por total """
+    pairs = {}
+    for (hypo, hyper, pattern_id), n in counts.items():
+        by_pattern = pairs.setdefault((hypo, hyper), Counter())
+        by_pattern[pattern_id] += n
+    rows = [(hypo, hyper, sum(c.values()), c) for (hypo, hyper), c in pairs.items()]
+    rows = [r for r in rows if r[2] >= min_count]
+    rows.sort(key=lambda r: (-r[2], r[0], r[1]))
+    return rows
+
+
+def patterns_path(path_out):
+    """ lista de padrões de um arquivo de candidatos: fora do diretório que o scorer lê como datasets """
+    out_dir, name = os.path.split(os.path.abspath(path_out))
+    return os.path.join(out_dir, "patterns", os.path.splitext(name)[0] + ".json")
+
+
+def write_candidates(rows, patterns, path_out):
+    os.makedirs(os.path.dirname(os.path.abspath(path_out)), exist_ok=True)
+    with open(path_out, mode="w", encoding="utf-8") as f_out:
+        for hypo, hyper, total, by_pattern in rows:
+            ids = ",".join(f"{i}:{n}" for i, n in sorted(by_pattern.items()))
+            f_out.write(f"{hypo}\t{hyper}\t{total}\t{ids}\n")
+    os.makedirs(os.path.dirname(patterns_path(path_out)), exist_ok=True)
+    with open(patterns_path(path_out), mode="w", encoding="utf-8") as f_out:
+        json.dump(patterns, f_out, ensure_ascii=False)
+
+
+def read_candidates(path):
+    """ Lê o arquivo de candidatos: [(hipo, hyper, total, {id_padrão: contagem})] """
+    rows = []
+    with open(path, mode="r", encoding="utf-8") as f:
+        for line in f:
+            hypo, hyper, total, ids = line.rstrip("\n").split("\t")
+            by_pattern = {int(i): int(n) for i, n in (x.split(":") for x in ids.split(","))}
+            rows.append((hypo, hyper, int(total), by_pattern))
+    return rows
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--corpus", type=str, nargs="+", help="corpus text files", required=True)
+    parser.add_argument("-o", "--output", type=str, help="candidate pairs tsv", required=True)
+    parser.add_argument("--en", action="store_true", help="use the english patterns")
+    parser.add_argument("--encoding", type=str, default="utf-8")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="default: all cores")
+    parser.add_argument("--chunk_mb", type=int, default=64)
+    parser.add_argument("--min_count", type=int, default=1)
+    parser.add_argument("--cased", action="store_true", help="do not lower case the corpus")
+    parser.add_argument("--stopwords", type=str, help="stop word list (one per line)", required=False)
+    args = parser.parse_args()
+
+    patterns = ALL_EN_PATTERNS if args.en else ALL_PATTERNS
+    stopwords = set(open(args.stopwords, encoding="utf-8").read().splitlines()) if args.stopwords else set()
+    t0 = time.time()
+    counts = mine(args.corpus, patterns, args.workers, args.chunk_mb, args.encoding, not args.cased, stopwords)
+    rows = aggregate(counts, args.min_count)
+    write_candidates(rows, patterns, args.output)
+    size = sum(os.path.getsize(p) for p in args.corpus)
+    elapsed = time.time() - t0
+    logger.info(f"{len(rows)} pares em {elapsed:.1f}s ({size / (1 << 30) / (elapsed / 3600):.2f} GB/h)")
+
+
+if __name__ == '__main__':
+    main()
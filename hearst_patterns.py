@@ -0,0 +1,41 @@
+"""
+Padrões de Hearst usados pelos scorers, pelo avaliador e pelo minerador de corpus.
+"""
+
+PATTERNS = ["{} é um tipo de {}", "{} é um {}", "{} e outros {}", "{} ou outro {}", "{} , um {}"]
+EN_PATTERNS = ["{} is a type of {}", "{} is a {}", "{} and others {}", "{} or others {}", "{} , a {}"]
+
+# 2018 RoolerEtal - Hearst Patterns Revisited
+PATTERNS2 = ["{} que é um exemplo de {}", "{} que é uma classe de {}", "{} que é um tipo de {}",
+             "{} e qualquer outro {}", "{} e algum outro {}", "{} ou qualquer outro {}", "{} ou algum outro {}",
+             "{} que é chamado de {}",
+             "{} é um caso especial de {}",
+             "{} incluindo {}"]
+
+EN_PATTERNS2 = ["{} which is a example of {}", "{} which is a class of {}", "{} which is kind of {}",
+                "{} and any other {}", "{} and some other {}", "{} or any other {}", "{} or some other {}",
+                "{} which is called {}",
+                "{} a special case of {}",
+                "{} including {}"]
+
+ALL_PATTERNS = PATTERNS + PATTERNS2
+ALL_EN_PATTERNS = EN_PATTERNS + EN_PATTERNS2
+
+# padrões ordenados pelo AP no ontoPT-validation
+BEST_BERT_SCORE = ['{} que é um exemplo de {}', '{} incluindo {}', '{} que é chamado de {}', '{} é um tipo de {}',
+                   '{} é um {}', '{} e outros {}', '{} que é um tipo de {}', '{} é um caso especial de {}',
+                   '{} que é uma classe de {}', '{} e qualquer outro {}', '{} ou qualquer outro {}', '{} , um {}',
+                   '{} ou outro {}', '{} ou algum outro {}', '{} e algum outro {}']
+
+EN_BEST_PATTERNS = ['{} or some other {}', '{} or any other {}', '{} and any other {}', '{} is a type of {}',
+                    '{} and some other {}', '{} which is kind of {}', '{} a special case of {}', '{} is a {}',
+                    '{} which is a example of {}', '{} and others {}', '{} which is called {}',
+                    '{} which is a class of {}', '{} or others {}', '{} , a {}', '{} including {}']
+
+HYPENET_BEST_PATTERNS = ['{} or some other {}', '{} or any other {}', '{} and any other {}', '{} is a type of {}',
+                         '{} which is kind of {}', '{} and some other {}', '{} is a {}', '{} a special case of {}',
+                         '{} which is a example of {}', '{} and others {}', '{} which is called {}',
+                         '{} or others {}', '{} which is a class of {}', '{} , a {}', '{} including {}']
+
+# conjuntos de padrões escolhidos por --patterns nas ferramentas de pontuação
+PATTERN_SETS = {"all_en": ALL_EN_PATTERNS, "all": ALL_PATTERNS, "best": BEST_BERT_SCORE, "en_best": EN_BEST_PATTERNS}
@@ -0,0 +1,211 @@
+"""
+Recuperação de hiperônimos: "quais são os hiperônimos de X?" sem pontuar pares explícitos.
+
+Para cada hipônimo e padrão a posição do hiperônimo é mascarada uma vez e a distribuição do MLM nessa posição
+pontua todos os candidatos de um wordpiece de uma só vez. Candidatos com L wordpieces (de um vocabs/*/vocab.txt)
+são pontuados com beam search da esquerda para a direita sobre L máscaras, restrito a uma trie dos candidatos:
+score = soma dos log p de cada wordpiece dado os anteriores, L forwards (em lote) por padrão e tamanho.
+Candidatos que saem do beam ficam sem score no padrão e vão para o fim do ranking daquele padrão.
+
+Para candidatos de um wordpiece a ordem em cada padrão é a mesma do bert_sentence_score (logit e log p diferem
+por uma constante da sentença). Os padrões são combinados com o min/mean positional rank do bert-eval.py (ranking.py).
+
+Uso:
+    python hypernym_retrieval.py -m neuralmind/bert-base-portuguese-cased -w gato banana \\
+        -c vocabs/wikipedia15M/vocab.txt -k 20 -o hypernyms.json
+"""
+import argparse
+import json
+import logging
+import os
+
+import torch
+import torch.nn.functional as f
+
+from hearst_patterns import BEST_BERT_SCORE
+from ranking import positional_ranks
+
+logger = logging.getLogger(__name__)
+
+
+class CandidateTrie:
+    """ candidatos agrupados por número de wordpieces; prefixos válidos de cada tamanho """
+
+    def __init__(self, candidates):
+        # candidates: {palavra: [ids]}
+        self.by_length = {}
+        self.prefixes = {}
+        for word, ids in candidates.items():
+            ids = tuple(ids)
+            if not ids:
+                continue
+            self.by_length.setdefault(len(ids), {})[ids] = word
+            for i in range(len(ids)):
+                self.prefixes.setdefault((len(ids), ids[:i]), set()).add(ids[i])
+
+    def next_tokens(self, length, prefix):
+        return self.prefixes.get((length, tuple(prefix)), set())
+
+
+def single_wordpiece_candidates(tokenizer):
+    """ todo o vocabulário do BERT, menos tokens especiais e continuações (##) """
+    special = set(tokenizer.all_special_ids)
+    return {token: [i] for token, i in tokenizer.vocab.items() if i not in special and not token.startswith("##")
+            and not token.startswith("[unused")}
+
+
+class HypernymRetriever:
+    def __init__(self, cloze, candidates=None, beam_size=50, max_len=4):
+        """
+        :param cloze: ClozeBert (bert_portuguese.py)
+        :param candidates: {palavra: [ids]}; None usa os candidatos de um wordpiece do vocabulário
+        """
+        self.cloze = cloze
+        self.tokenizer = cloze.tokenizer
+        if candidates is None:
+            candidates = single_wordpiece_candidates(self.tokenizer)
+        candidates = {w: ids for w, ids in candidates.items() if 0 < len(ids) <= max_len}
+        self.trie = CandidateTrie(candidates)
+        self.beam_size = beam_size
+        self.n_forwards = 0
+
+    def _forward(self, sentences):
+        max_len = max(len(s) for s in sentences)
+        pad = self.tokenizer.pad_token_id
+        input_ids = torch.tensor([s + [pad] * (max_len - len(s)) for s in sentences], device=self.cloze.device)
+        attention_mask = torch.tensor([[1] * len(s) + [0] * (max_len - len(s)) for s in sentences],
+                                      device=self.cloze.device)
+        self.cloze.model.eval()
+        with torch.no_grad():
+            outputs = self.cloze.model(input_ids, attention_mask=attention_mask)
+        self.n_forwards += 1
+        return f.log_softmax(outputs[0], dim=-1)
+
+    def _context(self, hyponym, pattern):
+        # mesma montagem do build_sentences_n_subtoken: [CLS] hipônimo padrão <hiperônimo> [SEP]
+        pattern_tokenize = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(pattern.format("", "").strip()))
+        return [self.tokenizer.cls_token_id] + self.cloze.word_ids(hyponym) + pattern_tokenize, \
+            [self.tokenizer.sep_token_id]
+
+    @staticmethod
+    def _sentence(context, hypernym_ids):
+        antes, depois = context
+        return antes + hypernym_ids + depois, len(antes)
+
+    def score_length(self, context, length):
+        """ {palavra: log p} dos candidatos de `length` wordpieces que sobreviveram ao beam """
+        words = self.trie.by_length.get(length)
+        if not words:
+            return {}
+        mask = self.tokenizer.mask_token_id
+        # beam: [(prefixo, log p acumulado)]
+        beam = [((), 0.0)]
+        for step in range(length):
+            sentences = []
+            start = None
+            for prefix, _ in beam:
+                sentence, start = self._sentence(context, list(prefix) + [mask] * (length - step))
+                sentences.append(sentence)
+            log_probs = self._forward(sentences)[:, start + step]
+            expanded = []
+            for row, (prefix, score) in enumerate(beam):
+                allowed = self.trie.next_tokens(length, prefix)
+                if not allowed:
+                    continue
+                allowed = torch.tensor(sorted(allowed), device=log_probs.device)
+                values = log_probs[row, allowed]
+                k = min(self.beam_size, len(allowed))
+                top = torch.topk(values, k)
+                for v, i in zip(top.values.tolist(), allowed[top.indices].tolist()):
+                    expanded.append((prefix + (i,), score + v))
+            expanded.sort(key=lambda x: x[1], reverse=True)
+            beam = expanded[:self.beam_size] if step < length - 1 else expanded
+        return {words[prefix]: score for prefix, score in beam if prefix in words}
+
+    def score_single(self, context):
+        """ um forward: log p de todos os candidatos de um wordpiece """
+        words = self.trie.by_length.get(1, {})
+        if not words:
+            return {}
+        sentence, start = self._sentence(context, [self.tokenizer.mask_token_id])
+        log_probs = self._forward([sentence])[0, start]
+        ids = torch.tensor([prefix[0] for prefix in words], device=log_probs.device)
+        return dict(zip(words.values(), log_probs[ids].tolist()))
+
+    def rank(self, hyponym, patterns, top_k=50, sub_method="min_positional_rank"):
+        """ [(palavra, rank agregado, {padrão: log p})] dos top_k hiperônimos de `hyponym` """
+        scores = {}
+        for pattern in patterns:
+            context = self._context(hyponym, pattern)
+            by_word = self.score_single(context)
+            for length in sorted(self.trie.by_length):
+                if length > 1:
+                    by_word.update(self.score_length(context, length))
+            by_word.pop(hyponym, None)
+            for word, score in by_word.items():
+                scores.setdefault(word, {})[pattern] = score
+
+        # candidato sem score num padrão fica no fim daquele padrão
+        new_pairs = {w: {p: s.get(p, float("-inf")) for p in patterns} for w, s in scores.items()}
+        pair_position = positional_ranks(new_pairs, patterns)
+        if sub_method == "mean_positional_rank":
+            final = {w: sum(pos) / len(pos) for w, pos in pair_position.items()}
+        else:
+            final = {w: min(pos) for w, pos in pair_position.items()}
+        order = sorted(final.items(), key=lambda x: x[1])[:top_k]
+        return [(w, r, scores[w]) for w, r in order]
+
+
+def read_candidates(cloze, path, table_dir=None):
+    """ palavras de um vocab.txt (ou lista de palavras) e seus wordpieces, pela tabela wordpiece se houver """
+    from wordpiece_table import load_or_build, read_words
+    if table_dir:
+        table = load_or_build(cloze.tokenizer, cloze.model_name, path, table_dir)
+        return {w: table.token_ids(w) for w in table.words}
+    words = read_words(path)
+    cloze.prepare_words([[w, w] for w in words])
+    return {w: cloze.word_ids(w) for w in words}
+
+
+def main():
+    from bert_portuguese import ClozeBert
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_name", type=str, help="path to bert models", required=True)
+    parser.add_argument("-w", "--hyponyms", type=str, nargs="+", help="hyponyms (or a file with one per line)",
+                        required=True)
+    parser.add_argument("-c", "--candidates", type=str, required=False,
+                        help="vocab.txt with the candidate hypernyms (default: single wordpieces of the model)")
+    parser.add_argument("-t", "--table_dir", type=str, required=False, help="dir of wordpiece tables")
+    parser.add_argument("-n", "--n_patterns", type=int, default=len(BEST_BERT_SCORE),
+                        help="use the n best patterns of BEST_BERT_SCORE")
+    parser.add_argument("-k", "--top_k", type=int, default=50)
+    parser.add_argument("--beam_size", type=int, default=50)
+    parser.add_argument("--max_len", type=int, default=4, help="max wordpieces of a candidate")
+    parser.add_argument("--mean", action="store_true", help="mean positional rank instead of min")
+    parser.add_argument("-o", "--output", type=str, required=True)
+    args = parser.parse_args()
+
+    cloze = ClozeBert(args.model_name)
+    candidates = read_candidates(cloze, args.candidates, args.table_dir) if args.candidates else None
+    retriever = HypernymRetriever(cloze, candidates, args.beam_size, args.max_len)
+    hyponyms = args.hyponyms
+    if len(hyponyms) == 1 and os.path.isfile(hyponyms[0]):
+        hyponyms = open(hyponyms[0], encoding="utf-8").read().split()
+
+    patterns = BEST_BERT_SCORE[:args.n_patterns]
+    sub_method = "mean_positional_rank" if args.mean else "min_positional_rank"
+    result = {}
+    for hyponym in hyponyms:
+        result[hyponym] = retriever.rank(hyponym, patterns, args.top_k, sub_method)
+        logger.info(f"{hyponym}: {[w for w, _, _ in result[hyponym][:10]]}")
+    logger.info(f"{retriever.n_forwards} forwards para {len(hyponyms)} hipônimos")
+    with open(args.output, mode="w", encoding="utf-8") as f_out:
+        f_out.write(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Pontuação incremental: compara a grade pedida (pares x padrões x modo x modelo) com o que já está no diretório de
+resultados e pontua só as células que faltam, juntando-as aos resultados existentes.
+
+Os resultados ficam no layout de sempre (o do bert_portuguese.py -b, work_queue.py e pipeline.py):
+    <output>/<modelo>/<dataset>.json              (modo bert_score)
+    <output>/<modelo>_<modo>/<dataset>.json       (outros modos)
+
+Para cada arquivo, os pares são agrupados pelo conjunto de padrões que falta (um padrão novo: todos os pares com
+esse padrão só; pares novos no tsv: esses pares com todos os padrões) e cada grupo vai para o scoring.score em
+lote. O arquivo novo é gravado num temporário e renomeado (os.replace), então quem lê vê o resultado antigo ou o
+novo inteiro, nunca um meio-termo. Pares e padrões que já estão no resultado e não foram pedidos ficam lá.
+
+Uso:
+    python incremental.py -m neuralmind/bert-base-portuguese-cased -e datasets -o results --dry_run
+    python incremental.py -m <model> -e datasets/ontoPT-test.tsv -o results --extra_patterns "{} é uma espécie de {}"
+    python incremental.py -m <model1> <model2> --modes bert_score bert_score_2 -e datasets -o results
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+def load_result(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path, encoding="utf-8") as f_in:
+        return json.load(f_in)
+
+
+def missing_cells(result, rows, patterns):
+    """ {tupla de padrões que faltam: [linhas]}, na ordem das linhas """
+    groups = defaultdict(list)
+    seen = set()
+    for row in rows:
+        key = " ".join(row)
+        if key in seen:
+            continue
+        seen.add(key)
+        done = result.get(key, {})
+        missing = tuple(p for p in patterns if p not in done)
+        if missing:
+            groups[missing].append(row)
+    return groups
+
+
+def merge(result, new, rows):
+    """ result com as células de new; pares na ordem do dataset, seguidos dos que só estavam em result """
+    merged = {}
+    for row in rows:
+        key = " ".join(row)
+        if key not in merged and (key in result or key in new):
+            merged[key] = {**result.get(key, {}), **new.get(key, {})}
+    for key, by_pattern in result.items():
+        if key not in merged:
+            merged[key] = by_pattern
+    return merged
+
+
+def plan(models, modes, datasets, patterns, output_path):
+    """ [(modelo, modo, nome do dataset, caminho do resultado, linhas, {padrões: linhas})] com algo a pontuar """
+    from dataset_index import model_output_dir
+
+    jobs = []
+    for model_name in models:
+        for mode in modes:
+            out_dir = os.path.join(output_path, model_output_dir(model_name, mode))
+            for name, rows in datasets.items():
+                path = os.path.join(out_dir, os.path.splitext(name)[0] + ".json")
+                groups = missing_cells(load_result(path), rows, patterns)
+                n_cells = sum(len(g) * len(p) for p, g in groups.items())
+                n_pairs = len({" ".join(row) for row in rows})
+                logger.info(f"{model_name} {mode} {name}: {n_cells} de {n_pairs * len(patterns)} células a pontuar")
+                if groups:
+                    jobs.append((model_name, mode, name, path, rows, groups))
+    return jobs
+
+
+def run_job(cloze, job, batch_tokens=8192, pack_tokens=None):
+    """ pontua as células que faltam de um arquivo e grava o resultado junto; devolve as células novas """
+    import scoring
+    from dataset_index import append_info, write_atomic
+
+    model_name, mode, name, path, rows, groups = job
+    new = defaultdict(dict)
+    n_cells = 0
+    for patterns, group_rows in groups.items():
+        for key, by_pattern in scoring.score(cloze, group_rows, list(patterns), mode, batch_tokens,
+                                             pack_tokens).items():
+            new[key].update(by_pattern)
+        n_cells += len(group_rows) * len(patterns)
+    # relido agora: outro processo pode ter gravado o arquivo enquanto este pontuava
+    merged = merge(load_result(path), new, rows)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, json.dumps(merged, ensure_ascii=False))
+    append_info(os.path.dirname(path), model_name, name, len(merged))
+    return n_cells
+
+
+def main():
+    from bert_portuguese import ClozeBert, load_eval_file
+    from dataset_index import dataset_files
+    from hearst_patterns import PATTERN_SETS
+    from scoring import MODES
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    pattern_sets = dict(PATTERN_SETS, none=[])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_names", type=str, nargs="+", help="bert models or snapshot dirs",
+                        required=True)
+    parser.add_argument("-e", "--eval_path", type=str, help="dataset file or dir of datasets", required=True)
+    parser.add_argument("-o", "--output_path", type=str, help="dir of the results", required=True)
+    parser.add_argument("-i", "--index", type=str, required=False, help="dataset index (dataset_index.py)")
+    parser.add_argument("--modes", choices=MODES, nargs="+", default=["bert_score"])
+    parser.add_argument("--patterns", choices=list(pattern_sets), default="all_en",
+                        help="all_en is the list bert_portuguese.py -b uses")
+    parser.add_argument("--extra_patterns", type=str, nargs="+", default=[],
+                        help="patterns not in the set, with two {} (hyponym, hypernym)")
+    parser.add_argument("--batch_tokens", type=int, default=8192)
+    parser.add_argument("--pack_tokens", type=int, default=None, help="pack sentences into rows of this size")
+    parser.add_argument("--dry_run", action="store_true", help="only report the missing cells")
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    args = parser.parse_args()
+
+    for pattern in args.extra_patterns:
+        if pattern.count("{}") != 2:
+            parser.error(f"pattern without two {{}}: {pattern}")
+    patterns = list(pattern_sets[args.patterns]) + [p for p in args.extra_patterns
+                                                    if p not in pattern_sets[args.patterns]]
+    if not patterns:
+        parser.error("no patterns")
+    datasets = {}
+    for name, path in dataset_files(args.eval_path, args.index):
+        with open(path, encoding="utf-8") as f_in:
+            datasets[name] = load_eval_file(f_in)
+
+    jobs = plan(args.model_names, args.modes, datasets, patterns, args.output_path)
+    total = sum(len(g) * len(p) for job in jobs for p, g in job[5].items())
+    logger.info(f"{total} células a pontuar em {len(jobs)} arquivos")
+    if args.dry_run or not jobs:
+        return
+
+    cloze = None
+    t0 = time.time()
+    # um modelo carregado por vez: os jobs já vêm agrupados por modelo
+    for job in jobs:
+        if cloze is None or cloze.model_name != job[0]:
+            cloze = None
+            cloze = ClozeBert(job[0], fast_tokenizer=args.fast_tokenizer)
+            cloze.model_name = job[0]
+        n_cells = run_job(cloze, job, args.batch_tokens, args.pack_tokens)
+        logger.info(f"{job[0]} {job[1]} {job[2]}: {n_cells} células -> {job[3]}")
+    logger.info(f"{total} células em {time.time() - t0:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+Medidas leves dos loops de pontuação: tempo e número de chamadas por etapa, contadores, linha de progresso
+periódica (pares/s e ETA) e dump em JSON no fim, separado por modo (bert_score, bert_score_2, batched_...).
+
+Etapas: tokenize (prepare_words), build (montagem das sentenças), tensor (torch.tensor), forward, gather
+(indexação dos logits), capture (top-k das posições mascaradas, topk_capture.py), copy (device -> host,
+.cpu().tolist()) e serialize (json do save_bert_file). "total" é o tempo de parede de cada chamada do scorer e
+"untracked" o que sobra fora das etapas. Em GPU as operações são assíncronas: o tempo do forward aparece em boa
+parte no copy, que sincroniza.
+
+Um timer é um perf_counter na entrada e outro na saída (~0.3us), desprezível perto de um forward.
+
+Opcional: traces do torch.profiler em uma amostra dos forwards (um a cada profile_every, até max_traces), no
+formato do chrome://tracing:
+    python bert_portuguese.py -m <model> -b -e datasets -o results --metrics metrics.json --profile_dir traces
+"""
+import json
+import logging
+import os
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+STAGES = ["tokenize", "build", "tensor", "forward", "gather", "capture", "copy", "serialize"]
+
+
+class _Timer:
+    __slots__ = ("stats", "stage", "t0")
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.seconds[self.stage] += time.perf_counter() - self.t0
+        self.stats.calls[self.stage] += 1
+        return False
+
+
+class _NoProfile:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_PROFILE = _NoProfile()
+
+
+class ModeMetrics:
+    """ tempos, chamadas e contadores de um modo """
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = Counter()
+        self.calls = Counter()
+        self.counters = Counter()
+        self._timers = {}
+
+    def time(self, stage):
+        timer = self._timers.get(stage)
+        if timer is None:
+            timer = self._timers[stage] = _Timer(self, stage)
+        return timer
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def progress(self, total, every=None):
+        return Progress(self, total, METRICS.progress_every if every is None else every)
+
+    def report(self):
+        total = self.seconds["total"]
+        stages = {s: self.seconds[s] for s in STAGES if self.calls[s]}
+        result = {"total_seconds": total, "stages": stages,
+                  "untracked": max(0.0, total - sum(v for s, v in stages.items() if s != "serialize")),
+                  "calls": {s: self.calls[s] for s in stages}, "counters": dict(self.counters)}
+        if total > 0:
+            for name in ("pairs", "forwards", "sentences"):
+                if self.counters[name]:
+                    result[f"{name}_per_s"] = self.counters[name] / total
+        return result
+
+
+class Progress:
+    """ linha de progresso a cada `every` segundos com pares/s e ETA; finish() soma o tempo de parede no modo """
+
+    def __init__(self, stats, total, every=30.0):
+        self.stats = stats
+        self.total = total
+        self.every = every
+        self.done = 0
+        self.t0 = self.last = time.perf_counter()
+
+    def update(self, n=1):
+        self.done += n
+        now = time.perf_counter()
+        if self.every and now - self.last >= self.every:
+            self.last = now
+            rate = self.done / (now - self.t0)
+            if not self.total:
+                # iterável sem tamanho (score_pairs): sem ETA
+                logger.info(f"{self.stats.name}: {self.done} pares, {rate:.1f} pares/s")
+                return
+            eta = (self.total - self.done) / rate if rate > 0 else float("inf")
+            logger.info(f"{self.stats.name}: {self.done}/{self.total} pares ({self.done / self.total:.1%}), "
+                        f"{rate:.1f} pares/s, ETA {format_seconds(eta)}")
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.t0
+        self.stats.seconds["total"] += elapsed
+        self.stats.calls["total"] += 1
+        self.stats.count("pairs", self.done)
+        if self.every and elapsed >= self.every:
+            logger.info(f"{self.stats.name}: {self.done} pares em {format_seconds(elapsed)} "
+                        f"({self.done / elapsed:.1f} pares/s)")
+
+
+def format_seconds(seconds):
+    if seconds == float("inf"):
+        return "?"
+    seconds = int(seconds)
+    return f"{seconds // 3600:d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class Metrics:
+    def __init__(self):
+        self.modes = {}
+        self.last = None
+        self.progress_every = 30.0
+        self.profile_dir = None
+        self.profile_every = 100
+        self.max_traces = 5
+        self._forwards = 0
+        self._traces = 0
+
+    def mode(self, name):
+        stats = self.modes.get(name)
+        if stats is None:
+            stats = self.modes[name] = ModeMetrics(name)
+        self.last = stats
+        return stats
+
+    def current(self):
+        """ o último modo usado (ex.: o save_bert_file conta a serialização no modo que gerou o resultado) """
+        return self.last if self.last is not None else self.mode("default")
+
+    def enable_profiler(self, path, every=100, max_traces=5):
+        os.makedirs(path, exist_ok=True)
+        self.profile_dir = path
+        self.profile_every = max(1, every)
+        self.max_traces = max_traces
+
+    def profile(self, name="forward"):
+        """ contexto em volta de um forward: grava um trace do torch.profiler numa amostra deles """
+        if self.profile_dir is None:
+            return _NO_PROFILE
+        self._forwards += 1
+        if self._traces >= self.max_traces or (self._forwards - 1) % self.profile_every:
+            return _NO_PROFILE
+        self._traces += 1
+        return _Trace(os.path.join(self.profile_dir, f"{name}-{self._forwards:07d}.json"))
+
+    def report(self):
+        return {name: stats.report() for name, stats in self.modes.items()}
+
+    def dump(self, path, extra=None):
+        """ extra: outras chaves do json (ex.: a ocupação das etapas do pipeline.py) """
+        with open(path, mode="w", encoding="utf-8") as f_out:
+            json.dump({"date": time.strftime("%Y-%m-%d %H:%M:%S"), "modes": self.report(), **(extra or {})}, f_out,
+                      indent=2)
+        logger.info(f"Métricas em {path}")
+
+    def reset(self):
+        self.modes = {}
+        self.last = None
+        self._forwards = 0
+        self._traces = 0
+
+
+class _Trace:
+    def __init__(self, path):
+        self.path = path
+        self.profiler = None
+
+    def __enter__(self):
+        from torch.profiler import ProfilerActivity, profile
+        import torch
+        activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if torch.cuda.is_available() else [])
+        self.profiler = profile(activities=activities, record_shapes=True)
+        self.profiler.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.__exit__(*exc)
+        self.profiler.export_chrome_trace(self.path)
+        return False
+
+
+METRICS = Metrics()
+
+
+def add_arguments(parser):
+    """ opções de métricas para os main dos scorers """
+    parser.add_argument("--metrics", type=str, required=False, help="write per-mode stage timings (json) here")
+    parser.add_argument("--progress_every", type=float, default=30.0, help="seconds between progress lines (0: off)")
+    parser.add_argument("--profile_dir", type=str, required=False,
+                        help="write torch profiler traces of sampled forwards here")
+    parser.add_argument("--profile_every", type=int, default=100, help="trace one forward in every N")
+    parser.add_argument("--max_traces", type=int, default=5)
+
+
+def configure(args):
+    METRICS.progress_every = args.progress_every
+    if args.profile_dir:
+        METRICS.enable_profiler(args.profile_dir, args.profile_every, args.max_traces)
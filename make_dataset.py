@@ -2,8 +2,8 @@ import argparse
 import os
 import logging
 
-from bert_portuguese import ClozeBert
-from bert_portuguese import load_eval_file
+from dataset_index import load_eval_file
+from wordpiece_table import DEFAULT_TABLE_ROOT, load_or_build, load_tokenizer
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
@@ -11,9 +11,9 @@ logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message
                     level=logging.INFO)
 
 
-def write_dataset(data, name_dataset, path_out):
+def write_dataset(data, name_dataset, path_out, suffix="_token_1"):
     logger.info(f"salvando dataset {name_dataset}")
-    with open(os.path.join(path_out, name_dataset + "_token_1.tsv"), mode="w", encoding="utf-8") as f_out:
+    with open(os.path.join(path_out, name_dataset + suffix + ".tsv"), mode="w", encoding="utf-8") as f_out:
         for row in data:
             f_out.write("\t".join(row) + "\n")
 
@@ -24,26 +24,32 @@ def main():
     parser.add_argument("-m", "--model_name", type=str, help="path to bert models", required=True)
     parser.add_argument("-e", "--eval_path", type=str, help="path to datasets", required=True)
     parser.add_argument("-o", "--output_path", type=str, help="path to dir output", required=False)
+    parser.add_argument("-t", "--table_dir", type=str, help="dir of wordpiece tables", default=DEFAULT_TABLE_ROOT)
+    parser.add_argument("--max_hypo", type=int, help="max subtokens of the hyponym", default=1)
+    parser.add_argument("--max_hyper", type=int, help="max subtokens of the hypernym", default=1)
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
     args = parser.parse_args()
 
     logger.info("Iniciando make_dataset...")
-    bert = ClozeBert(args.model_name)
-    print(bert.tokenizer.tokenize("banana"))
-    print(bert.tokenizer.tokenize("tigre"))
-
-    for name in os.listdir(args.eval_path):
+    # só o tokenizer: os pesos do modelo não são usados aqui
+    tokenizer = load_tokenizer(args.model_name, args.fast_tokenizer)
+    # tamanhos de subtoken de todas as palavras dos datasets, tokenizados uma única vez
+    table = load_or_build(tokenizer, args.model_name, args.eval_path, args.table_dir)
+    if args.max_hypo == args.max_hyper:
+        suffix = f"_token_{args.max_hypo}"
+    else:
+        suffix = f"_token_{args.max_hypo}-{args.max_hyper}"
+
+    new_data = []
+    for name in sorted(os.listdir(args.eval_path)):
         if os.path.isfile(os.path.join(args.eval_path, name)):
-            if name == "conceptnet-hypernym-1.tsv":
-                new_data = []
-                with open(os.path.join(args.eval_path, name), mode="r", encoding="utf-8") as f:
-                    data = load_eval_file(f)
-                    for row in data:
-                        h_0, h_1 = bert.tokenizer.tokenize(row[0]), bert.tokenizer.tokenize(row[1])
-                        if len(h_0) == 1 and len(h_1) == 1:
-                            new_data.append(row)
-                write_dataset(new_data, name[:-4], args.output_path)
-
-    return bert, new_data
+            with open(os.path.join(args.eval_path, name), mode="r", encoding="utf-8") as f:
+                data = load_eval_file(f)
+            new_data = table.filter_pairs(data, args.max_hypo, args.max_hyper)
+            logger.info(f"{name}: {len(new_data)} de {len(data)} pares")
+            write_dataset(new_data, name[:-4], args.output_path, suffix)
+
+    return tokenizer, new_data
 
 
 if __name__ == '__main__':
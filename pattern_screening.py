@@ -0,0 +1,250 @@
+"""
+Triagem de padrões novos numa subamostra estratificada, sem pontuar o dataset inteiro.
+
+A subamostra é sorteada por estrato (fonte da linha, len_hypo, len_hyper), os mesmos tamanhos em wordpieces que o
+top_k e o z_score usam, com tamanhos acima de --max_len juntos num estrato só. Cada estrato entra proporcional ao
+tamanho, com pelo menos --min_per_stratum pares. Cada par amostrado pesa N do estrato / amostrados do estrato, e o
+AP do dataset inteiro é estimado com esses pesos (ranking.compute_weighted_AP). O intervalo de confiança sai de um
+bootstrap estratificado: reamostragem com reposição dentro de cada estrato.
+
+Os candidatos são pontuados em --rounds rodadas, cada uma com uma fração estratificada a mais da subamostra. A
+régua é o padrão mais fraco da lista atual (o de menor AP sozinho na subamostra). Depois de cada rodada, a
+diferença de AP candidato - régua é estimada com bootstrap pareado (as mesmas reamostragens nos dois). Se o
+limite superior do intervalo fica abaixo de zero, o candidato é claramente pior e a triagem para nele. Quem
+chega ao fim ganha também o ganho de AP da lista atual com ele (mesmo method/sub_method do bert-eval.py).
+
+Uso:
+    python pattern_screening.py -m <model> -d datasets/ontoPT-test_token_1.tsv -o results/screening \\
+        --candidates "{} é uma espécie de {}" "{}, um tipo de {}" --sample 1000
+    python pattern_screening.py -m <model> -d datasets/ontoPT-test_token_1.tsv -o results/screening \\
+        --candidates_file candidatos.txt --en --rounds 5
+"""
+import argparse
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from ranking import aggregate, compute_weighted_AP, is_hyper, pattern_scores
+
+logger = logging.getLogger(__name__)
+
+
+def stratum(cloze, row, max_len=3):
+    return row[3], min(len(cloze.word_ids(row[0])), max_len), min(len(cloze.word_ids(row[1])), max_len)
+
+
+def stratified_sample(cloze, rows, n, rounds=4, min_per_stratum=2, max_len=3, seed=0):
+    """
+    :return: (amostra [(linha, estrato, rodada)], tamanho de cada estrato no dataset); as linhas de cada estrato se
+             espalham pelas rodadas, então toda rodada acumulada é também estratificada
+    """
+    rnd = random.Random(seed)
+    unique = {}
+    for row in rows:
+        unique.setdefault(" ".join(row), row)
+    cloze.prepare_words(list(unique.values()))
+    groups = defaultdict(list)
+    for row in unique.values():
+        groups[stratum(cloze, row, max_len)].append(row)
+    total = len(unique)
+    sample = []
+    for key in sorted(groups):
+        group = groups[key]
+        size = min(len(group), max(min_per_stratum, round(n * len(group) / total)))
+        chosen = rnd.sample(group, size)
+        for i, row in enumerate(chosen):
+            sample.append((row, key, i * rounds // size))
+    return sample, {key: len(group) for key, group in groups.items()}
+
+
+def prefix_weights(sample, sizes, last_round):
+    """ {chave: peso} dos pares das rodadas 0..last_round """
+    counts = defaultdict(int)
+    for _, key, r in sample:
+        if r <= last_round:
+            counts[key] += 1
+    return {" ".join(row): sizes[key] / counts[key] for row, key, r in sample if r <= last_round}
+
+
+def bootstrap_counts(keys, strata, n_boot, rng):
+    """ [n_boot, len(keys)] quantas vezes cada par sai em cada reamostragem estratificada """
+    counts = np.zeros((n_boot, len(keys)))
+    members = defaultdict(list)
+    for i, key in enumerate(keys):
+        members[strata[key]].append(i)
+    for idx in members.values():
+        draws = rng.choice(idx, size=(n_boot, len(idx)), replace=True)
+        for b in range(n_boot):
+            np.add.at(counts[b], draws[b], 1)
+    return counts
+
+
+def bootstrap_AP(order, keys, weights, counts):
+    """ AP ponderado de cada reamostragem (counts de bootstrap_counts, colunas na ordem de keys) """
+    position = {key: i for i, key in enumerate(keys)}
+    idx = np.array([position[key] for key, _ in order])
+    relevant = np.array([is_hyper(key) for key, _ in order], dtype=np.float64)
+    w = counts[:, idx] * np.array([weights[key] for key, _ in order])
+    seen = np.cumsum(w, axis=1)
+    hits = np.cumsum(w * relevant, axis=1)
+    precision = np.divide(hits, seen, out=np.zeros_like(hits), where=seen > 0)
+    total = (w * relevant).sum(axis=1)
+    return np.divide((w * relevant * precision).sum(axis=1), total, out=np.zeros_like(total), where=total > 0)
+
+
+def interval(values, confidence=0.95):
+    alpha = (1 - confidence) / 2
+    return float(np.quantile(values, alpha)), float(np.quantile(values, 1 - alpha))
+
+
+class Screening:
+    def __init__(self, cloze, rows, best_patterns, n_sample=1000, rounds=4, min_per_stratum=2, max_len=3,
+                 n_boot=200, confidence=0.95, mode="bert_score", method="all_subword",
+                 sub_method="min_positional_rank", batch_tokens=8192, seed=0):
+        import scoring
+
+        self.cloze = cloze
+        self.best = list(best_patterns)
+        self.rounds = rounds
+        self.confidence = confidence
+        self.mode = mode
+        self.method = method
+        self.sub_method = sub_method
+        self.batch_tokens = batch_tokens
+        self.sample, self.sizes = stratified_sample(cloze, rows, n_sample, rounds, min_per_stratum, max_len, seed)
+        self.strata = {" ".join(row): key for row, key, _ in self.sample}
+        self.keys = list(self.strata)
+        self.counts = bootstrap_counts(self.keys, self.strata, n_boot, np.random.default_rng(seed))
+        logger.info(f"Subamostra: {len(self.sample)} de {sum(self.sizes.values())} pares, {len(self.sizes)} estratos")
+        t0 = time.time()
+        self.reference = scoring.score(cloze, [row for row, _, _ in self.sample], self.best, mode, batch_tokens)
+        self.reference_seconds = time.time() - t0
+        weights = prefix_weights(self.sample, self.sizes, rounds - 1)
+        single = {p: compute_weighted_AP(self.order(self.reference, [p], self.keys), weights) for p in self.best}
+        self.bar = min(single, key=single.get)
+        self.list_AP = compute_weighted_AP(self.order(self.reference, self.best, self.keys), weights)
+        logger.info(f"Lista atual: AP estimado {self.list_AP:.4f}; régua: {self.bar} ({single[self.bar]:.4f}) "
+                    f"({self.reference_seconds:.1f}s)")
+
+    def order(self, scores, patterns, keys):
+        pairs = pattern_scores({key: scores[key] for key in keys}, patterns, self.method)
+        if len(patterns) == 1:
+            return sorted(pairs.items(), key=lambda x: x[1][patterns[0]], reverse=True)
+        return aggregate(pairs, patterns, self.sub_method)
+
+    def estimate(self, scores, patterns, keys, weights):
+        """ (AP estimado, AP de cada reamostragem) """
+        order = self.order(scores, patterns, keys)
+        columns = [self.keys.index(key) for key in keys]
+        return compute_weighted_AP(order, weights), bootstrap_AP(order, keys, weights, self.counts[:, columns])
+
+    def screen(self, candidate):
+        """ pontua o candidato rodada a rodada; devolve a linha do relatório """
+        import scoring
+
+        scores = {}
+        t0 = time.time()
+        report = {"pattern": candidate, "decision": "keep"}
+        for r in range(self.rounds):
+            rows = [row for row, _, rr in self.sample if rr == r]
+            for key, by_pattern in scoring.score(self.cloze, rows, [candidate], self.mode,
+                                                 self.batch_tokens).items():
+                scores[key] = {**self.reference[key], **by_pattern}
+            weights = prefix_weights(self.sample, self.sizes, r)
+            keys = [key for key in self.keys if key in weights]
+            ap, ap_boot = self.estimate(scores, [candidate], keys, weights)
+            bar, bar_boot = self.estimate(scores, [self.bar], keys, weights)
+            low, high = interval(ap_boot, self.confidence)
+            diff_low, diff_high = interval(ap_boot - bar_boot, self.confidence)
+            report.update({"pairs": len(keys), "rounds": r + 1, "AP": ap, "AP_low": low, "AP_high": high,
+                           "bar_AP": bar, "diff_low": diff_low, "diff_high": diff_high})
+            logger.info(f"{candidate} rodada {r + 1}/{self.rounds} ({len(keys)} pares): AP {ap:.4f} "
+                        f"[{low:.4f}, {high:.4f}], diferença para a régua [{diff_low:+.4f}, {diff_high:+.4f}]")
+            if diff_high < 0:
+                report["decision"] = "worse"
+                break
+        else:
+            # chegou ao fim: ganho da lista atual com o candidato
+            list_ap, list_boot = self.estimate(scores, self.best, self.keys, weights)
+            with_ap, with_boot = self.estimate(scores, self.best + [candidate], self.keys, weights)
+            report["gain"] = with_ap - list_ap
+            report["gain_low"], report["gain_high"] = interval(with_boot - list_boot, self.confidence)
+            if report["diff_low"] > 0:
+                report["decision"] = "better"
+        report["seconds"] = time.time() - t0
+        return report
+
+
+def main():
+    from bert_portuguese import ClozeBert, load_eval_file
+    from hearst_patterns import BEST_BERT_SCORE, EN_BEST_PATTERNS
+    from ranking import METHODS, SUB_METHODS
+    from scoring import MODES
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_name", type=str, help="path to bert models", required=True)
+    parser.add_argument("-d", "--dataset", type=str, help="dataset tsv file", required=True)
+    parser.add_argument("-o", "--output_path", type=str, help="dir output (screening.tsv)", required=True)
+    parser.add_argument("--candidates", type=str, nargs="*", default=[], help="patterns with two {}")
+    parser.add_argument("--candidates_file", type=str, required=False, help="one candidate pattern per line")
+    parser.add_argument("--en", action="store_true", help="current list is EN_BEST_PATTERNS, not BEST_BERT_SCORE")
+    parser.add_argument("-n", "--n_patterns", type=int, default=None, help="use the n best patterns as the list")
+    parser.add_argument("--sample", type=int, default=1000, help="pairs in the stratified subsample")
+    parser.add_argument("--rounds", type=int, default=4, help="scoring rounds (early stop after each)")
+    parser.add_argument("--min_per_stratum", type=int, default=2)
+    parser.add_argument("--max_len", type=int, default=3, help="wordpiece lengths above this share a stratum")
+    parser.add_argument("--bootstrap", type=int, default=200, help="bootstrap resamples")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--mode", choices=MODES, default="bert_score")
+    parser.add_argument("--method", choices=METHODS, default="all_subword")
+    parser.add_argument("--sub_method", choices=SUB_METHODS, default="min_positional_rank")
+    parser.add_argument("--batch_tokens", type=int, default=8192)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    args = parser.parse_args()
+
+    candidates = list(args.candidates)
+    if args.candidates_file:
+        with open(args.candidates_file, encoding="utf-8") as f_in:
+            candidates += [line.rstrip("\n") for line in f_in if line.strip()]
+    for pattern in candidates:
+        if pattern.count("{}") != 2:
+            parser.error(f"pattern without two {{}}: {pattern}")
+    if not candidates:
+        parser.error("no candidates")
+    best = EN_BEST_PATTERNS if args.en else BEST_BERT_SCORE
+    best = best[:args.n_patterns] if args.n_patterns else list(best)
+
+    with open(args.dataset, encoding="utf-8") as f_in:
+        rows = load_eval_file(f_in)
+    cloze = ClozeBert(args.model_name, fast_tokenizer=args.fast_tokenizer)
+    screening = Screening(cloze, rows, best, args.sample, args.rounds, args.min_per_stratum, args.max_len,
+                          args.bootstrap, args.confidence, args.mode, args.method, args.sub_method,
+                          args.batch_tokens, args.seed)
+
+    os.makedirs(args.output_path, exist_ok=True)
+    f_out = open(os.path.join(args.output_path, "screening.tsv"), mode="a", encoding="utf-8")
+    f_out.write("model\tdataset\tpattern\tdecision\tpairs\trounds\tAP\tAP_low\tAP_high\tbar_AP\tdiff_low\t"
+                "diff_high\tgain\tgain_low\tgain_high\tseconds\n")
+    for candidate in candidates:
+        line = screening.screen(candidate)
+        gain = [f"{line[k]:.4f}" if k in line else "-" for k in ("gain", "gain_low", "gain_high")]
+        f_out.write(f"{args.model_name}\t{os.path.basename(args.dataset)}\t{candidate}\t{line['decision']}\t"
+                    f"{line['pairs']}\t{line['rounds']}\t{line['AP']:.4f}\t{line['AP_low']:.4f}\t"
+                    f"{line['AP_high']:.4f}\t{line['bar_AP']:.4f}\t{line['diff_low']:.4f}\t{line['diff_high']:.4f}\t"
+                    + "\t".join(gain) + f"\t{line['seconds']:.1f}\n")
+        f_out.flush()
+        logger.info(f"{candidate}: {line['decision']} (AP {line['AP']:.4f}, {line['pairs']} pares, "
+                    f"{line['seconds']:.1f}s)")
+    f_out.close()
+
+
+if __name__ == '__main__':
+    main()
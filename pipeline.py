@@ -0,0 +1,322 @@
+"""
+Pontuação em pipeline: três threads ligadas por filas limitadas, para a preparação em Python e a escrita do json
+andarem enquanto o modelo faz as multiplicações (o torch solta o GIL no forward):
+
+    prepare: tokeniza um bloco de pares, monta as sentenças (scoring.expand), os lotes e os tensores
+    model:   forward, gather e cópia para a CPU (scoring.run_inputs); com --topk, também o top-k de cada posição
+             mascarada (topk_capture.py), gravado em <dataset>.topk.npz
+    writer:  junta os scores por par (scoring.ResultBuilder) e grava o json do dataset par a par, na ordem de
+             entrada, no mesmo formato do save_bert_file
+
+As filas têm no máximo --queue_size itens, então a preparação fica no máximo alguns lotes à frente do modelo.
+Um erro em qualquer etapa para as outras (nenhuma fica presa em put/get) e é relançado por Pipeline.run; um
+KeyboardInterrupt faz o mesmo. No fim sai a ocupação de cada etapa: busy (trabalhando), starved (esperando
+entrada) e blocked (esperando espaço na fila seguinte); com o modelo saturado o busy dele fica perto de 100% e
+as outras etapas passam o tempo bloqueadas.
+
+Uso:
+    python pipeline.py -m neuralmind/bert-base-portuguese-cased -e datasets -o results
+    python pipeline.py -m <model> -e datasets/ontoPT-test.tsv -o results --mode bert_score_2 --pack_tokens 128
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class Stage:
+    """ etapa do pipeline: function(item) devolve um iterável de saídas; finish() as saídas finais """
+
+    def __init__(self, name, function, finish=None):
+        self.name = name
+        self.function = function
+        self.finish = finish
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.items = 0
+
+    def report(self, wall):
+        wall = wall or float("nan")
+        return {"items": self.items, "busy": self.busy / wall, "starved": self.starved / wall,
+                "blocked": self.blocked / wall}
+
+
+class Pipeline:
+    def __init__(self, stages, queue_size=4, poll_s=0.1):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.poll_s = poll_s
+        self.stop = threading.Event()
+        self.error = None
+        self.wall = 0.0
+
+    def _get(self, inbox, stage):
+        t0 = time.perf_counter()
+        while True:
+            if self.stop.is_set():
+                raise _Stopped()
+            try:
+                item = inbox.get(timeout=self.poll_s)
+                break
+            except queue.Empty:
+                continue
+        stage.starved += time.perf_counter() - t0
+        return item
+
+    def _put(self, outbox, item, stage):
+        if outbox is None:
+            return
+        t0 = time.perf_counter()
+        while True:
+            if self.stop.is_set():
+                raise _Stopped()
+            try:
+                outbox.put(item, timeout=self.poll_s)
+                break
+            except queue.Full:
+                continue
+        stage.blocked += time.perf_counter() - t0
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stop.set()
+
+    def _emit(self, stage, outputs, outbox):
+        """ passa as saídas adiante; o tempo gerando cada uma conta como busy """
+        iterator = iter(outputs or ())
+        while True:
+            t0 = time.perf_counter()
+            output = next(iterator, _END)
+            stage.busy += time.perf_counter() - t0
+            if output is _END:
+                return
+            self._put(outbox, output, stage)
+
+    def _source(self, items, stage, outbox):
+        try:
+            self._emit(stage, items, outbox)
+            self._put(outbox, _END, stage)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            self._fail(e)
+
+    def _worker(self, stage, inbox, outbox):
+        try:
+            while True:
+                item = self._get(inbox, stage)
+                if item is _END:
+                    break
+                stage.items += 1
+                self._emit(stage, stage.function(item), outbox)
+            if stage.finish is not None:
+                self._emit(stage, stage.finish(), outbox)
+            self._put(outbox, _END, stage)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            self._fail(e)
+
+    def run(self, items):
+        """ passa items pelas etapas; relança o primeiro erro de qualquer uma """
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        source = Stage("source", None)
+        threads = [threading.Thread(target=self._source, args=(items, source, queues[0]), name="source",
+                                    daemon=True)]
+        for i, stage in enumerate(self.stages):
+            outbox = queues[i + 1] if i + 1 < len(self.stages) else None
+            threads.append(threading.Thread(target=self._worker, args=(stage, queues[i], outbox), name=stage.name,
+                                            daemon=True))
+        t0 = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(self.poll_s)
+        except BaseException as e:
+            # Ctrl-C: para as etapas e espera elas saírem
+            self._fail(e)
+            for thread in threads:
+                thread.join()
+        self.wall = time.perf_counter() - t0
+        if self.error is not None:
+            raise self.error
+
+    def report(self):
+        return {"wall_seconds": self.wall, "stages": {stage.name: stage.report(self.wall) for stage in self.stages}}
+
+    def log_report(self):
+        for name, stage in self.report()["stages"].items():
+            logger.info(f"{name}: busy {stage['busy']:.0%}, starved {stage['starved']:.0%}, "
+                        f"blocked {stage['blocked']:.0%} ({stage['items']} itens)")
+
+
+def chunks(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def scoring_pipeline(cloze, patterns, f_out, mode="bert_score", batch_tokens=8192, pack_tokens=None,
+                     queue_size=4, total=None, capture=None):
+    """
+    Pipeline que pontua blocos de linhas do dataset e grava o json em f_out
+    :param total: número de pares, para o ETA
+    :param capture: TopKCapture preenchido pela etapa do modelo
+    """
+    import scoring
+    from instrumentation import METRICS
+
+    stats = METRICS.mode(("pipeline_packed_" if pack_tokens else "pipeline_") + mode)
+    builder = scoring.ResultBuilder(cloze, patterns, mode)
+    progress = stats.progress(total)
+    seen = set()
+    state = {"next_item": 0, "next_out": 0, "done": {}, "written": 0}
+
+    def prepare(rows):
+        # par repetido sai uma vez só, como no dict dos scorers
+        unique = []
+        for row in rows:
+            if " ".join(row) not in seen:
+                seen.add(" ".join(row))
+                unique.append(row)
+        rows = unique
+        with stats.time("tokenize"):
+            cloze.prepare_words(rows)
+        window = []
+        pairs = []
+        with stats.time("build"):
+            for row in rows:
+                item = state["next_item"]
+                state["next_item"] += 1
+                pairs.append((" ".join(row), row))
+                if capture is not None:
+                    capture.add_pair(item, " ".join(row), len(cloze.word_ids(row[0])))
+                for p, pattern in enumerate(patterns):
+                    window.extend(scoring.expand(cloze, row[:2], pattern, mode, item, p))
+        # os pares antes das sentenças deles: o writer os registra na mesma ordem dos índices
+        yield "pairs", pairs
+        for batch in scoring.make_batches(scoring.pack(window, pack_tokens) if pack_tokens else window,
+                                          batch_tokens):
+            with stats.time("tensor"):
+                if pack_tokens:
+                    sentences = [s for row in batch for s in row.sentences]
+                    inputs = scoring.packed_inputs(cloze, batch)
+                else:
+                    sentences = batch
+                    inputs = scoring.batch_inputs(cloze, batch)
+            yield "batch", (sentences, inputs)
+
+    def model(message):
+        kind, payload = message
+        if kind == "batch":
+            sentences, inputs = payload
+            payload = sentences, scoring.run_inputs(cloze, inputs, stats, capture, sentences)
+        yield kind, payload
+
+    def write_pair(key, result):
+        with stats.time("serialize"):
+            f_out.write((", " if state["written"] else "{") + json.dumps(key, ensure_ascii=False) + ": " +
+                        json.dumps(result, ensure_ascii=False))
+        state["written"] += 1
+        progress.update()
+
+    def complete(item):
+        state["done"][item] = builder.pop(item)
+        while state["next_out"] in state["done"]:
+            write_pair(*state["done"].pop(state["next_out"]))
+            state["next_out"] += 1
+
+    def writer(message):
+        kind, payload = message
+        if kind == "pairs":
+            for key, row in payload:
+                builder.add_pair(key, row)
+            # pares sem wordpieces não têm sentenças: já estão completos
+            while builder.ready:
+                complete(builder.ready.pop(0))
+            return
+        for sentence, values in zip(*payload):
+            item = builder.add(sentence, values)
+            if item is not None:
+                complete(item)
+
+    def finish():
+        f_out.write("}" if state["written"] else "{}")
+        progress.finish()
+        return ()
+
+    return Pipeline([Stage("prepare", prepare), Stage("model", model), Stage("writer", writer, finish)],
+                    queue_size)
+
+
+def main():
+    import instrumentation
+    from bert_portuguese import ClozeBert, load_eval_file
+    from dataset_index import append_info, dataset_files, model_output_dir
+    from hearst_patterns import PATTERN_SETS
+    from instrumentation import METRICS
+    from scoring import MODES
+    from topk_capture import TopKCapture, topk_path
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_name", type=str, help="bert model or snapshot dir", required=True)
+    parser.add_argument("-e", "--eval_path", type=str, help="dataset file or dir of datasets", required=True)
+    parser.add_argument("-o", "--output_path", type=str, help="dir output", required=True)
+    parser.add_argument("-i", "--index", type=str, required=False, help="dataset index (dataset_index.py)")
+    parser.add_argument("--mode", choices=MODES, default="bert_score")
+    parser.add_argument("--patterns", choices=list(PATTERN_SETS), default="all_en",
+                        help="all_en is the list bert_portuguese.py -b uses")
+    parser.add_argument("--batch_tokens", type=int, default=8192)
+    parser.add_argument("--pack_tokens", type=int, default=None, help="pack sentences into rows of this size")
+    parser.add_argument("--chunk_pairs", type=int, default=256, help="pairs prepared together")
+    parser.add_argument("--queue_size", type=int, default=4, help="items between two stages")
+    parser.add_argument("--topk", type=int, default=0, help="save the k best tokens of each masked slot")
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+
+    cloze = ClozeBert(args.model_name, fast_tokenizer=args.fast_tokenizer)
+    patterns = PATTERN_SETS[args.patterns]
+    out_dir = os.path.join(args.output_path, model_output_dir(args.model_name, args.mode))
+    os.makedirs(out_dir, exist_ok=True)
+    reports = {}
+    for file_dataset, path_dataset in dataset_files(args.eval_path, args.index):
+        with open(path_dataset, encoding="utf-8") as f_in:
+            dataset = load_eval_file(f_in)
+        path = os.path.join(out_dir, os.path.splitext(file_dataset)[0] + ".json")
+        capture = TopKCapture(args.topk) if args.topk else None
+        with open(path + ".tmp", mode="w", encoding="utf-8") as f_out:
+            pipeline = scoring_pipeline(cloze, patterns, f_out, args.mode, args.batch_tokens, args.pack_tokens,
+                                        args.queue_size, len(dataset), capture)
+            pipeline.run(chunks(dataset, args.chunk_pairs))
+        os.replace(path + ".tmp", path)
+        if capture is not None:
+            capture.save(topk_path(path), patterns)
+        append_info(out_dir, args.model_name, file_dataset, len(dataset))
+        logger.info(f"{file_dataset}: {len(dataset)} pares em {pipeline.wall:.1f}s -> {path}")
+        pipeline.log_report()
+        reports[file_dataset] = pipeline.report()
+    if args.metrics:
+        METRICS.dump(args.metrics, {"pipeline": reports})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Agregação de scores por padrão e AP, com a mesma lógica do output2 do bert-eval.py, para ser usada fora dele
+(recuperação de hiperônimos, cascata, varreduras).
+"""
+import operator
+
+import numpy as np
+
+METHODS = ["mean_subword", "all_subword"]
+SUB_METHODS = ["mean_positional_rank", "min_positional_rank", "max_pattern", "mean_pattern"]
+
+
+def pattern_scores(dict_pairs, patterns_list, method="all_subword"):
+    """
+    :param dict_pairs: {'a b True hyper': {'pattern1': [[-10, -20], [-5]], ...}}
+    :return: {'a b True hyper': {'pattern1': -35, ...}}
+    """
+    new_pairs = {}
+    for data, values_by_pattern in dict_pairs.items():
+        new_pairs[data] = {}
+        for pattern_name in patterns_list:
+            values = values_by_pattern[pattern_name]
+            if method == "all_subword":
+                new_pairs[data][pattern_name] = sum(values[0]) + sum(values[1])
+            elif method == "mean_subword":
+                new_pairs[data][pattern_name] = np.mean(values[0]) + np.mean(values[1])
+            else:
+                raise ValueError(method)
+    return new_pairs
+
+
+def positional_ranks(new_pairs, patterns_list):
+    """ posição de cada par no ranking de cada padrão (0 = maior score) """
+    pair_position = {}
+    for pattern_name in patterns_list:
+        order_result = sorted(new_pairs.items(), key=lambda x: x[1][pattern_name], reverse=True)
+        for position, pair in enumerate(order_result):
+            pair_position.setdefault(pair[0], []).append(position)
+    return pair_position
+
+
+def aggregate(new_pairs, patterns_list, sub_method="min_positional_rank"):
+    """ lista [(chave, valor)] na ordem final do sub_method, como em output2 """
+    if sub_method in ("mean_positional_rank", "min_positional_rank"):
+        pair_position = positional_ranks(new_pairs, patterns_list)
+        reduce = np.mean if sub_method == "mean_positional_rank" else min
+        return sorted(pair_position.items(), key=lambda x: reduce(x[1]), reverse=False)
+    if sub_method == "max_pattern":
+        max_pattern = {data: max(((p, v[p]) for p in patterns_list), key=operator.itemgetter(1))[1]
+                       for data, v in new_pairs.items()}
+        return sorted(max_pattern.items(), key=lambda x: x[1], reverse=True)
+    if sub_method == "mean_pattern":
+        mean_pattern = {data: np.mean([v[p] for p in patterns_list]) for data, v in new_pairs.items()}
+        return sorted(mean_pattern.items(), key=lambda x: x[1], reverse=True)
+    raise ValueError(sub_method)
+
+
+def is_hyper(key):
+    return key.split()[-1] == "hyper"
+
+
+def compute_AP(order_final, relevant=is_hyper, empty=float("nan")):
+    """ AP da ordem; sem nenhum par relevante devolve empty (nan, como o bert-eval.py sempre escreveu) """
+    prec_list = []
+    correct_count = 0
+    for all_count, (key, _) in enumerate(order_final, start=1):
+        if relevant(key):
+            correct_count += 1
+            prec_list.append(correct_count / float(all_count))
+    return np.mean(prec_list) if prec_list else empty
+
+
+def compute_weighted_AP(order_final, weights, relevant=is_hyper):
+    """
+    AP de uma amostra estratificada: cada par conta como weights[chave] pares do dataset (N do estrato /
+    amostrados do estrato), na precisão e na média
+    """
+    prec_sum = 0.0
+    relevant_weight = 0.0
+    seen_weight = 0.0
+    for key, _ in order_final:
+        seen_weight += weights[key]
+        if relevant(key):
+            relevant_weight += weights[key]
+            prec_sum += weights[key] * relevant_weight / seen_weight
+    return prec_sum / relevant_weight if relevant_weight else 0.0
+
+
+def evaluate(dict_pairs, patterns_list, method="all_subword", sub_method="min_positional_rank", empty=float("nan")):
+    return compute_AP(aggregate(pattern_scores(dict_pairs, patterns_list, method), patterns_list, sub_method),
+                      empty=empty)
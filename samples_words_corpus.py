@@ -4,7 +4,7 @@ from collections import defaultdict
 from itertools import combinations_with_replacement
 import argparse
 import random
-from bert2 import ClozeBert
+from wordpiece_table import DEFAULT_TABLE_ROOT, load_or_build, load_tokenizer
 
 
 def escrever_random_pares(word_length_tokenize):
@@ -19,10 +19,12 @@ def main():
     parser.add_argument("-m", "--model_name", type=str, help="path to bert models", required=True)
     parser.add_argument("-l", "--list_word", type=str, help="path to list_words", required=True)
     parser.add_argument("-c", "--min_frequency", type=int, help="frequency word >= min_frequency", required=True)
+    parser.add_argument("-t", "--table_dir", type=str, help="dir of wordpiece tables", default=DEFAULT_TABLE_ROOT)
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
     args = parser.parse_args()
 
-    print("Iniciando bert...")
-    cloze_model = ClozeBert(args.model_name)
+    print("Iniciando tokenizer...")
+    tokenizer = load_tokenizer(args.model_name, args.fast_tokenizer)
     count_threshold = args.min_frequency
     words = {}
     with open(args.list_word, mode="r", encoding="utf8") as f:
@@ -37,12 +39,14 @@ def main():
     print(f"Com frequência maior que {count_threshold}")
 
     # pegar o comprimento de cada palavra conforme o wordpiece
+    # a tabela é construída com todas as palavras da lista e reaproveitada com qualquer min_frequency
+    table = load_or_build(tokenizer, args.model_name, args.list_word, args.table_dir)
     word_length = {}
     for word, count in words.items():
         if word in word_length:
             raise KeyError
         else:
-            word_length[word] = len(cloze_model.tokenizer.tokenize(word))
+            word_length[word] = table.length(word)
     counter_length = Counter(word_length)
     inv_word_len = defaultdict(list)
     _ = {inv_word_len[v].append(k) for k, v in word_length.items()}
@@ -83,7 +87,7 @@ def main():
         print(f"Terminado o status {size}")
     escrever_random_pares(word_len_tokenize)
 
-    return cloze_model, candidatos_dict, word_length, inv_word_len
+    return tokenizer, candidatos_dict, word_length, inv_word_len
 
 
 if __name__ == '__main__':
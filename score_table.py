@@ -0,0 +1,105 @@
+"""
+Resultado compacto da pontuação: um buffer float32 só com os scores de todos os pares e padrões, no lugar do
+{chave: {padrão: [[floats], [floats]]}} de listas Python (cada float é um objeto de 24 bytes, mais as listas e
+dicts; um dataset de 74k pares x 15 padrões passa de GB, no buffer são dezenas de MB).
+
+Layout: os pares um depois do outro; dentro do par, os padrões na ordem de `patterns`; dentro do padrão, os
+scores do hipônimo seguidos dos do hiperônimo. O início de cada (par, padrão, papel) sai de starts (início do
+par) e dos tamanhos do par, sem guardar um offset por célula.
+
+ScoreTable é um Mapping com a mesma cara do dict dos scorers (table[chave][padrão] -> [[hipo], [hyper]], listas
+montadas na hora), então ranking.py, approx_scoring.py etc. funcionam sem mudança; dump() grava o mesmo json que
+o save_bert_file grava a partir do dict, par a par.
+"""
+import json
+from collections.abc import Mapping
+
+import numpy as np
+
+
+class PairScores(Mapping):
+    """ {padrão: [[hipo], [hyper]]} de um par, lido do buffer """
+    __slots__ = ("table", "item")
+
+    def __init__(self, table, item):
+        self.table = table
+        self.item = item
+
+    def __getitem__(self, pattern):
+        return self.table.scores(self.item, self.table.pattern_index[pattern])
+
+    def __iter__(self):
+        return iter(self.table.patterns)
+
+    def __len__(self):
+        return len(self.table.patterns)
+
+
+class ScoreTable(Mapping):
+    def __init__(self, patterns, keys, n_hypo, n_hyper):
+        """
+        :param keys: chave de cada par (" ".join(linha)), sem repetição
+        :param n_hypo: número de wordpieces do hipônimo de cada par (idem n_hyper)
+        """
+        self.patterns = list(patterns)
+        self.pattern_index = {pattern: i for i, pattern in enumerate(self.patterns)}
+        self.keys = list(keys)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        if len(self.index) != len(self.keys):
+            raise ValueError("chaves repetidas")
+        self.n_hypo = np.asarray(n_hypo, dtype=np.int32)
+        self.n_hyper = np.asarray(n_hyper, dtype=np.int32)
+        self.width = self.n_hypo + self.n_hyper
+        self.starts = np.zeros(len(self.keys) + 1, dtype=np.int64)
+        np.cumsum(self.width.astype(np.int64) * len(self.patterns), out=self.starts[1:])
+        self.values = np.zeros(self.starts[-1], dtype=np.float32)
+
+    def offset(self, item, pattern, role=0):
+        """ posição no buffer do primeiro score de (par, padrão, papel); papel 1 = hiperônimo """
+        return int(self.starts[item] + pattern * self.width[item] + (self.n_hypo[item] if role else 0))
+
+    def put(self, destinations, values):
+        """ grava values (tensor ou array) nas posições destinations do buffer, sem passar por listas """
+        if hasattr(values, "numpy"):
+            values = values.numpy()
+        self.values[destinations] = values
+
+    def scores(self, item, pattern):
+        start = self.offset(item, pattern)
+        hypo = self.values[start:start + self.n_hypo[item]]
+        hyper = self.values[start + self.n_hypo[item]:start + self.width[item]]
+        return [hypo.tolist(), hyper.tolist()]
+
+    def __getitem__(self, key):
+        return PairScores(self, self.index[key])
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.starts.nbytes + self.n_hypo.nbytes + self.n_hyper.nbytes + \
+            self.width.nbytes
+
+    def to_dict(self):
+        return {key: {pattern: self.scores(i, j) for j, pattern in enumerate(self.patterns)}
+                for i, key in enumerate(self.keys)}
+
+    def dump(self, f_out, keys=None):
+        """
+        o json.dumps(self.to_dict(), ensure_ascii=False), escrito par a par
+        :param keys: só estes pares, nesta ordem (ex.: os de um dataset, num table da união de vários)
+        """
+        f_out.write("{")
+        for n, key in enumerate(self.keys if keys is None else keys):
+            i = self.index[key]
+            pair = {pattern: self.scores(i, j) for j, pattern in enumerate(self.patterns)}
+            f_out.write((", " if n else "") + json.dumps(key, ensure_ascii=False) + ": " +
+                        json.dumps(pair, ensure_ascii=False))
+        f_out.write("}")
@@ -0,0 +1,448 @@
+"""
+Pontuação em lote dos pares: as sentenças mascaradas de vários pares e padrões (build_sentences_n_subtoken /
+build_sentences_n_subtoken_2 do ClozeBert) são ordenadas por tamanho e agrupadas em lotes com no máximo
+batch_tokens tokens (com padding), um forward por lote em vez de um por par e padrão.
+
+Com pack_tokens, várias sentenças curtas vão numa linha só de até pack_tokens tokens (sequence packing), com
+máscara de atenção em blocos diagonais e position_ids recomeçando em cada sentença: nenhuma atende às outras e
+os scores são os mesmos da pontuação sem empacotamento, com bem menos padding e linhas por forward. Precisa
+da atenção sdpa (padrão do ClozeBert) ou do bert_mlm.py dos snapshots.
+
+mode=single é a aproximação de um forward por par e padrão: a sentença sem máscara, lendo o logit de cada
+subtoken do hipônimo e do hiperônimo na própria posição. Os valores são de outra distribuição (bem mais altos
+que os do bert_score); o approx_scoring.py calibra contra o bert_score.
+
+O resultado tem o mesmo formato do bert_sentence_score / bert_sentence_score_2:
+    {'hipo hyper True hyper': {padrão: [[scores do hipônimo], [scores do hiperônimo]]}}
+"""
+import numpy as np
+import torch
+
+from instrumentation import METRICS
+from score_table import ScoreTable
+
+MODES = ["bert_score", "bert_score_2", "single"]
+
+# BOTH: sentença do mode=single, com os scores do hipônimo seguidos pelos do hiperônimo
+HYPONYM, HYPERNYM, BOTH = 0, 1, 2
+
+# pares tokenizados juntos (prepare_words) ao encher a janela do score_pairs
+READ_CHUNK = 32
+
+
+class MaskedSentence:
+    __slots__ = ("ids", "positions", "targets", "item", "pattern", "role", "offset")
+
+    def __init__(self, ids, positions, targets, item, pattern, role, offset):
+        self.ids = ids
+        self.positions = positions
+        self.targets = targets
+        # índice do par, índice do padrão, papel (hipônimo/hiperônimo) e posição dos scores dentro do papel
+        self.item = item
+        self.pattern = pattern
+        self.role = role
+        self.offset = offset
+
+
+def expand(cloze, pair, pattern, mode="bert_score", item=0, pattern_idx=0):
+    """ sentenças mascaradas de um par e padrão, como nos scorers do ClozeBert (nenhuma se as duas palavras não
+    têm wordpieces: o ResultBuilder já devolve o par completo, com listas vazias) """
+    if not cloze.word_ids(pair[0]) and not cloze.word_ids(pair[1]):
+        return []
+    if mode == "bert_score_2":
+        sentences, hyponym_idx, hypernym_idx, idx_mask = cloze.build_sentences_n_subtoken_2(pattern, pair)
+        return [MaskedSentence(sentences[0], idx_mask[0], hyponym_idx, item, pattern_idx, HYPONYM, 0),
+                MaskedSentence(sentences[1], idx_mask[1], hypernym_idx, item, pattern_idx, HYPERNYM, 0)]
+    if mode == "single":
+        tokenizer = cloze.tokenizer
+        hyponym_idx, hypernym_idx = cloze.word_ids(pair[0]), cloze.word_ids(pair[1])
+        pattern_tokens = tokenizer.convert_tokens_to_ids(tokenizer.tokenize(pattern.format("", "").strip()))
+        sentence = [tokenizer.cls_token_id] + hyponym_idx + pattern_tokens + hypernym_idx + [tokenizer.sep_token_id]
+        start = 1 + len(hyponym_idx) + len(pattern_tokens)
+        positions = list(range(1, 1 + len(hyponym_idx))) + list(range(start, start + len(hypernym_idx)))
+        return [MaskedSentence(sentence, positions, hyponym_idx + hypernym_idx, item, pattern_idx, BOTH, 0)]
+    if mode != "bert_score":
+        raise ValueError(mode)
+    sentences, hyponym_idx, hypernym_idx, idx_mask = cloze.build_sentences_n_subtoken(pattern, pair)
+    targets = hyponym_idx + hypernym_idx
+    result = []
+    for i, (sentence, position, target) in enumerate(zip(sentences, idx_mask, targets)):
+        role, offset = (HYPONYM, i) if i < len(hyponym_idx) else (HYPERNYM, i - len(hyponym_idx))
+        result.append(MaskedSentence(sentence, [position], [target], item, pattern_idx, role, offset))
+    return result
+
+
+def make_batches(sentences, batch_tokens=8192, sort=True):
+    """ lotes de sentenças com no máximo batch_tokens tokens contando o padding """
+    if sort:
+        sentences = sorted(sentences, key=lambda s: len(s.ids))
+    batch = []
+    max_len = 0
+    for sentence in sentences:
+        length = max(max_len, len(sentence.ids))
+        if batch and length * (len(batch) + 1) > batch_tokens:
+            yield batch
+            batch = []
+            length = len(sentence.ids)
+        batch.append(sentence)
+        max_len = length
+    if batch:
+        yield batch
+
+
+class PackedRow:
+    """ sentenças concatenadas numa linha; starts[i] é a posição da sentença i na linha """
+    __slots__ = ("ids", "sentences", "starts")
+
+    def __init__(self):
+        self.ids = []
+        self.sentences = []
+        self.starts = []
+
+    def add(self, sentence):
+        self.starts.append(len(self.ids))
+        self.sentences.append(sentence)
+        self.ids.extend(sentence.ids)
+
+
+def pack(sentences, pack_tokens=128):
+    """ linhas de até pack_tokens tokens, das sentenças maiores para as menores, cada uma na linha mais cheia
+    em que cabe (best fit); sentença maior que pack_tokens fica sozinha na linha """
+    rows = []
+    # linhas abertas por espaço livre
+    free = [[] for _ in range(pack_tokens + 1)]
+    for sentence in sorted(sentences, key=lambda s: len(s.ids), reverse=True):
+        length = len(sentence.ids)
+        row = None
+        for space in range(length, pack_tokens + 1):
+            if free[space]:
+                row = free[space].pop()
+                break
+        if row is None:
+            row = PackedRow()
+            rows.append(row)
+        row.add(sentence)
+        if len(row.ids) < pack_tokens:
+            free[pack_tokens - len(row.ids)].append(row)
+    return rows
+
+
+class BatchInputs:
+    """ tensores de um lote prontos para o forward, e onde ler os scores na saída """
+    __slots__ = ("input_ids", "kwargs", "rows", "positions", "targets", "sizes")
+
+    def __init__(self, input_ids, kwargs, rows, positions, targets, sizes):
+        self.input_ids = input_ids
+        # attention_mask e, no empacotado, position_ids
+        self.kwargs = kwargs
+        self.rows = rows
+        self.positions = positions
+        self.targets = targets
+        # número de posições de cada sentença, na ordem do lote
+        self.sizes = sizes
+
+
+def batch_inputs(cloze, batch):
+    """ BatchInputs de um lote de MaskedSentence, com padding à direita """
+    max_len = max(len(s.ids) for s in batch)
+    pad = cloze.tokenizer.pad_token_id
+    input_ids = torch.tensor([s.ids + [pad] * (max_len - len(s.ids)) for s in batch], device=cloze.device)
+    attention_mask = torch.tensor([[1] * len(s.ids) + [0] * (max_len - len(s.ids)) for s in batch],
+                                  device=cloze.device)
+    rows = torch.tensor([i for i, s in enumerate(batch) for _ in s.positions], device=cloze.device)
+    positions = torch.tensor([p for s in batch for p in s.positions], device=cloze.device)
+    targets = torch.tensor([t for s in batch for t in s.targets], device=cloze.device)
+    return BatchInputs(input_ids, {"attention_mask": attention_mask}, rows, positions, targets,
+                       [len(s.positions) for s in batch])
+
+
+def packed_inputs(cloze, batch):
+    """ BatchInputs de um lote de PackedRow; as sentenças ficam na ordem em que estão nas linhas """
+    max_len = max(len(row.ids) for row in batch)
+    pad = cloze.tokenizer.pad_token_id
+    input_ids = torch.tensor([row.ids + [pad] * (max_len - len(row.ids)) for row in batch], device=cloze.device)
+    # segmento de cada token (0 no padding, que vira um bloco à parte e não é atendido por ninguém)
+    segments = []
+    position_ids = []
+    for row in batch:
+        padding = [0] * (max_len - len(row.ids))
+        segments.append([j + 1 for j, s in enumerate(row.sentences) for _ in s.ids] + padding)
+        position_ids.append([p for s in row.sentences for p in range(len(s.ids))] + padding)
+    segments = torch.tensor(segments, device=cloze.device)
+    # [lote, 1, len, len]: True onde o token da linha pode atender o da coluna
+    attention_mask = (segments[:, :, None] == segments[:, None, :])[:, None]
+    position_ids = torch.tensor(position_ids, device=cloze.device)
+    rows = torch.tensor([i for i, row in enumerate(batch) for s in row.sentences for _ in s.positions],
+                        device=cloze.device)
+    positions = torch.tensor([start + p for row in batch for start, s in zip(row.starts, row.sentences)
+                              for p in s.positions], device=cloze.device)
+    targets = torch.tensor([t for row in batch for s in row.sentences for t in s.targets], device=cloze.device)
+    return BatchInputs(input_ids, {"attention_mask": attention_mask, "position_ids": position_ids}, rows,
+                       positions, targets, [len(s.positions) for row in batch for s in row.sentences])
+
+
+def run_inputs(cloze, inputs, stats, capture=None, sentences=None):
+    """
+    forward de um BatchInputs: [tensor [n_máscaras]] na CPU, um por sentença
+    :param capture: TopKCapture (topk_capture.py) que recebe os logits das posições mascaradas das sentences
+    """
+    cloze.model.eval()
+    with torch.no_grad():
+        with stats.time("forward"), METRICS.profile(stats.name):
+            outputs = cloze.model(inputs.input_ids, **inputs.kwargs)
+    with stats.time("gather"):
+        predict = outputs[0][inputs.rows, inputs.positions, inputs.targets]
+    if capture is not None:
+        with stats.time("capture"):
+            capture.add(outputs[0][inputs.rows, inputs.positions], inputs.targets, sentences)
+    with stats.time("copy"):
+        predict = predict.cpu()
+    stats.count("forwards")
+    stats.count("sentences", len(inputs.sizes))
+    return torch.split(predict, inputs.sizes)
+
+
+def forward_packed(cloze, batch, stats=None, capture=None):
+    """ como o forward_batch, para um lote de PackedRow; os scores saem na ordem das sentenças das linhas """
+    stats = stats or METRICS.mode("packed")
+    with stats.time("tensor"):
+        inputs = packed_inputs(cloze, batch)
+    sentences = [s for row in batch for s in row.sentences] if capture is not None else None
+    return run_inputs(cloze, inputs, stats, capture, sentences)
+
+
+def forward_batch(cloze, batch, stats=None, capture=None):
+    """ logits das posições mascaradas de cada sentença nos ids alvo: [tensor [n_máscaras]] na CPU """
+    stats = stats or METRICS.mode("batched")
+    with stats.time("tensor"):
+        inputs = batch_inputs(cloze, batch)
+    return run_inputs(cloze, inputs, stats, capture, batch)
+
+
+class ResultBuilder:
+    """ junta os scores das sentenças de volta em {chave: {padrão: [[hipo], [hyper]]}}, par a par """
+
+    def __init__(self, cloze, patterns, mode):
+        self.cloze = cloze
+        self.patterns = patterns
+        self.mode = mode
+        self.keys = {}
+        self.scores = {}
+        # sentenças que faltam para cada par
+        self.missing = {}
+        self.n_items = 0
+        # pares sem nenhuma sentença (palavras sem wordpieces): completos desde o registro, com listas vazias
+        self.ready = []
+
+    def add_pair(self, key, pair):
+        """ registra um par; devolve o índice dele (MaskedSentence.item) """
+        item = self.n_items
+        self.n_items += 1
+        n_hypo, n_hyper = len(self.cloze.word_ids(pair[0])), len(self.cloze.word_ids(pair[1]))
+        self.keys[item] = key
+        self.scores[item] = [[[0.0] * n_hypo, [0.0] * n_hyper] for _ in self.patterns]
+        per_pattern = {"bert_score_2": 2, "single": 1}.get(self.mode, n_hypo + n_hyper)
+        self.missing[item] = len(self.patterns) * per_pattern if n_hypo + n_hyper else 0
+        if self.missing[item] == 0:
+            self.ready.append(item)
+        return item
+
+    def add(self, sentence, values):
+        """ guarda os scores de uma sentença; devolve o índice do par quando ele fica completo """
+        values = values.tolist()
+        if sentence.role == BOTH:
+            hypo, hyper = self.scores[sentence.item][sentence.pattern]
+            hypo[:] = values[:len(hypo)]
+            hyper[:] = values[len(hypo):]
+        else:
+            role = self.scores[sentence.item][sentence.pattern][sentence.role]
+            role[sentence.offset:sentence.offset + len(values)] = values
+        self.missing[sentence.item] -= 1
+        return sentence.item if self.missing[sentence.item] == 0 else None
+
+    def result(self, item):
+        return {pattern: scores for pattern, scores in zip(self.patterns, self.scores[item])}
+
+    def pop(self, item):
+        """ (chave, resultado) de um par completo, liberando a memória dele """
+        result = self.result(item)
+        del self.scores[item], self.missing[item]
+        return self.keys.pop(item), result
+
+
+def score(cloze, dataset, patterns, mode="bert_score", batch_tokens=8192, pack_tokens=None, capture=None):
+    """ equivalente em lote ao bert_sentence_score (mode=bert_score) e ao bert_sentence_score_2 """
+    return dict(score_pairs(dataset, patterns, cloze, mode, batch_tokens, window_tokens=None, ordered=True,
+                            pack_tokens=pack_tokens, capture=capture))
+
+
+def score_table(cloze, dataset, patterns, mode="bert_score", batch_tokens=8192, window_tokens=65536,
+                pack_tokens=None, capture=None):
+    """
+    Como o score, mas devolve um ScoreTable (score_table.py): os scores gatherados vão do tensor direto para o
+    buffer float32, sem .tolist() nem listas por par. Pares repetidos são pontuados uma vez (o dict dos
+    scorers também fica com uma entrada só). As sentenças são montadas por janela de window_tokens tokens.
+    """
+    if mode not in MODES:
+        raise ValueError(mode)
+    stats = METRICS.mode(("packed_" if pack_tokens else "batched_") + mode)
+    unique = {}
+    for row in dataset:
+        unique.setdefault(" ".join(row), list(row))
+    rows = list(unique.values())
+    with stats.time("tokenize"):
+        cloze.prepare_words(rows)
+    table = ScoreTable(patterns, list(unique), [len(cloze.word_ids(row[0])) for row in rows],
+                       [len(cloze.word_ids(row[1])) for row in rows])
+    if capture is not None:
+        for item, (key, n_hypo) in enumerate(zip(table.keys, table.n_hypo)):
+            capture.add_pair(item, key, int(n_hypo))
+    progress = stats.progress(len(rows))
+    window = []
+    tokens = 0
+    first = 0
+    for item, row in enumerate(rows):
+        with stats.time("build"):
+            for p, pattern in enumerate(patterns):
+                for sentence in expand(cloze, row[:2], pattern, mode, item, p):
+                    window.append(sentence)
+                    tokens += len(sentence.ids)
+        if item < len(rows) - 1 and (window_tokens is None or tokens < window_tokens):
+            continue
+        # a janela tem todas as sentenças dos pares first..item
+        fill_table(cloze, table, make_batches(pack(window, pack_tokens) if pack_tokens else window, batch_tokens),
+                   bool(pack_tokens), stats, capture)
+        progress.update(item + 1 - first)
+        first = item + 1
+        window = []
+        tokens = 0
+    progress.finish()
+    return table
+
+
+def fill_table(cloze, table, batches, packed=False, stats=None, capture=None):
+    """
+    pontua lotes já montados (make_batches, de MaskedSentence ou de PackedRow com packed=True) e grava os scores
+    no ScoreTable; os índices das sentenças (MaskedSentence.item) são os pares do table
+    """
+    stats = stats or METRICS.mode("packed" if packed else "batched")
+    for batch in batches:
+        if packed:
+            sentences = [s for row in batch for s in row.sentences]
+            values = forward_packed(cloze, batch, stats, capture)
+        else:
+            sentences = batch
+            values = forward_batch(cloze, batch, stats, capture)
+        with stats.time("copy"):
+            # o BOTH do mode=single começa no hipônimo e segue pelo hiperônimo, que vem logo depois
+            destinations = np.concatenate([
+                np.arange(len(s.positions)) + table.offset(s.item, s.pattern, s.role == HYPERNYM) + s.offset
+                for s in sentences])
+            table.put(destinations, torch.cat(values))
+
+
+_models = {}
+
+
+def load_model(model_name, fast_tokenizer=False):
+    """ ClozeBert (bert_portuguese.py) carregado uma vez por processo """
+    if (model_name, fast_tokenizer) not in _models:
+        from bert_portuguese import ClozeBert
+        _models[(model_name, fast_tokenizer)] = ClozeBert(model_name, fast_tokenizer=fast_tokenizer)
+    return _models[(model_name, fast_tokenizer)]
+
+
+def score_pairs(pairs, patterns, model, mode="bert_score", batch_tokens=8192, window_tokens=65536, ordered=False,
+                pack_tokens=None, capture=None):
+    """
+    Pontua um iterável de pares sob demanda e devolve um gerador de (chave, {padrão: [[hipo], [hyper]]}).
+
+    Os pares são lidos do iterável só até juntar window_tokens tokens de sentenças mascaradas (a janela, que
+    é ordenada por tamanho e dividida em lotes de batch_tokens); cada par sai assim que o lote com a última
+    sentença dele termina. Como é um gerador, nada é lido nem pontuado enquanto o consumidor não pede o
+    próximo resultado: a memória fica limitada à janela (backpressure). window_tokens=None lê tudo de uma vez.
+
+    :param pairs: iterável de linhas [hipo, hyper, ...]; a chave é " ".join(linha), como nos resultados
+    :param model: ClozeBert ou nome do modelo/snapshot
+    :param ordered: devolve na ordem de entrada (segura os pares que terminam antes dos anteriores)
+    :param pack_tokens: empacota as sentenças em linhas deste tamanho (ex.: 128); None: uma sentença por linha
+    :param capture: TopKCapture que guarda as alternativas de cada posição mascarada (topk_capture.py)
+
+    Ex.: mineração -> pontuação -> avaliação sem arquivos intermediários
+        rows = [[h, y, "True", "hyper"] for h, y, _, _ in hearst_miner.aggregate(counts)]
+        result = dict(score_pairs(rows, BEST_BERT_SCORE, "neuralmind/bert-base-portuguese-cased"))
+    """
+    cloze = load_model(model) if isinstance(model, str) else model
+    if mode not in MODES:
+        raise ValueError(mode)
+    builder = ResultBuilder(cloze, patterns, mode)
+    stats = METRICS.mode(("packed_" if pack_tokens else "batched_") + mode)
+    progress = stats.progress(len(pairs) if hasattr(pairs, "__len__") else None)
+    iterator = iter(pairs)
+    exhausted = False
+    next_out = 0
+    done = {}
+
+    def complete(item):
+        nonlocal next_out
+        progress.update()
+        if not ordered:
+            yield builder.pop(item)
+            return
+        done[item] = builder.pop(item)
+        while next_out in done:
+            yield done.pop(next_out)
+            next_out += 1
+
+    while not exhausted:
+        # enche a janela
+        window = []
+        rows = []
+        tokens = 0
+        # palavras tokenizadas para esta janela: saem do word_cache quando ela termina (memória limitada)
+        new_words = [] if window_tokens is not None else None
+        while window_tokens is None or tokens < window_tokens:
+            row = next(iterator, None)
+            if row is None:
+                exhausted = True
+                break
+            rows.append(list(row))
+            if len(rows) == READ_CHUNK or window_tokens is None:
+                tokens += _expand_rows(cloze, builder, rows, patterns, mode, window, stats, capture, new_words)
+                rows = []
+        if rows:
+            _expand_rows(cloze, builder, rows, patterns, mode, window, stats, capture, new_words)
+        while builder.ready:
+            yield from complete(builder.ready.pop(0))
+        for batch in make_batches(pack(window, pack_tokens) if pack_tokens else window, batch_tokens):
+            if pack_tokens:
+                scored = zip([s for row in batch for s in row.sentences],
+                             forward_packed(cloze, batch, stats, capture))
+            else:
+                scored = zip(batch, forward_batch(cloze, batch, stats, capture))
+            for sentence, values in scored:
+                item = builder.add(sentence, values)
+                if item is not None:
+                    yield from complete(item)
+        for word in new_words or ():
+            cloze.word_cache.pop(word, None)
+    progress.finish()
+
+
+def _expand_rows(cloze, builder, rows, patterns, mode, window, stats, capture=None, new_words=None):
+    """ tokeniza as palavras em lote, registra os pares e põe as sentenças na janela; devolve os tokens """
+    with stats.time("tokenize"):
+        if new_words is not None:
+            new_words.extend(w for w in dict.fromkeys(w for row in rows for w in row[:2]) if w not in cloze.word_cache)
+        cloze.prepare_words(rows)
+    tokens = 0
+    with stats.time("build"):
+        for row in rows:
+            item = builder.add_pair(" ".join(row), row)
+            if capture is not None:
+                capture.add_pair(item, " ".join(row), len(cloze.word_ids(row[0])))
+            for p, pattern in enumerate(patterns):
+                for sentence in expand(cloze, row[:2], pattern, mode, item, p):
+                    window.append(sentence)
+                    tokens += len(sentence.ids)
+    return tokens
@@ -0,0 +1,293 @@
+"""
+Serviço local de pontuação: mantém um ou mais ClozeBert carregados e atende pedidos de pares x padrões x modo
+(HTTP em localhost ou num socket Unix), sem recarregar o modelo a cada experimento.
+
+As sentenças mascaradas de pedidos concorrentes entram numa fila única por modelo; o laço do modelo espera até
+--window_ms pelo próximo pedido, junta o que chegou em lotes de até --batch_tokens tokens (scoring.py) e roda o
+forward numa thread, enquanto o laço de eventos continua recebendo pedidos. Cada par é devolvido assim que fica
+completo, uma linha NDJSON por par no formato dos resultados de hoje: {"hipo hyper True hyper": {padrão: [[..], [..]]}}
+
+    POST /score  {"pairs": [["gato", "animal", "True", "hyper"], ...], "patterns": [...], "mode": "bert_score",
+                  "model": "<nome>"}       (patterns, mode e model são opcionais)
+    GET  /stats  contadores de pedidos, lotes e latência
+
+Uso:
+    python scoring_service.py serve -m neuralmind/bert-base-portuguese-cased --port 8765
+    python scoring_service.py serve -m work/tiny-bert --socket /tmp/scoring.sock
+    python scoring_service.py bench -d datasets/ontoPT-test.tsv --port 8765 --clients 8 --pairs 20
+
+    curl -N -d '{"pairs": [["gato", "animal"]]}' localhost:8765/score
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class ModelWorker:
+    """ fila de sentenças de um modelo e o laço que monta e roda os lotes """
+
+    def __init__(self, cloze, batch_tokens=8192, window_ms=5):
+        self.cloze = cloze
+        self.batch_tokens = batch_tokens
+        self.window = window_ms / 1000
+        self.pending = deque()
+        self.has_work = asyncio.Event()
+        self.stats = {"requests": 0, "pairs": 0, "sentences": 0, "batches": 0, "batch_rows": 0, "forward_s": 0.0,
+                      "latency_s": 0.0}
+
+    def submit(self, pairs, patterns, mode):
+        """ fila as sentenças dos pares; devolve uma asyncio.Queue que recebe (chave, resultado) por par """
+        from scoring import ResultBuilder, expand
+        self.cloze.prepare_words(pairs)
+        builder = ResultBuilder(self.cloze, patterns, mode)
+        out = asyncio.Queue()
+        request = {"builder": builder, "out": out, "left": len(pairs), "t0": time.time(), "failed": False}
+        for row in pairs:
+            item = builder.add_pair(" ".join(row), row)
+            for p, pattern in enumerate(patterns):
+                for sentence in expand(self.cloze, row[:2], pattern, mode, item, p):
+                    self.pending.append((request, sentence))
+        # pares sem wordpieces não têm sentenças: saem já completos
+        while builder.ready:
+            out.put_nowait(builder.pop(builder.ready.pop(0)))
+            request["left"] -= 1
+        self.stats["requests"] += 1
+        self.stats["pairs"] += len(pairs)
+        if request["left"] == 0:
+            out.put_nowait(None)
+        self.has_work.set()
+        return out
+
+    def next_batch(self):
+        # ordem de chegada; o lote para quando passa do orçamento de tokens (com padding)
+        batch = []
+        max_len = 0
+        while self.pending:
+            if self.pending[0][0]["failed"]:
+                self.pending.popleft()
+                continue
+            length = max(max_len, len(self.pending[0][1].ids))
+            if batch and length * (len(batch) + 1) > self.batch_tokens:
+                break
+            batch.append(self.pending.popleft())
+            max_len = length
+        return batch
+
+    async def run(self):
+        from scoring import forward_batch
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.has_work.wait()
+            # janela para juntar pedidos concorrentes no mesmo lote
+            await asyncio.sleep(self.window)
+            while self.pending:
+                batch = self.next_batch()
+                if not batch:
+                    break
+                t0 = time.time()
+                try:
+                    values = await loop.run_in_executor(None, forward_batch, self.cloze, [s for _, s in batch])
+                except Exception as e:
+                    # o erro vai para os pedidos do lote; o resto da fila continua
+                    logger.exception("Erro no forward")
+                    for request in {id(r): r for r, _ in batch}.values():
+                        request["failed"] = True
+                        request["out"].put_nowait(e)
+                    continue
+                self.stats["forward_s"] += time.time() - t0
+                self.stats["batches"] += 1
+                self.stats["batch_rows"] += len(batch)
+                self.stats["sentences"] += len(batch)
+                for (request, sentence), v in zip(batch, values):
+                    item = request["builder"].add(sentence, v)
+                    if item is not None:
+                        request["out"].put_nowait(request["builder"].pop(item))
+                        request["left"] -= 1
+                        if request["left"] == 0:
+                            self.stats["latency_s"] += time.time() - request["t0"]
+                            request["out"].put_nowait(None)
+            self.has_work.clear()
+
+
+class ScoringService:
+    def __init__(self, models, patterns, batch_tokens=8192, window_ms=5, fast_tokenizer=False):
+        from bert_portuguese import ClozeBert
+        self.patterns = patterns
+        self.workers = {}
+        for model_name in models:
+            logger.info(f"Carregando {model_name}")
+            self.workers[model_name] = ModelWorker(ClozeBert(model_name, fast_tokenizer=fast_tokenizer),
+                                                   batch_tokens, window_ms)
+        self.default_model = models[0]
+
+    def stats(self):
+        result = {}
+        for name, worker in self.workers.items():
+            s = dict(worker.stats)
+            s["mean_batch_rows"] = s["batch_rows"] / max(s["batches"], 1)
+            s["mean_latency_s"] = s["latency_s"] / max(s["requests"], 1)
+            s["queued_sentences"] = len(worker.pending)
+            result[name] = s
+        return result
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            if len(request_line) < 2:
+                return
+            method, path = request_line[0], request_line[1]
+            if method == "GET" and path == "/stats":
+                await self.respond(writer, 200, json.dumps(self.stats()) + "\n")
+            elif method == "POST" and path == "/score":
+                await self.score(writer, json.loads(body))
+            else:
+                await self.respond(writer, 404, json.dumps({"error": f"{method} {path}"}) + "\n")
+        except Exception as e:
+            logger.exception("Erro no pedido")
+            await self.respond(writer, 400, json.dumps({"error": str(e)}) + "\n")
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer, status, text):
+        writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(text.encode('utf-8'))}\r\nConnection: close\r\n\r\n{text}".encode("utf-8"))
+        await writer.drain()
+
+    async def score(self, writer, request):
+        from scoring import MODES
+        worker = self.workers[request.get("model", self.default_model)]
+        mode = request.get("mode", "bert_score")
+        if mode not in MODES:
+            raise ValueError(f"mode {mode} (use {MODES})")
+        patterns = request.get("patterns", self.patterns)
+        # linhas com só (hipo, hyper) recebem a chave "hipo hyper"
+        pairs = [list(row) for row in request["pairs"]]
+        out = worker.submit(pairs, patterns, mode)
+        # sem Content-Length: as linhas vão saindo conforme os pares ficam prontos e a conexão fecha no fim
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+        while True:
+            item = await out.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                writer.write((json.dumps({"error": str(item)}) + "\n").encode("utf-8"))
+                break
+            key, result = item
+            writer.write((json.dumps({key: result}, ensure_ascii=False) + "\n").encode("utf-8"))
+            await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8765, socket_path=None):
+        for worker in self.workers.values():
+            asyncio.ensure_future(worker.run())
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+            logger.info(f"Servindo em {socket_path}")
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            logger.info(f"Servindo em http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+async def request(body, host="127.0.0.1", port=8765, socket_path=None, path="/score"):
+    """ cliente mínimo: devolve a lista de linhas (json) da resposta """
+    if socket_path:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    data = json.dumps(body).encode("utf-8") if body is not None else b""
+    method = "POST" if body is not None else "GET"
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\n"
+                 f"Connection: close\r\n\r\n".encode("latin-1") + data)
+    await writer.drain()
+    status = (await reader.readline()).decode("latin-1")
+    while (await reader.readline()).strip():
+        pass
+    lines = []
+    async for line in reader:
+        if line.strip():
+            lines.append(json.loads(line))
+    writer.close()
+    if " 200 " not in status:
+        raise RuntimeError(f"{status.strip()}: {lines}")
+    return lines
+
+
+async def bench(dataset, clients, pairs_per_request, mode, host, port, socket_path):
+    """ clientes concorrentes, cada um pedindo blocos do dataset; latência por pedido e pares/s no total """
+    chunks = [dataset[i:i + pairs_per_request] for i in range(0, len(dataset), pairs_per_request)]
+    latencies = []
+    queue = asyncio.Queue()
+    for chunk in chunks:
+        queue.put_nowait(chunk)
+
+    async def client():
+        while not queue.empty():
+            chunk = queue.get_nowait()
+            t0 = time.time()
+            lines = await request({"pairs": chunk, "mode": mode}, host, port, socket_path)
+            assert len(lines) == len(chunk), lines[-1:]
+            latencies.append(time.time() - t0)
+
+    t0 = time.time()
+    await asyncio.gather(*[client() for _ in range(clients)])
+    elapsed = time.time() - t0
+    latencies.sort()
+    stats = await request(None, host, port, socket_path, path="/stats")
+    return {"pairs": len(dataset), "requests": len(chunks), "clients": clients, "pairs_sec": len(dataset) / elapsed,
+            "latency_p50": latencies[len(latencies) // 2], "latency_p95": latencies[int(len(latencies) * 0.95)],
+            "server": stats[0]}
+
+
+def main():
+    from hearst_patterns import BEST_BERT_SCORE, EN_BEST_PATTERNS
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["serve", "bench"])
+    parser.add_argument("-m", "--models", type=str, nargs="+", help="bert models to keep loaded (serve)")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", type=str, default=None, help="unix socket instead of tcp")
+    parser.add_argument("--batch_tokens", type=int, default=8192)
+    parser.add_argument("--window_ms", type=float, default=5, help="wait to merge concurrent requests")
+    parser.add_argument("--en", action="store_true", help="default patterns: EN_BEST_PATTERNS")
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    parser.add_argument("-d", "--dataset", type=str, help="dataset tsv (bench)")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--pairs", type=int, default=20, help="pairs per request (bench)")
+    parser.add_argument("--mode", type=str, default="bert_score")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        patterns = EN_BEST_PATTERNS if args.en else BEST_BERT_SCORE
+        service = ScoringService(args.models, patterns, args.batch_tokens, args.window_ms, args.fast_tokenizer)
+        asyncio.run(service.serve(args.host, args.port, args.socket))
+    else:
+        from dataset_index import read_dataset
+        result = asyncio.run(bench(read_dataset(args.dataset), args.clients, args.pairs, args.mode, args.host,
+                                   args.port, args.socket))
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Vários processos de pontuação com uma só cópia dos pesos na memória.
+
+O modelo (e o tokenizer/vocab) é carregado uma vez no processo pai e os workers são criados com fork: as páginas
+dos pesos são compartilhadas (copy-on-write) e só o que cada worker escreve vira memória privada dele
+(ativações, resultados). Com --share_memory os pesos vão para memória compartilhada (model.share_memory())
+antes do fork; com um snapshot (snapshot.py) os pesos já são páginas do arquivo mapeado, compartilhadas até
+entre processos independentes. gc.freeze() antes do fork evita que o coletor de lixo toque (e copie) os objetos
+Python herdados.
+
+O relatório de memória lê /proc/<pid>/smaps_rollup: Rss, Pss e Private (memória só do processo), medidos quando
+cada fatia termina, com os tensores do forward já liberados. O pico de cada worker vem do VmHWM de
+/proc/<pid>/status: Pss_peak soma ao Pss o quanto o processo chegou a ocupar acima do Rss atual (os logits de um
+lote de batch_tokens tokens, por exemplo). O check falha (código 1) se algum worker passar de --max_private_mb de
+memória privada.
+
+Uso:
+    python shared_workers.py -m neuralmind/bert-base-portuguese-cased -e datasets -o results -w 8 --threads 1
+    python shared_workers.py -m snapshots/bert-base-portuguese-cased -e datasets -o results -w 8 --max_private_mb 300
+"""
+import argparse
+import gc
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+_cloze = None
+_options = None
+
+
+def memory(pid="self"):
+    """ {campo: MB} de /proc/<pid>/smaps_rollup """
+    result = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == "kB":
+                result[fields[0].rstrip(":")] = int(fields[1]) / 1024
+    result["Private"] = result.get("Private_Clean", 0) + result.get("Private_Dirty", 0)
+    return result
+
+
+def peak_rss(pid="self"):
+    """ VmHWM (pico do Rss do processo) em MB, de /proc/<pid>/status """
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _init_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+
+
+def _score_shard(task):
+    import scoring
+    shard_id, rows = task
+    t0 = time.time()
+    result = scoring.score(_cloze, rows, _options["patterns"], _options["mode"], _options["batch_tokens"])
+    usage = memory()
+    usage["VmHWM"] = peak_rss()
+    # o que passou do Rss atual durante os forwards já foi liberado, mas ocupou memória do worker
+    usage["Pss_peak"] = usage["Pss"] + max(0.0, usage["VmHWM"] - usage["Rss"])
+    return shard_id, result, {"pid": os.getpid(), "pairs": len(rows), "seconds": time.time() - t0,
+                              "memory": usage}
+
+
+def run(cloze, dataset, patterns, mode="bert_score", workers=2, threads=1, batch_tokens=8192, shards_per_worker=4):
+    """ pontua o dataset em workers criados por fork; devolve (resultado, {pid: memória}) """
+    global _cloze, _options
+    _cloze = cloze
+    _options = {"patterns": patterns, "mode": mode, "batch_tokens": batch_tokens}
+    # tokenização no pai, antes do fork: o cache de palavras também fica compartilhado
+    cloze.prepare_words(dataset)
+    n_shards = max(1, workers * shards_per_worker)
+    size = max(1, -(-len(dataset) // n_shards))
+    tasks = [(i, dataset[start:start + size]) for i, start in enumerate(range(0, len(dataset), size))]
+
+    gc.collect()
+    gc.freeze()
+    ctx = multiprocessing.get_context("fork")
+    results = [None] * len(tasks)
+    worker_memory = {}
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        for shard_id, result, info in pool.imap_unordered(_score_shard, tasks):
+            results[shard_id] = result
+            previous = worker_memory.get(info["pid"], {})
+            worker_memory[info["pid"]] = {k: max(v, previous.get(k, 0)) for k, v in info["memory"].items()}
+            logger.info(f"shard {shard_id}: {info['pairs']} pares em {info['seconds']:.1f}s (pid {info['pid']}, "
+                        f"privada {info['memory']['Private']:.0f} MB)")
+    gc.unfreeze()
+    merged = {}
+    for result in results:
+        merged.update(result)
+    return merged, worker_memory
+
+
+def memory_report(parent, worker_memory, f_out=sys.stdout):
+    f_out.write("process\tRss_MB\tPss_MB\tShared_MB\tPrivate_MB\tPss_peak_MB\n")
+    shared = parent.get("Shared_Clean", 0) + parent.get("Shared_Dirty", 0)
+    f_out.write(f"parent\t{parent['Rss']:.0f}\t{parent['Pss']:.0f}\t{shared:.0f}\t{parent['Private']:.0f}\t"
+                f"{parent['Pss']:.0f}\n")
+    for pid, m in sorted(worker_memory.items()):
+        shared = m.get("Shared_Clean", 0) + m.get("Shared_Dirty", 0)
+        f_out.write(f"worker-{pid}\t{m['Rss']:.0f}\t{m['Pss']:.0f}\t{shared:.0f}\t{m['Private']:.0f}\t"
+                    f"{m['Pss_peak']:.0f}\n")
+    total_pss = parent["Pss"] + sum(m["Pss"] for m in worker_memory.values())
+    f_out.write(f"total_pss\t{total_pss:.0f}\n")
+    f_out.write(f"total_pss_peak\t{parent['Pss'] + sum(m['Pss_peak'] for m in worker_memory.values()):.0f}\n")
+
+
+def main():
+    from autotune import load_profile
+    from bert_portuguese import ClozeBert, load_eval_file, save_bert_file
+    from dataset_index import dataset_files
+    from hearst_patterns import PATTERN_SETS
+    from scoring import MODES
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_name", type=str, help="bert model or snapshot dir", required=True)
+    parser.add_argument("-e", "--eval_path", type=str, help="path to datasets", required=True)
+    parser.add_argument("-o", "--output_path", type=str, help="path to dir output", required=True)
+    parser.add_argument("-i", "--index", type=str, required=False, help="index.json of dataset_index.py")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="default: host profile of autotune.py, else the cpu count")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads per worker (default: profile, else 1)")
+    parser.add_argument("--mode", choices=MODES, default="bert_score")
+    parser.add_argument("--patterns", choices=list(PATTERN_SETS), default="all_en",
+                        help="all_en is the list bert_portuguese.py -b uses")
+    parser.add_argument("--batch_tokens", type=int, default=None, help="default: profile, else 8192")
+    parser.add_argument("--no_profile", action="store_true", help="ignore the host profile of autotune.py")
+    parser.add_argument("--share_memory", action="store_true", help="move the weights to shared memory before fork")
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    parser.add_argument("--max_private_mb", type=float, default=None,
+                        help="fail if a worker's private memory goes above this")
+    args = parser.parse_args()
+
+    profile = None if args.no_profile else load_profile(args.model_name, args.mode)
+    defaults = profile or {"workers": os.cpu_count(), "threads": 1, "batch_tokens": 8192}
+    for name in ("workers", "threads", "batch_tokens"):
+        if getattr(args, name) is None:
+            setattr(args, name, defaults[name])
+    logger.info(f"{args.workers} workers x {args.threads} threads, batch_tokens={args.batch_tokens}"
+                f"{' (perfil da máquina)' if profile else ''}")
+
+    cloze = ClozeBert(args.model_name, fast_tokenizer=args.fast_tokenizer)
+    if args.share_memory:
+        cloze.model.share_memory()
+    model_dir = args.model_name.replace("/", "-")
+    os.makedirs(os.path.join(args.output_path, model_dir), exist_ok=True)
+    f_out = open(os.path.join(args.output_path, model_dir, "info.tsv"), mode="a")
+    f_out.write("model\tdataset\tN\toov\thyper_num\tinclude_oov\n")
+
+    failed = False
+    for file_dataset, path_dataset in dataset_files(args.eval_path, args.index):
+        with open(path_dataset) as f_in:
+            eval_data = load_eval_file(f_in)
+        t0 = time.time()
+        result, worker_memory = run(cloze, eval_data, PATTERN_SETS[args.patterns], args.mode, args.workers,
+                                    args.threads, args.batch_tokens)
+        logger.info(f"{file_dataset}: {len(eval_data)} pares em {time.time() - t0:.1f}s com {args.workers} workers")
+        save_bert_file(result, args.output_path, file_dataset, model_dir, 0, 0, f_out)
+        memory_report(memory(), worker_memory)
+        if args.max_private_mb is not None:
+            over = {pid: m["Private"] for pid, m in worker_memory.items() if m["Private"] > args.max_private_mb}
+            if over:
+                logger.error(f"workers acima de {args.max_private_mb} MB de memória privada: {over}")
+                failed = True
+    f_out.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Snapshot local de um modelo para carregar rápido: pesos num arquivo lido com mmap (torch.load(mmap=True)) e
+ligados direto ao modelo criado no device "meta" (load_state_dict(assign=True)), sem inicialização aleatória
+nem cópia dos pesos; config.json; e o tokenizer já construído.
+
+O modelo do snapshot é o BertMLM (bert_mlm.py, só torch), então carregar um snapshot não importa o transformers
+(~4s). Com --fast_tokenizer o tokenizer vem do tokenizer.json (biblioteca tokenizers, mesmos ids, ver
+tokenizer_parity.py); sem ele, do tokenizer lento serializado com pickle, que importa parte do transformers.
+
+Os ClozeBert (bert_portuguese.py, bert2.py) reconhecem um diretório de snapshot no lugar do nome do modelo:
+    python snapshot.py build -m neuralmind/bert-base-portuguese-cased -o snapshots/bert-base-portuguese-cased
+    python bert_portuguese.py -m snapshots/bert-base-portuguese-cased -b -e datasets -o results
+
+Tempo de inicialização por etapa (rodar num processo novo, com o modelo original e com o snapshot):
+    python snapshot.py startup -m snapshots/bert-base-portuguese-cased
+"""
+import argparse
+import json
+import logging
+import os
+import pickle
+import time
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "snapshot.pt"
+CONFIG_FILE = "config.json"
+META_FILE = "snapshot.json"
+TOKENIZER_PICKLE = "tokenizer.pkl"
+TOKENIZER_JSON = "tokenizer.json"
+
+
+class SnapshotTokenizer:
+    """ a parte da interface do tokenizer do transformers usada pelos scorers, sobre tokenizers.Tokenizer """
+
+    is_fast = True
+
+    def __init__(self, path_json, special_tokens):
+        from tokenizers import Tokenizer
+        self.backend = Tokenizer.from_file(path_json)
+        self.vocab = self.backend.get_vocab()
+        self.ids_to_tokens = {i: t for t, i in self.vocab.items()}
+        for name, token in special_tokens.items():
+            setattr(self, name, token)
+            setattr(self, name + "_id", self.vocab[token])
+        self.all_special_ids = [self.vocab[t] for t in special_tokens.values()]
+        self.unk_token_id = self.vocab.get(special_tokens.get("unk_token"))
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def tokenize(self, text):
+        return self.backend.encode(text, add_special_tokens=False).tokens
+
+    def convert_tokens_to_ids(self, tokens):
+        if isinstance(tokens, str):
+            return self.vocab.get(tokens, self.unk_token_id)
+        return [self.vocab.get(t, self.unk_token_id) for t in tokens]
+
+    def convert_ids_to_tokens(self, ids):
+        if isinstance(ids, int):
+            return self.ids_to_tokens[ids]
+        return [self.ids_to_tokens[i] for i in ids]
+
+    def build_inputs_with_special_tokens(self, ids, ids_2=None):
+        result = [self.cls_token_id] + ids + [self.sep_token_id]
+        return result + ids_2 + [self.sep_token_id] if ids_2 is not None else result
+
+    def encode(self, text, add_special_tokens=True):
+        return self.backend.encode(text, add_special_tokens=add_special_tokens).ids
+
+    def __call__(self, texts, add_special_tokens=True):
+        return {"input_ids": [e.ids for e in self.backend.encode_batch(texts, add_special_tokens=add_special_tokens)]}
+
+
+def is_snapshot(path):
+    return os.path.isfile(os.path.join(path, SNAPSHOT_FILE))
+
+
+def build_snapshot(model_name, output_path):
+    import torch
+    from transformers import BertConfig, BertForMaskedLM
+
+    from wordpiece_table import load_tokenizer
+
+    os.makedirs(output_path, exist_ok=True)
+    config = BertConfig.from_pretrained(model_name)
+    model = BertForMaskedLM.from_pretrained(model_name, config=config)
+    torch.save({"state_dict": model.state_dict()}, os.path.join(output_path, SNAPSHOT_FILE))
+    config.to_json_file(os.path.join(output_path, CONFIG_FILE))
+    with open(os.path.join(output_path, TOKENIZER_PICKLE), mode="wb") as f:
+        pickle.dump(load_tokenizer(model_name, False), f)
+    fast = load_tokenizer(model_name, True)
+    fast.backend_tokenizer.save(os.path.join(output_path, TOKENIZER_JSON))
+    special_tokens = {name: getattr(fast, name) for name in
+                      ("unk_token", "sep_token", "pad_token", "cls_token", "mask_token")}
+    with open(os.path.join(output_path, META_FILE), mode="w", encoding="utf-8") as f:
+        json.dump({"model_name": model_name, "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   "special_tokens": special_tokens}, f)
+    logger.info(f"Snapshot de {model_name} em {output_path}")
+
+
+def load_tokenizer_snapshot(path, fast=False):
+    if fast:
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+            return SnapshotTokenizer(os.path.join(path, TOKENIZER_JSON), json.load(f)["special_tokens"])
+    with open(os.path.join(path, TOKENIZER_PICKLE), mode="rb") as f:
+        return pickle.load(f)
+
+
+def load_model_snapshot(path):
+    """ BertMLM com os pesos mapeados do arquivo (sem cópia) """
+    import torch
+
+    from bert_mlm import BertMLM, load_config
+
+    config = load_config(os.path.join(path, CONFIG_FILE))
+    with torch.device("meta"):
+        model = BertMLM(config)
+    snapshot = torch.load(os.path.join(path, SNAPSHOT_FILE), map_location="cpu", mmap=True, weights_only=True)
+    model.load_state_dict(snapshot["state_dict"], assign=True)
+    missing = [name for name, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+    if missing:
+        raise ValueError(f"snapshot {path} sem os tensores {missing}")
+    model.eval()
+    return config, model
+
+
+def load_snapshot(path, fast_tokenizer=False):
+    """ (config, tokenizer, model) de um diretório criado por build_snapshot """
+    config, model = load_model_snapshot(path)
+    return config, load_tokenizer_snapshot(path, fast_tokenizer), model
+
+
+def startup(model_name, fast_tokenizer=False, pattern="{} é um tipo de {}", pair=("gato", "animal")):
+    """ tempo de cada etapa até o primeiro score: imports, tokenizer, modelo e primeiro forward """
+    times = {}
+    t0 = time.time()
+    import torch  # noqa: F401
+    times["import_torch"] = time.time() - t0
+
+    t = time.time()
+    if not is_snapshot(model_name):
+        from transformers import BertForMaskedLM
+    times["import_transformers"] = time.time() - t
+
+    t = time.time()
+    from bert_portuguese import ClozeBert
+    times["import_scorer"] = time.time() - t
+
+    t = time.time()
+    cloze = ClozeBert(model_name, fast_tokenizer=fast_tokenizer, load_model=False)
+    times["tokenizer"] = time.time() - t
+
+    t = time.time()
+    if is_snapshot(model_name):
+        _, model = load_model_snapshot(model_name)
+    else:
+        from transformers import BertConfig
+        model = BertForMaskedLM.from_pretrained(model_name, config=BertConfig.from_pretrained(model_name))
+    cloze.model = model.to(cloze.device)
+    times["model"] = time.time() - t
+
+    t = time.time()
+    cloze.bert_sentence_score([pattern], [list(pair) + ["True", "hyper"]], [], [])
+    times["first_score"] = time.time() - t
+    times["total"] = time.time() - t0
+    return times
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["build", "startup"])
+    parser.add_argument("-m", "--model_name", type=str, help="bert model (or snapshot dir for startup)",
+                        required=True)
+    parser.add_argument("-o", "--output_path", type=str, help="snapshot dir (build)", required=False)
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_snapshot(args.model_name, args.output_path)
+    else:
+        times = startup(args.model_name, args.fast_tokenizer)
+        print(json.dumps({"model": args.model_name, "snapshot": is_snapshot(args.model_name),
+                          "times": {k: round(v, 3) for k, v in times.items()}}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
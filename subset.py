@@ -0,0 +1,186 @@
+"""
+Extrai subconjuntos de um resultado (json do bert_portuguese.py / bert2.py) sem carregar o arquivo inteiro.
+
+O resultado é lido entrada por entrada e cada chave é comparada, por hash, com o índice de pares
+normalizados (hipônimo hiperônimo, espaços colapsados, sem os rótulos). Dois modos:
+
+    - lista de pares (-p): grava as entradas cujo par está na lista (ex.: ontoPT-validation.tsv) e,
+      opcionalmente (--rest), as demais
+    - razão (-r/--ratio, --seed): divide em validação/teste numa única passada; a divisão depende só do
+      par e da semente, então é a mesma para qualquer modelo/modo
+
+Uso:
+    python subset.py -i results/model/ontoPT-test.json -p datasets/validation/ontoPT-validation.tsv -o out
+    python subset.py -i results/model/ontoPT-test.json -r 0.2 --seed 13 -o out
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+_decoder = json.JSONDecoder()
+
+
+def normalize_pair(hypo, hyper):
+    return " ".join(hypo.split() + hyper.split())
+
+
+def normalize_key(key):
+    # chave do resultado: "hipo hiper True hyper" (ou separada por tab no bert2.py); os 2 últimos campos são rótulos
+    fields = key.split()
+    return " ".join(fields[:-2])
+
+
+def key_hash(normalized, seed=""):
+    return int.from_bytes(hashlib.blake2b(f"{seed}{normalized}".encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def read_pairs(path_pairs):
+    pairs = set()
+    with open(path_pairs, mode="r", encoding="utf-8") as f:
+        for line in f:
+            row = line.rstrip("\n").split("\t")
+            if len(row) >= 2:
+                pairs.add(key_hash(normalize_pair(row[0], row[1])))
+    return pairs
+
+
+def iter_json_items(f_in, chunk_size=1 << 20):
+    """ Lê um objeto json {chave: valor, ...} de f_in e devolve (chave, valor) um por vez """
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = f_in.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def skip_space():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    def expect(chars):
+        nonlocal pos
+        skip_space()
+        if pos >= len(buffer) or buffer[pos] not in chars:
+            raise ValueError(f"json inválido: esperado {chars!r}")
+        pos += 1
+        return buffer[pos - 1]
+
+    def decode():
+        nonlocal pos
+        skip_space()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buffer, pos)
+                # um número no fim do buffer pode estar incompleto
+                if end < len(buffer) or eof:
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+
+    fill()
+    expect("{")
+    skip_space()
+    if pos < len(buffer) and buffer[pos] == "}":
+        return
+    while True:
+        key = decode()
+        expect(":")
+        value = decode()
+        yield key, value
+        if expect(",}") == "}":
+            return
+
+
+class JsonObjectWriter:
+    """ Grava um objeto json entrada por entrada, no mesmo formato do save_bert_file """
+
+    def __init__(self, path):
+        self.f = open(path, mode="w", encoding="utf-8")
+        self.f.write("{")
+        self.n = 0
+
+    def write(self, key, value):
+        if self.n:
+            self.f.write(", ")
+        self.f.write(json.dumps(key, ensure_ascii=False) + ": " + json.dumps(value, ensure_ascii=False))
+        self.n += 1
+
+    def close(self):
+        self.f.write("}")
+        self.f.close()
+
+
+def extract(path_result, writers, select):
+    """
+    :param writers: {nome: JsonObjectWriter}
+    :param select: função chave_normalizada -> nome do writer (ou None para descartar)
+    """
+    with open(path_result, mode="r", encoding="utf-8") as f_in:
+        for key, value in iter_json_items(f_in):
+            name = select(normalize_key(key))
+            if name is not None:
+                writers[name].write(key, value)
+    for writer in writers.values():
+        writer.close()
+    return {name: writer.n for name, writer in writers.items()}
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input_result", type=str, help="result json", required=True)
+    parser.add_argument("-o", "--output_path", type=str, help="dir output", required=True)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("-p", "--pairs", type=str, help="tsv with the pairs of the subset")
+    group.add_argument("-r", "--ratio", type=float, help="fraction of the pairs that go to validation")
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--rest", action="store_true", help="also write the pairs not in --pairs")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_path, exist_ok=True)
+    name = os.path.splitext(os.path.basename(args.input_result))[0]
+    if args.pairs:
+        pairs = read_pairs(args.pairs)
+        logger.info(f"{len(pairs)} pares em {args.pairs}")
+        subset_name = os.path.splitext(os.path.basename(args.pairs))[0]
+        writers = {"subset": JsonObjectWriter(os.path.join(args.output_path, subset_name + ".json"))}
+        if args.rest:
+            writers["rest"] = JsonObjectWriter(os.path.join(args.output_path, f"{name}-rest.json"))
+
+        def select(key):
+            if key_hash(key) in pairs:
+                return "subset"
+            return "rest" if args.rest else None
+    else:
+        writers = {"validation": JsonObjectWriter(os.path.join(args.output_path, f"{name}-validation.json")),
+                   "test": JsonObjectWriter(os.path.join(args.output_path, f"{name}-test.json"))}
+        threshold = int(args.ratio * 2 ** 64)
+
+        def select(key):
+            return "validation" if key_hash(key, f"{args.seed}:") < threshold else "test"
+
+    counts = extract(args.input_result, writers, select)
+    logger.info(f"Done! {counts}")
+
+
+if __name__ == '__main__':
+    main()
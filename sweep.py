@@ -0,0 +1,363 @@
+"""
+Sweep de vários modelos e modos numa máquina só, com a preparação dos datasets feita uma vez para todos.
+
+    - os datasets são lidos uma vez e os pares repetidos entre eles (e dentro deles) viram uma lista única
+    - as sentenças mascaradas (scoring.expand) e os lotes (make_batches / pack) são montados uma vez por
+      tokenização distinta e modo: modelos com os mesmos wordpieces para as palavras e os padrões do sweep (ex.:
+      base e large do mesmo vocabulário, ou um modelo e o snapshot dele) usam os mesmos lotes
+    - cada modelo roda num processo criado por fork depois da preparação, então os lotes são páginas
+      compartilhadas (gc.freeze, como no shared_workers.py); o processo carrega o modelo uma vez e roda todos os
+      modos dele
+    - os processos entram enquanto a soma das memórias estimadas cabe em --memory_mb (e até --workers ao mesmo
+      tempo), os maiores primeiro; um modelo maior que o orçamento roda sozinho
+
+A memória de cada modelo é estimada do config.json: pesos float32 mais os logits de um lote (batch_tokens x
+vocabulário, o forward calcula o vocabulário inteiro em todas as posições) e as ativações, mais --overhead_mb do
+processo. O pico real (Rss/Private de /proc, como no shared_workers.py) vai para o sweep.json.
+
+Os resultados ficam no layout de sempre (o do bert_portuguese.py -b, work_queue.py e pipeline.py), um json por
+dataset com os pares dele na ordem do tsv:
+    <output>/<modelo>/<dataset>.json e info.tsv             (modo bert_score)
+    <output>/<modelo>_<modo>/<dataset>.json ...              (outros modos)
+e o índice do sweep inteiro em <output>/sweep_index.tsv (modelo, modo, dataset, arquivo, N, AP com
+all_subword/min_positional_rank e os padrões do sweep) e <output>/sweep.json (configuração, estimativas, picos
+de memória e tempos), que dá a tabela de comparação direto.
+
+Uso:
+    python sweep.py -m neuralmind/bert-base-portuguese-cased bert-base-multilingual-cased bert-base-cased \
+        --modes bert_score bert_score_2 -e datasets -o results --memory_mb 24000
+    python sweep.py -m <model1> <model2> -e datasets -o results --dry_run
+"""
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "sweep_index.tsv"
+SWEEP_FILE = "sweep.json"
+
+_prepared = {}
+_options = None
+
+
+class Prepared:
+    """ pares da união e lotes já montados de uma tokenização e modo """
+
+    def __init__(self, keys, n_hypo, n_hyper, batches):
+        self.keys = keys
+        self.n_hypo = n_hypo
+        self.n_hyper = n_hyper
+        self.batches = batches
+
+
+class Job:
+    def __init__(self, model_name, signature, memory_mb):
+        self.model_name = model_name
+        self.signature = signature
+        self.memory_mb = memory_mb
+        self.process = None
+        self.started = 0.0
+        self.status = "pending"
+        self.seconds = 0.0
+        self.peak = {}
+
+
+def available_mb():
+    """ MemAvailable de /proc/meminfo """
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) / 1024
+    return float("inf")
+
+
+def model_config(model_name):
+    """ config.json de um diretório (modelo ou snapshot) ou do hub """
+    path = os.path.join(model_name, "config.json")
+    if os.path.isfile(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    from transformers import BertConfig
+    return BertConfig.from_pretrained(model_name).to_dict()
+
+
+def estimate_mb(config, batch_tokens=8192, overhead_mb=500):
+    """ memória de um processo com o modelo: pesos float32, logits e ativações de um lote e o resto do processo """
+    vocab, hidden = config["vocab_size"], config["hidden_size"]
+    layers, intermediate = config["num_hidden_layers"], config["intermediate_size"]
+    embeddings = (vocab + config.get("max_position_embeddings", 512) + config.get("type_vocab_size", 2)) * hidden
+    layer = 4 * hidden * hidden + 2 * hidden * intermediate + intermediate + 9 * hidden
+    head = hidden * hidden + 3 * hidden + vocab
+    weights = (embeddings + layers * layer + head) * 4
+    activations = batch_tokens * (vocab + intermediate + 6 * hidden) * 4
+    return (weights + activations) / (1 << 20) + overhead_mb
+
+
+def load_datasets(eval_path, index=None):
+    """ ({dataset: [chaves na ordem do tsv, sem repetição]}, [linhas da união, cada par uma vez]) """
+    from dataset_index import dataset_files, load_eval_file
+
+    dataset_keys = {}
+    union = {}
+    for file_dataset, path_dataset in dataset_files(eval_path, index):
+        with open(path_dataset, encoding="utf-8") as f_in:
+            rows = load_eval_file(f_in)
+        keys = []
+        for row in rows:
+            key = " ".join(row)
+            if key not in union:
+                union[key] = row
+            keys.append(key)
+        dataset_keys[file_dataset] = list(dict.fromkeys(keys))
+    return dataset_keys, list(union.values())
+
+
+def tokenizer_cloze(model_name, fast_tokenizer=False):
+    """ ClozeBert sem modelo, só com o tokenizer: o necessário para o scoring.expand (como no snapshot.startup) """
+    from bert_portuguese import ClozeBert
+
+    return ClozeBert(model_name, fast_tokenizer=fast_tokenizer, load_model=False)
+
+
+def signature(cloze, rows, patterns):
+    """ wordpieces das palavras e dos padrões e ids especiais: o que o scoring.expand usa do tokenizer """
+    import hashlib
+
+    tokenizer = cloze.tokenizer
+    cloze.prepare_words(rows)
+    digest = hashlib.sha1()
+    digest.update(json.dumps([tokenizer.cls_token_id, tokenizer.sep_token_id, tokenizer.mask_token_id,
+                              tokenizer.pad_token_id]).encode())
+    for pattern in patterns:
+        digest.update(json.dumps(tokenizer.convert_tokens_to_ids(tokenizer.tokenize(
+            pattern.format("", "").strip()))).encode())
+    for word in dict.fromkeys(w for row in rows for w in row[:2]):
+        digest.update(json.dumps(cloze.word_ids(word)).encode())
+    return digest.hexdigest()[:12]
+
+
+def prepare(cloze, rows, patterns, mode, batch_tokens=8192, pack_tokens=None):
+    """ Prepared com as sentenças de todos os pares e padrões, já em lotes """
+    import scoring
+
+    sentences = []
+    for item, row in enumerate(rows):
+        for p, pattern in enumerate(patterns):
+            sentences.extend(scoring.expand(cloze, row[:2], pattern, mode, item, p))
+    batches = list(scoring.make_batches(scoring.pack(sentences, pack_tokens) if pack_tokens else sentences,
+                                        batch_tokens))
+    return Prepared([" ".join(row) for row in rows], [len(cloze.word_ids(row[0])) for row in rows],
+                    [len(cloze.word_ids(row[1])) for row in rows], batches)
+
+
+def write_results(table, out_dir, dataset_keys, patterns, model_name):
+    """ um json por dataset, gravado num temporário e renomeado; devolve as linhas do índice """
+    from dataset_index import append_info
+    from ranking import evaluate
+
+    entries = []
+    os.makedirs(out_dir, exist_ok=True)
+    for file_dataset, keys in dataset_keys.items():
+        path = os.path.join(out_dir, os.path.splitext(file_dataset)[0] + ".json")
+        with open(path + ".tmp", mode="w", encoding="utf-8") as f_out:
+            table.dump(f_out, keys)
+        os.replace(path + ".tmp", path)
+        hyper_num = sum(1 for key in keys if key.split()[-1] == "hyper")
+        append_info(out_dir, model_name, file_dataset, len(keys), hyper_num=hyper_num)
+        ap = evaluate({key: table[key] for key in keys}, patterns) if keys else 0.0
+        entries.append({"dataset": file_dataset, "path": path, "N": len(keys), "hyper_num": hyper_num, "AP": ap})
+    return entries
+
+
+def _run_model(job, messages):
+    """ processo de um modelo: carrega uma vez e pontua os lotes preparados de cada modo """
+    import torch
+
+    import scoring
+    from bert_portuguese import ClozeBert
+    from instrumentation import METRICS
+    from score_table import ScoreTable
+    from shared_workers import memory
+    from dataset_index import model_output_dir
+
+    try:
+        torch.set_num_threads(_options["threads"])
+        cloze = ClozeBert(job.model_name, fast_tokenizer=_options["fast_tokenizer"])
+        for mode in _options["modes"]:
+            t0 = time.time()
+            prepared = _prepared[(job.signature, mode)]
+            table = ScoreTable(_options["patterns"], prepared.keys, prepared.n_hypo, prepared.n_hyper)
+            stats = METRICS.mode(("sweep_packed_" if _options["pack_tokens"] else "sweep_") + mode)
+            scoring.fill_table(cloze, table, prepared.batches, bool(_options["pack_tokens"]), stats)
+            out_dir = os.path.join(_options["output_path"], model_output_dir(job.model_name, mode))
+            entries = write_results(table, out_dir, _options["dataset_keys"], _options["patterns"], job.model_name)
+            messages.put(("mode", job.model_name, mode, entries, time.time() - t0, memory()))
+            del table
+    except BaseException:
+        messages.put(("error", job.model_name, traceback.format_exc()))
+        raise
+
+
+def run_sweep(jobs, memory_mb, workers, on_message, poll_s=1.0):
+    """ roda os jobs em processos (fork) enquanto a soma das memórias estimadas cabe em memory_mb """
+    context = multiprocessing.get_context("fork")
+    messages = context.Queue()
+    pending = sorted(jobs, key=lambda j: -j.memory_mb)
+    running = []
+    # o que foi herdado não é mais tocado pelo coletor de lixo (e não vira cópia privada em cada processo)
+    gc.freeze()
+    while pending or running:
+        used = sum(j.memory_mb for j in running)
+        for job in list(pending):
+            if len(running) >= workers:
+                break
+            if running and used + job.memory_mb > memory_mb:
+                continue
+            if job.memory_mb > memory_mb:
+                logger.warning(f"{job.model_name}: {job.memory_mb:.0f} MB estimados, mais que o orçamento; "
+                               f"roda sozinho")
+            job.process = context.Process(target=_run_model, args=(job, messages), name=job.model_name)
+            job.started = time.time()
+            job.process.start()
+            job.status = "running"
+            pending.remove(job)
+            running.append(job)
+            used += job.memory_mb
+            logger.info(f"{job.model_name}: iniciado ({job.memory_mb:.0f} MB estimados, {used:.0f} de "
+                        f"{memory_mb:.0f} MB em uso, {len(running)} processos)")
+        try:
+            on_message(messages.get(timeout=poll_s))
+            continue
+        except queue.Empty:
+            pass
+        for job in list(running):
+            if job.process.is_alive():
+                continue
+            job.process.join()
+            job.seconds = time.time() - job.started
+            job.status = "done" if job.process.exitcode == 0 else "failed"
+            running.remove(job)
+            logger.info(f"{job.model_name}: {job.status} em {job.seconds:.1f}s")
+    # mensagens que chegaram depois do último processo sair
+    while True:
+        try:
+            on_message(messages.get(timeout=poll_s))
+        except queue.Empty:
+            break
+    gc.unfreeze()
+
+
+def write_index(output_path, entries):
+    path = os.path.join(output_path, INDEX_FILE)
+    with open(path + ".tmp", mode="w", encoding="utf-8") as f_out:
+        f_out.write("model\tmode\tdataset\tpath\tN\thyper_num\tAP\n")
+        for e in sorted(entries, key=lambda e: (e["dataset"], e["model"], e["mode"])):
+            f_out.write(f"{e['model']}\t{e['mode']}\t{e['dataset']}\t{os.path.relpath(e['path'], output_path)}\t"
+                        f"{e['N']}\t{e['hyper_num']}\t{e['AP']}\n")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def main():
+    global _options
+    from hearst_patterns import PATTERN_SETS
+    from scoring import MODES
+    from shared_workers import memory
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_names", type=str, nargs="+", help="bert models or snapshot dirs",
+                        required=True)
+    parser.add_argument("--modes", choices=MODES, nargs="+", default=["bert_score"])
+    parser.add_argument("-e", "--eval_path", type=str, help="dataset file or dir of datasets", required=True)
+    parser.add_argument("-i", "--index", type=str, required=False, help="dataset index (dataset_index.py)")
+    parser.add_argument("-o", "--output_path", type=str, help="dir of the results", required=True)
+    parser.add_argument("--patterns", choices=list(PATTERN_SETS), default="all_en",
+                        help="all_en is the list bert_portuguese.py -b uses")
+    parser.add_argument("--memory_mb", type=float, default=None, help="default: 80%% of MemAvailable")
+    parser.add_argument("--overhead_mb", type=float, default=500, help="memory of a process besides the model")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="models at the same time (default: cpus)")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads per model (default: cpus / workers)")
+    parser.add_argument("--batch_tokens", type=int, default=8192)
+    parser.add_argument("--pack_tokens", type=int, default=None, help="pack sentences into rows of this size")
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    parser.add_argument("--dry_run", action="store_true", help="only prepare and show the schedule")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    patterns = PATTERN_SETS[args.patterns]
+    cpus = os.cpu_count() or 1
+    workers = args.workers or max(1, min(len(args.model_names), cpus))
+    threads = args.threads or max(1, cpus // workers)
+    memory_mb = args.memory_mb or 0.8 * available_mb()
+
+    dataset_keys, rows = load_datasets(args.eval_path, args.index)
+    n_keys = sum(len(keys) for keys in dataset_keys.values())
+    logger.info(f"{len(dataset_keys)} datasets, {n_keys} pares, {len(rows)} únicos")
+
+    jobs = []
+    for model_name in args.model_names:
+        cloze = tokenizer_cloze(model_name, args.fast_tokenizer)
+        sig = signature(cloze, rows, patterns)
+        if not any((sig, mode) in _prepared for mode in args.modes):
+            for mode in args.modes:
+                _prepared[(sig, mode)] = prepare(cloze, rows, patterns, mode, args.batch_tokens, args.pack_tokens)
+            n_batches = sum(len(_prepared[(sig, mode)].batches) for mode in args.modes)
+            logger.info(f"{model_name}: tokenização {sig}, {n_batches} lotes montados")
+        else:
+            logger.info(f"{model_name}: tokenização {sig}, lotes de outro modelo")
+        jobs.append(Job(model_name, sig, estimate_mb(model_config(model_name), args.batch_tokens,
+                                                     args.overhead_mb)))
+    parent = memory()
+    logger.info(f"Preparação em {time.time() - t0:.1f}s ({parent['Rss']:.0f} MB no processo principal)")
+    for job in jobs:
+        logger.info(f"{job.model_name}: {job.memory_mb:.0f} MB estimados")
+    logger.info(f"Orçamento {memory_mb:.0f} MB, até {workers} modelos ao mesmo tempo com {threads} threads cada")
+    if args.dry_run:
+        return
+
+    _options = {"modes": args.modes, "patterns": patterns, "threads": threads, "fast_tokenizer": args.fast_tokenizer,
+                "pack_tokens": args.pack_tokens, "output_path": args.output_path, "dataset_keys": dataset_keys}
+    entries = []
+    by_model = {job.model_name: job for job in jobs}
+
+    def on_message(message):
+        if message[0] == "error":
+            logger.error(f"{message[1]}:\n{message[2]}")
+            return
+        _, model_name, mode, mode_entries, seconds, peak = message
+        job = by_model[model_name]
+        job.peak = {k: max(v, job.peak.get(k, 0)) for k, v in peak.items() if k in ("Rss", "Pss", "Private")}
+        entries.extend({**e, "model": model_name, "mode": mode} for e in mode_entries)
+        logger.info(f"{model_name} {mode}: {len(mode_entries)} datasets em {seconds:.1f}s "
+                    f"(Rss {peak['Rss']:.0f} MB, privada {peak['Private']:.0f} MB)")
+
+    os.makedirs(args.output_path, exist_ok=True)
+    run_sweep(jobs, memory_mb, workers, on_message)
+    path = write_index(args.output_path, entries)
+    sweep = {"models": args.model_names, "modes": args.modes, "eval_path": args.eval_path, "index": args.index,
+             "patterns": args.patterns, "batch_tokens": args.batch_tokens, "pack_tokens": args.pack_tokens,
+             "memory_mb": memory_mb, "workers": workers, "threads": threads, "wall_seconds": time.time() - t0,
+             "date": time.strftime("%Y-%m-%d %H:%M:%S"), "prepare_rss_mb": parent["Rss"],
+             "jobs": [{"model": j.model_name, "tokenization": j.signature, "status": j.status,
+                       "estimated_mb": j.memory_mb, "peak_mb": j.peak, "seconds": j.seconds} for j in jobs]}
+    with open(os.path.join(args.output_path, SWEEP_FILE), mode="w", encoding="utf-8") as f_out:
+        json.dump(sweep, f_out, indent=2)
+    failed = [j.model_name for j in jobs if j.status != "done"]
+    logger.info(f"{len(entries)} resultados em {time.time() - t0:.1f}s -> {path}")
+    if failed:
+        logger.error(f"modelos com erro: {failed}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
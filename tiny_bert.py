@@ -0,0 +1,98 @@
+"""
+BERT minúsculo com pesos aleatórios e vocabulário local, para testar serviço, benchmarks e ferramentas sem
+baixar o modelo do Hugging Face. O vocabulário tem os tokens especiais, as palavras dos padrões de Hearst,
+os caracteres (e ##caracteres, então qualquer palavra é tokenizável) e as palavras dos datasets ou palavras
+sintéticas.
+
+Uso:
+    python tiny_bert.py -o work/tiny-bert -d datasets
+    python tiny_bert.py -o work/tiny-bert --n_words 2000 --layers 4
+"""
+import argparse
+import logging
+import os
+import random
+
+from hearst_patterns import ALL_EN_PATTERNS, ALL_PATTERNS
+
+logger = logging.getLogger(__name__)
+
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+SYLLABLES = ["ba", "ca", "da", "fe", "ga", "lo", "ma", "ne", "pi", "ra", "sa", "ta", "vo", "ze", "mu", "qui",
+             "tro", "bra", "cle", "dor", "gen", "lar", "mon", "par", "ser", "tin", "cão", "ção", "nha", "lhe"]
+
+
+def synthetic_words(n, seed=0, min_syllables=1, max_syllables=4):
+    rnd = random.Random(seed)
+    words = set()
+    while len(words) < n:
+        words.add("".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(min_syllables, max_syllables))))
+    return sorted(words)
+
+
+def dataset_words(eval_path):
+    words = set()
+    for filename in sorted(os.listdir(eval_path)):
+        path = os.path.join(eval_path, filename)
+        if not os.path.isfile(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                row = line.rstrip("\n").split("\t")
+                if len(row) >= 2:
+                    words.update(row[0].split())
+                    words.update(row[1].split())
+    return sorted(words)
+
+
+def build_vocab(words, max_words=None):
+    pattern_words = sorted({w for p in ALL_PATTERNS + ALL_EN_PATTERNS for w in p.format("", "").split()})
+    chars = sorted({c for w in list(words) + pattern_words for c in w})
+    vocab = SPECIAL_TOKENS + pattern_words
+    vocab += [c for c in chars if c not in vocab] + ["##" + c for c in chars]
+    seen = set(vocab)
+    words = [w for w in words if w not in seen]
+    return vocab + (words[:max_words] if max_words else words)
+
+
+def build_tiny_bert(output_path, words, hidden=32, layers=2, heads=2, intermediate=64, max_words=None, seed=0):
+    """ grava config, pesos aleatórios, vocab.txt e tokenizer em output_path """
+    import torch
+    from transformers import BertConfig, BertForMaskedLM, BertTokenizer
+
+    os.makedirs(output_path, exist_ok=True)
+    vocab = build_vocab(words, max_words)
+    with open(os.path.join(output_path, "vocab.txt"), mode="w", encoding="utf-8") as f:
+        f.write("\n".join(vocab) + "\n")
+    config = BertConfig(vocab_size=len(vocab), hidden_size=hidden, num_hidden_layers=layers,
+                        num_attention_heads=heads, intermediate_size=intermediate, max_position_embeddings=512)
+    torch.manual_seed(seed)
+    BertForMaskedLM(config).save_pretrained(output_path)
+    BertTokenizer(os.path.join(output_path, "vocab.txt"), do_lower_case=False).save_pretrained(output_path)
+    logger.info(f"BERT minúsculo em {output_path}: vocab={len(vocab)} hidden={hidden} camadas={layers}")
+    return output_path
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output_path", type=str, help="dir of the model", required=True)
+    parser.add_argument("-d", "--eval_path", type=str, help="take the words from the datasets", required=False)
+    parser.add_argument("--n_words", type=int, default=2000, help="synthetic words (without -d)")
+    parser.add_argument("--max_words", type=int, default=None)
+    parser.add_argument("--hidden", type=int, default=32)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--heads", type=int, default=2)
+    parser.add_argument("--intermediate", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    words = dataset_words(args.eval_path) if args.eval_path else synthetic_words(args.n_words, args.seed)
+    build_tiny_bert(args.output_path, words, args.hidden, args.layers, args.heads, args.intermediate,
+                    args.max_words, args.seed)
+
+
+if __name__ == '__main__':
+    main()
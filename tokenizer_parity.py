@@ -0,0 +1,121 @@
+"""
+Verifica que o tokenizer fast (BertTokenizerFast, em lote) gera exatamente os mesmos ids que o
+BertTokenizer python (um texto por vez) em todos os pontos de entrada que tokenizam:
+
+    - palavras dos datasets e dos vocabs (ClozeBert.word_ids, make_dataset.py, samples_words_corpus.py,
+      wordpiece_table.py)
+    - sentenças com os padrões (most_probabable_words do cloze_bert.py)
+    - utils_multiple_choice.convert_examples_to_features
+
+Uso:
+    python tokenizer_parity.py -m neuralmind/bert-base-portuguese-cased bert-base-multilingual-uncased \\
+        -s datasets vocabs/wikipedia15M/vocab.txt ...
+
+Sai com código 1 se houver qualquer diferença.
+"""
+import argparse
+import logging
+import os
+import sys
+
+from wordpiece_table import batch_tokenize, load_tokenizer, read_words
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S',
+                    level=logging.INFO)
+
+PATTERNS = ["{} é um tipo de {}", "{} é um {}", "{} e outros {}", "{} ou outro {}", "{} , um {}",
+            "{} is a type of {}", "{} is a {}", "{} and others {}", "{} or others {}", "{} , a {}"]
+
+
+def default_sources():
+    sources = ["datasets"]
+    if os.path.isdir("vocabs"):
+        for name in sorted(os.listdir("vocabs")):
+            sources.append(os.path.join("vocabs", name, "vocab.txt"))
+    return sources
+
+
+def compare(name, slow_ids, fast_ids, texts, max_report=10):
+    errors = 0
+    for text, a, b in zip(texts, slow_ids, fast_ids):
+        if list(a) != list(b):
+            errors += 1
+            if errors <= max_report:
+                logger.error(f"{name}: {text!r} slow={list(a)} fast={list(b)}")
+    logger.info(f"{name}: {len(texts)} textos, {errors} diferenças")
+    return errors
+
+
+def check_words(slow, fast, words, name):
+    slow_ids = [slow.convert_tokens_to_ids(slow.tokenize(w)) for w in words]
+    return compare(name, slow_ids, list(batch_tokenize(fast, words)), words)
+
+
+def check_sentences(slow, fast, dataset, name):
+    texts = []
+    for row in dataset:
+        for pattern in PATTERNS:
+            texts.append(pattern.format(row[0], slow.mask_token))
+            texts.append(pattern.format(row[0], row[1]))
+    slow_ids = [slow.convert_tokens_to_ids(slow.tokenize(t)) for t in texts]
+    return compare(name, slow_ids, list(batch_tokenize(fast, texts)), texts)
+
+
+def check_multiple_choice(slow, fast, dataset, name, max_length=32):
+    from utils_multiple_choice import InputExample, convert_examples_to_features
+    examples = []
+    for i, row in enumerate(dataset):
+        examples.append(InputExample(example_id=str(i), question="_ é um tipo de " + row[1],
+                                     contexts=[row[0], row[0]], endings=[row[0], row[1]], label="0"))
+    try:
+        slow_f = convert_examples_to_features(examples, ["0", "1"], max_length, slow)
+        fast_f = convert_examples_to_features(examples, ["0", "1"], max_length, fast)
+    except Exception as e:
+        # check que não roda conta como diferença: não dá para afirmar que os tokenizers são idênticos
+        logger.error(f"{name}: convert_examples_to_features falhou ({type(e).__name__}: {e})")
+        return 1
+    slow_ids = [c["input_ids"] + c["segment_ids"] for f in slow_f for c in f.choices_features]
+    fast_ids = [c["input_ids"] + c["segment_ids"] for f in fast_f for c in f.choices_features]
+    texts = [f"{e.example_id}:{j}" for e in examples for j in range(len(e.endings))]
+    return compare(name, slow_ids, fast_ids, texts)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_name", type=str, nargs="+", required=True,
+                        help="models (names ending with -uncased are lower cased)")
+    parser.add_argument("-s", "--source", type=str, nargs="+", required=False,
+                        help="datasets dir/files and vocab files (default: datasets and vocabs/*/vocab.txt)")
+    parser.add_argument("--max_sentences", type=int, default=5000,
+                        help="pairs of each dataset used to check sentences and multiple choice features")
+    args = parser.parse_args()
+
+    sources = args.source or default_sources()
+    errors = 0
+    for model_name in args.model_name:
+        slow = load_tokenizer(model_name, fast=False)
+        fast = load_tokenizer(model_name, fast=True)
+        logger.info(f"{model_name}: slow={type(slow).__name__} fast={type(fast).__name__}")
+        for source in sources:
+            errors += check_words(slow, fast, read_words(source), f"{model_name} {source}")
+            files = [source]
+            if os.path.isdir(source):
+                files = [os.path.join(source, f) for f in sorted(os.listdir(source))]
+            for path in files:
+                with open(path, mode="r", encoding="utf-8") as f:
+                    dataset = [line.rstrip("\n").split("\t") for line in f]
+                dataset = [row for row in dataset if len(row) == 4][:args.max_sentences]
+                if dataset:
+                    errors += check_sentences(slow, fast, dataset, f"{model_name} {path} sentences")
+                    errors += check_multiple_choice(slow, fast, dataset, f"{model_name} {path} multiple choice")
+
+    if errors:
+        logger.error(f"{errors} diferenças entre os tokenizers")
+        sys.exit(1)
+    logger.info("Tokenizers idênticos")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Alternativas do modelo em cada posição mascarada, guardadas durante a pontuação em lote para a análise de erros
+(o que o BERT preferia no lugar do hipônimo/hiperônimo), sem outro forward nem o most_probabable_words à mão.
+
+Com o logit das posições mascaradas já calculado, o scoring.run_inputs passa para o TopKCapture o log_softmax
+delas: guarda os k ids mais prováveis (int32), os log-probs deles (float16), o posto do token certo (1 = o mais
+provável) e o log-prob dele. O custo é um log_softmax e um topk sobre o vocabulário só nas posições mascaradas.
+
+O arquivo <dataset>.topk.npz fica ao lado do <dataset>.json; cada posição é uma linha, com o par, o padrão, o papel
+(0 hipônimo, 1 hiperônimo) e a posição do wordpiece dentro da palavra:
+    from topk_capture import load_topk
+    topk = load_topk("results/neuralmind-bert-base-portuguese-cased/ontoPT-test.topk.npz")
+    topk.query("banana fruta True hyper", "{} é um tipo de {}", tokenizer)
+"""
+import os
+
+import numpy as np
+import torch
+
+
+class TopKCapture:
+    def __init__(self, k=10):
+        self.k = k
+        self.keys = []
+        self.n_hypo = []
+        self._chunks = []
+
+    def add_pair(self, item, key, n_hypo):
+        """ registra o par de índice item (MaskedSentence.item), que tem n_hypo wordpieces no hipônimo """
+        if item != len(self.keys):
+            raise ValueError(f"par {item} fora de ordem")
+        self.keys.append(key)
+        self.n_hypo.append(n_hypo)
+
+    def add(self, logits, targets, sentences):
+        """
+        :param logits: [posições mascaradas, vocabulário], na ordem das posições das sentenças
+        :param targets: id certo de cada posição
+        """
+        from scoring import BOTH
+
+        log_probs = torch.log_softmax(logits.float(), dim=-1)
+        top_values, top_ids = torch.topk(log_probs, min(self.k, log_probs.shape[-1]), dim=-1)
+        gold = log_probs.gather(1, targets[:, None])
+        rank = (log_probs > gold).sum(dim=1) + 1
+        meta = []
+        for s in sentences:
+            for j in range(len(s.positions)):
+                role, offset = s.role, s.offset + j
+                if role == BOTH:
+                    n_hypo = self.n_hypo[s.item]
+                    role, offset = (0, offset) if offset < n_hypo else (1, offset - n_hypo)
+                meta.append((s.item, s.pattern, role, offset))
+        self._chunks.append((np.asarray(meta, dtype=np.int32).reshape(-1, 4),
+                             top_ids.cpu().numpy().astype(np.int32), top_values.cpu().numpy().astype(np.float16),
+                             rank.cpu().numpy().astype(np.int32), gold[:, 0].cpu().numpy().astype(np.float16)))
+
+    def __len__(self):
+        return sum(len(chunk[0]) for chunk in self._chunks)
+
+    def save(self, path, patterns):
+        """ grava o .npz (sem pickle: chaves e padrões como arrays de texto) """
+        k = self.k
+        chunks = self._chunks or [(np.zeros((0, 4), np.int32), np.zeros((0, k), np.int32),
+                                   np.zeros((0, k), np.float16), np.zeros(0, np.int32), np.zeros(0, np.float16))]
+        meta, ids, values, rank, gold = (np.concatenate(parts) for parts in zip(*chunks))
+        # na ordem (par, padrão, papel, posição), a mesma do json
+        order = np.lexsort(meta.T[::-1])
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, keys=np.array(self.keys, dtype=str), patterns=np.array(patterns, dtype=str),
+                 pair=meta[order, 0], pattern=meta[order, 1], role=meta[order, 2].astype(np.int8),
+                 offset=meta[order, 3].astype(np.int16), top_ids=ids[order], top_log_probs=values[order],
+                 gold_rank=rank[order], gold_log_prob=gold[order])
+        os.replace(tmp, path)
+
+
+class TopK:
+    """ leitura do .npz do TopKCapture """
+
+    def __init__(self, data):
+        self.keys = list(data["keys"])
+        self.patterns = list(data["patterns"])
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.pair = data["pair"]
+        self.pattern = data["pattern"]
+        self.role = data["role"]
+        self.offset = data["offset"]
+        self.top_ids = data["top_ids"]
+        self.top_log_probs = data["top_log_probs"]
+        self.gold_rank = data["gold_rank"]
+        self.gold_log_prob = data["gold_log_prob"]
+
+    def slots(self, key, pattern=None):
+        """ índices das linhas de um par (e padrão); as linhas estão ordenadas por par """
+        item = self.index[key]
+        start, end = np.searchsorted(self.pair, item, "left"), np.searchsorted(self.pair, item, "right")
+        slots = np.arange(start, end)
+        if pattern is not None:
+            slots = slots[self.pattern[start:end] == self.patterns.index(pattern)]
+        return slots
+
+    def query(self, key, pattern=None, tokenizer=None):
+        """ [{pattern, role, offset, gold_rank, gold_log_prob, top: [(token ou id, log-prob)]}] de um par """
+        result = []
+        for i in self.slots(key, pattern):
+            ids = self.top_ids[i].tolist()
+            tokens = tokenizer.convert_ids_to_tokens(ids) if tokenizer is not None else ids
+            result.append({"pattern": self.patterns[self.pattern[i]], "role": int(self.role[i]),
+                           "offset": int(self.offset[i]), "gold_rank": int(self.gold_rank[i]),
+                           "gold_log_prob": float(self.gold_log_prob[i]),
+                           "top": list(zip(tokens, self.top_log_probs[i].astype(float).tolist()))})
+        return result
+
+
+def load_topk(path):
+    with np.load(path) as data:
+        return TopK({name: data[name] for name in data.files})
+
+
+def topk_path(json_path):
+    return json_path[:-len(".json")] + ".topk.npz" if json_path.endswith(".json") else json_path + ".topk.npz"
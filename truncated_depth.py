@@ -0,0 +1,177 @@
+"""
+Pontuação com as k primeiras camadas do encoder + cabeça MLM, e varredura de k (AP por dataset e pares/s).
+
+A calibração (opcional) é uma transformação afim, ajustada por mínimos quadrados com regularização, que leva o
+estado oculto da camada k ao da última camada nas posições mascaradas, usando estados ocultos do modelo
+completo guardados de uma amostra de pares. A cabeça MLM original é aplicada depois dela. Os pares da calibração
+(-c, ou sem ele uma fração --calib_fraction dos pares dos datasets) ficam fora do AP do relatório.
+
+Uso:
+    python truncated_depth.py -m <model> -d datasets/ontoPT-validation.tsv -k 2 4 6 8 10 12 --calibrate \\
+        -c datasets/calib.tsv -o results/depth
+    python bert_portuguese.py -m <model> -b -e datasets -o results --layers 6 --calibration results/depth/calib-6.pt
+"""
+import argparse
+import logging
+import os
+import random
+import time
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def set_depth(model, n_layers=None):
+    """ mantém só as n_layers primeiras camadas do encoder (None volta ao modelo completo) """
+    encoder = model.bert.encoder
+    if "_all_layers" not in encoder.__dict__:
+        # fora do state_dict: só guarda as camadas para poder voltar
+        encoder.__dict__["_all_layers"] = list(encoder.layer)
+    all_layers = encoder.__dict__["_all_layers"]
+    n_layers = len(all_layers) if n_layers is None else min(n_layers, len(all_layers))
+    encoder.layer = torch.nn.ModuleList(all_layers[:n_layers])
+    model.config.num_hidden_layers = n_layers
+    return n_layers
+
+
+def set_calibration(model, calibration=None):
+    """ aplica (ou remove, com None) a calibração na entrada da cabeça MLM """
+    handle = model.__dict__.pop("_calibration_handle", None)
+    if handle is not None:
+        handle.remove()
+    if calibration is None:
+        return
+    weight, bias = calibration["weight"], calibration["bias"]
+
+    def hook(module, args):
+        hidden = args[0]
+        return (hidden @ weight.to(hidden.device, hidden.dtype) + bias.to(hidden.device, hidden.dtype),)
+
+    model.__dict__["_calibration_handle"] = model.cls.register_forward_pre_hook(hook)
+
+
+def masked_hidden_states(cloze, dataset, patterns, layers, max_sentences=20000):
+    """ {camada: tensor [n, hidden]} nas posições mascaradas das sentenças de build_sentences_n_subtoken """
+    set_depth(cloze.model, None)
+    set_calibration(cloze.model, None)
+    cloze.prepare_words(dataset)
+    states = {k: [] for k in layers}
+    n = 0
+    cloze.model.eval()
+    for row in dataset:
+        for pattern in patterns:
+            sentences, _, _, idx_mask = cloze.build_sentences_n_subtoken(pattern, row[:2])
+            with torch.no_grad():
+                outputs = cloze.model.bert(torch.tensor(sentences, device=cloze.device), output_hidden_states=True)
+            rows = torch.arange(len(sentences), device=cloze.device)
+            for k in layers:
+                states[k].append(outputs.hidden_states[k][rows, idx_mask].float().cpu())
+            n += len(sentences)
+            if n >= max_sentences:
+                return {k: torch.cat(v) for k, v in states.items()}
+    return {k: torch.cat(v) for k, v in states.items()}
+
+
+def fit_calibration(hidden_k, hidden_last, ridge=1e-2):
+    """ W, b que minimizam ||hidden_k W + b - hidden_last||² + ridge ||W||² """
+    x = torch.cat([hidden_k, torch.ones(len(hidden_k), 1)], dim=1).double()
+    y = hidden_last.double()
+    reg = ridge * torch.eye(x.shape[1], dtype=torch.float64)
+    reg[-1, -1] = 0
+    solution = torch.linalg.solve(x.T @ x + reg, x.T @ y)
+    return {"weight": solution[:-1].float(), "bias": solution[-1].float()}
+
+
+def calibrate(cloze, dataset, patterns, layers, max_sentences=20000, ridge=1e-2):
+    """ {k: calibração} para cada k de layers, a partir de uma única passada do modelo completo """
+    n_total = len(cloze.model.bert.encoder.__dict__.get("_all_layers", cloze.model.bert.encoder.layer))
+    states = masked_hidden_states(cloze, dataset, patterns, sorted(set(layers) | {n_total}), max_sentences)
+    logger.info(f"Calibração com {len(states[n_total])} posições mascaradas")
+    return {k: fit_calibration(states[k], states[n_total], ridge) for k in layers if k < n_total}
+
+
+def save_calibration(calibration, path):
+    torch.save(calibration, path)
+
+
+def load_calibration(path):
+    return torch.load(path, map_location="cpu")
+
+
+def main():
+    from bert_portuguese import ClozeBert, load_eval_file
+    from hearst_patterns import BEST_BERT_SCORE, EN_BEST_PATTERNS
+    from ranking import METHODS, SUB_METHODS, evaluate
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_name", type=str, help="path to bert models", required=True)
+    parser.add_argument("-d", "--datasets", type=str, nargs="+", help="dataset tsv files", required=True)
+    parser.add_argument("-o", "--output_path", type=str, help="dir output", required=True)
+    parser.add_argument("-k", "--layers", type=int, nargs="+", required=True, help="encoder depths to evaluate")
+    parser.add_argument("--calibrate", action="store_true", help="also evaluate each k with the calibrated head")
+    parser.add_argument("-c", "--calib_dataset", type=str, required=False,
+                        help="pairs used to fit the calibration (default: --calib_fraction of the datasets' pairs); "
+                             "calibration pairs are left out of the evaluation")
+    parser.add_argument("--calib_fraction", type=float, default=0.2,
+                        help="fraction of the pairs held out for the calibration when -c is not given")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--calib_sentences", type=int, default=20000)
+    parser.add_argument("--ridge", type=float, default=1e-2)
+    parser.add_argument("--en", action="store_true", help="use EN_BEST_PATTERNS instead of BEST_BERT_SCORE")
+    parser.add_argument("-n", "--n_patterns", type=int, default=None)
+    parser.add_argument("--method", choices=METHODS, default="all_subword")
+    parser.add_argument("--sub_method", choices=SUB_METHODS, default="min_positional_rank")
+    args = parser.parse_args()
+
+    best = EN_BEST_PATTERNS if args.en else BEST_BERT_SCORE
+    patterns = best[:args.n_patterns] if args.n_patterns else list(best)
+    os.makedirs(args.output_path, exist_ok=True)
+    cloze = ClozeBert(args.model_name)
+    datasets = {}
+    for path in args.datasets:
+        with open(path, encoding="utf-8") as f_in:
+            datasets[os.path.basename(path)] = load_eval_file(f_in)
+
+    calibrations = {}
+    if args.calibrate:
+        if args.calib_dataset:
+            with open(args.calib_dataset, encoding="utf-8") as f_in:
+                calib_rows = load_eval_file(f_in)
+        else:
+            # sem -c: uma fração dos pares dos próprios datasets, separada antes da avaliação
+            pairs = sorted({(row[0], row[1]) for dataset in datasets.values() for row in dataset})
+            random.Random(args.seed).shuffle(pairs)
+            calib_rows = [list(pair) for pair in pairs[:max(1, int(args.calib_fraction * len(pairs)))]]
+        # o AP é sempre medido fora dos pares da calibração (com e sem ela, para as linhas serem comparáveis)
+        held_out = {(row[0], row[1]) for row in calib_rows}
+        for name, dataset in datasets.items():
+            datasets[name] = [row for row in dataset if (row[0], row[1]) not in held_out]
+            logger.info(f"{name}: {len(dataset) - len(datasets[name])} pares da calibração fora da avaliação")
+        calibrations = calibrate(cloze, calib_rows, patterns, args.layers, args.calib_sentences, args.ridge)
+        for k, calibration in calibrations.items():
+            save_calibration(calibration, os.path.join(args.output_path, f"calib-{k}.pt"))
+
+    f_out = open(os.path.join(args.output_path, "depth.tsv"), mode="a", encoding="utf-8")
+    f_out.write("model\tdataset\tN\tlayers\tcalibrated\tpairs_sec\tAP\n")
+    runs = [(k, None) for k in args.layers] + [(k, calibrations[k]) for k in args.layers if k in calibrations]
+    for k, calibration in runs:
+        k = set_depth(cloze.model, k)
+        set_calibration(cloze.model, calibration)
+        for name, dataset in datasets.items():
+            cloze.prepare_words(dataset)
+            t0 = time.time()
+            result = cloze.bert_sentence_score(patterns, dataset, [], [])
+            pairs_sec = len(dataset) / (time.time() - t0)
+            ap = evaluate(result, patterns, args.method, args.sub_method)
+            f_out.write(f"{args.model_name}\t{name}\t{len(dataset)}\t{k}\t{calibration is not None}\t"
+                        f"{pairs_sec:.1f}\t{ap:.4f}\n")
+            logger.info(f"{name} k={k} calibrado={calibration is not None} {pairs_sec:.1f} pares/s AP={ap:.4f}")
+    f_out.close()
+
+
+if __name__ == '__main__':
+    main()
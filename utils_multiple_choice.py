@@ -311,9 +311,13 @@ def convert_examples_to_features(
     pad_on_left=False,
     pad_token=0,
     mask_padding_with_zero=True,
+    batch_size=1000,
 ) -> List[InputFeatures]:
     """
     Loads a data file into a list of `InputFeatures`
+
+    With a fast tokenizer (`tokenizer.is_fast`) the (context, ending) pairs of `batch_size` examples are
+    encoded in a single batch call; the resulting ids are the same as the one-by-one `encode_plus` path.
     """
 
     label_map = {label : i for i, label in enumerate(label_list)}
@@ -322,21 +326,10 @@ def convert_examples_to_features(
     for (ex_index, example) in tqdm.tqdm(enumerate(examples), desc="convert examples to features"):
         if ex_index % 10000 == 0:
             logger.info("Writing example %d of %d" % (ex_index, len(examples)))
+        if ex_index % batch_size == 0:
+            batch_inputs = _encode_examples(examples[ex_index:ex_index + batch_size], max_length, tokenizer)
         choices_features = []
-        for ending_idx, (context, ending) in enumerate(zip(example.contexts, example.endings)):
-            text_a = context
-            if example.question.find("_") != -1:
-                # this is for cloze question
-                text_b = example.question.replace("_", ending)
-            else:
-                text_b = example.question + " " + ending
-
-            inputs = tokenizer.encode_plus(
-                text_a,
-                text_b,
-                add_special_tokens=True,
-                max_length=max_length,
-            )
+        for ending_idx, inputs in enumerate(batch_inputs[ex_index % batch_size]):
             if 'num_truncated_tokens' in inputs and inputs['num_truncated_tokens'] > 0:
                 logger.info('Attention! you are cropping tokens (swag task is ok). '
                         'If you are training ARC and RACE and you are poping question + options,'
@@ -388,6 +381,45 @@ def convert_examples_to_features(
     return features
 
 
+def _choice_texts(example):
+    for context, ending in zip(example.contexts, example.endings):
+        text_a = context
+        if example.question.find("_") != -1:
+            # this is for cloze question
+            text_b = example.question.replace("_", ending)
+        else:
+            text_b = example.question + " " + ending
+        yield text_a, text_b
+
+
+def _encode_examples(examples, max_length, tokenizer):
+    """ Encodes the choices of `examples`, returns one list of `inputs` dicts per example """
+    if not getattr(tokenizer, "is_fast", False):
+        if not hasattr(tokenizer, "encode_plus"):
+            # transformers >= 5: the python tokenizer only has __call__; same truncation as the fast path
+            return [[tokenizer(text_a, text_b, add_special_tokens=True, max_length=max_length,
+                               truncation="longest_first", return_token_type_ids=True)
+                     for text_a, text_b in _choice_texts(example)] for example in examples]
+        # encode_plus of transformers 2.x truncates with longest_first by default
+        return [[tokenizer.encode_plus(text_a, text_b, add_special_tokens=True, max_length=max_length)
+                 for text_a, text_b in _choice_texts(example)] for example in examples]
+
+    texts = [list(_choice_texts(example)) for example in examples]
+    encoded = tokenizer(
+        [text_a for choices in texts for text_a, _ in choices],
+        [text_b for choices in texts for _, text_b in choices],
+        add_special_tokens=True,
+        max_length=max_length,
+        truncation="longest_first",
+        return_token_type_ids=True,
+    )
+    batch_inputs = []
+    i = 0
+    for choices in texts:
+        batch_inputs.append([{"input_ids": encoded["input_ids"][i + j], "token_type_ids": encoded["token_type_ids"][i + j]}
+                             for j in range(len(choices))])
+        i += len(choices)
+    return batch_inputs
 
 
 processors = {
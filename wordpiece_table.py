@@ -0,0 +1,246 @@
+"""
+Tabela persistente palavra -> wordpieces para um par (modelo, fonte de palavras).
+
+Cada tabela fica em um diretório com arrays compactos:
+    words.txt    uma palavra por linha, na ordem dos arrays
+    lengths.npy  uint16, número de subtokens de cada palavra
+    offsets.npy  int64, offsets[i]:offsets[i+1] delimita os ids da palavra i em ids.npy
+    ids.npy      int32, ids dos wordpieces concatenados
+    meta.json    modelo, fonte, do_lower_case e os hashes do conjunto de palavras e do vocabulário do tokenizer
+                 usados na construção (load_or_build reconstrói a tabela quando um dos dois muda)
+
+Os arrays são abertos com mmap, então filtrar datasets por tamanho de subtoken, montar os
+histogramas de results/subtoken_size e agrupar pares por (len_hypo, len_hyper) viram consultas,
+sem chamar o tokenizer.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+from collections import Counter
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TABLE_ROOT = "./wordpiece_tables"
+
+
+def load_tokenizer(model_name, fast=False):
+    """
+    Tokenizer com a mesma regra de do_lower_case usada pelo ClozeBert. Com fast=True usa o BertTokenizerFast
+    (tokenizers em Rust), que tokeniza lotes inteiros de uma vez; os ids são os mesmos (ver tokenizer_parity.py).
+    Aceita também um diretório de snapshot (snapshot.py), sem carregar o modelo.
+    """
+    from snapshot import is_snapshot, load_tokenizer_snapshot
+    if is_snapshot(model_name):
+        return load_tokenizer_snapshot(model_name, fast)
+    import transformers
+    if fast:
+        tokenizer_class = transformers.BertTokenizerFast
+    else:
+        # nas versões novas do transformers BertTokenizer já é o fast e o python puro virou BertTokenizerLegacy
+        tokenizer_class = getattr(transformers, "BertTokenizerLegacy", transformers.BertTokenizer)
+    return tokenizer_class.from_pretrained(model_name, do_lower_case=model_name.endswith("-uncased"))
+
+
+def batch_tokenize(tokenizer, words, batch_size=2048):
+    """
+    Tokeniza uma lista de palavras em lotes. Para cada palavra devolve os mesmos ids de
+    tokenizer.convert_tokens_to_ids(tokenizer.tokenize(word)).
+    """
+    for start in range(0, len(words), batch_size):
+        batch = words[start:start + batch_size]
+        encoded = tokenizer(batch, add_special_tokens=False)["input_ids"]
+        for ids in encoded:
+            yield ids
+
+
+def read_words(path):
+    """
+    Lê as palavras de uma fonte. Aceita:
+        - diretório de datasets (hipônimo e hiperônimo de todos os .tsv)
+        - arquivo de dataset (4 colunas separadas por tab)
+        - vocab.txt do DIVE ("palavra contagem") ou lista de frequências ("palavra\\tcontagem")
+    """
+    if os.path.isdir(path):
+        words = []
+        for filename in sorted(os.listdir(path)):
+            if os.path.isfile(os.path.join(path, filename)):
+                words.extend(read_words(os.path.join(path, filename)))
+        return list(dict.fromkeys(words))
+
+    words = []
+    with open(path, mode="r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            row = line.split("\t")
+            if len(row) == 4:
+                words.append(row[0].strip())
+                words.append(row[1].strip())
+            else:
+                words.append(line.split()[0])
+    return list(dict.fromkeys(words))
+
+
+def words_hash(words):
+    """ hash do conjunto de palavras (a ordem não importa) """
+    digest = hashlib.sha1()
+    for word in sorted(set(words)):
+        digest.update(word.encode("utf-8") + b"\n")
+    return digest.hexdigest()
+
+
+def tokenizer_hash(tokenizer):
+    """ hash do vocabulário (token -> id) e do do_lower_case do tokenizer """
+    vocab = tokenizer.get_vocab() if hasattr(tokenizer, "get_vocab") else tokenizer.vocab
+    digest = hashlib.sha1(str(bool(getattr(tokenizer, "do_lower_case", False))).encode())
+    for token, i in sorted(vocab.items(), key=lambda x: x[1]):
+        digest.update(f"{i}\t{token}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def source_name(path):
+    path = os.path.normpath(path)
+    if os.path.basename(path) == "vocab.txt":
+        # vocabs/wikipedia15M/vocab.txt -> wikipedia15M
+        return os.path.basename(os.path.dirname(path))
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def table_path(root, model_name, source):
+    return os.path.join(root, model_name.replace("/", "-"), source)
+
+
+class WordpieceTable:
+    def __init__(self, words, lengths, offsets, ids, meta):
+        self.words = words
+        self.lengths = lengths
+        self.offsets = offsets
+        self.ids = ids
+        self.meta = meta
+        self.word_index = {w: i for i, w in enumerate(words)}
+
+    @classmethod
+    def build(cls, tokenizer, words, model_name, source, batch_size=2048):
+        words = list(dict.fromkeys(words))
+        logger.info(f"Construindo tabela wordpiece {source} com {len(words)} palavras")
+        lengths = np.zeros(len(words), dtype=np.uint16)
+        offsets = np.zeros(len(words) + 1, dtype=np.int64)
+        chunks = []
+        for i, ids in enumerate(batch_tokenize(tokenizer, words, batch_size)):
+            lengths[i] = len(ids)
+            offsets[i + 1] = offsets[i] + len(ids)
+            chunks.append(ids)
+        flat = np.fromiter((t for ids in chunks for t in ids), dtype=np.int32, count=int(offsets[-1]))
+        meta = {"model_name": model_name, "source": source, "n_words": len(words), "n_ids": int(offsets[-1]),
+                "do_lower_case": bool(getattr(tokenizer, "do_lower_case", False)), "words_hash": words_hash(words),
+                "tokenizer_hash": tokenizer_hash(tokenizer)}
+        return cls(words, lengths, offsets, flat, meta)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "words.txt"), mode="w", encoding="utf-8") as f:
+            for w in self.words:
+                f.write(w + "\n")
+        np.save(os.path.join(path, "lengths.npy"), self.lengths)
+        np.save(os.path.join(path, "offsets.npy"), self.offsets)
+        np.save(os.path.join(path, "ids.npy"), self.ids)
+        with open(os.path.join(path, "meta.json"), mode="w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "words.txt"), encoding="utf-8") as f:
+            words = f.read().split("\n")[:-1]
+        lengths = np.load(os.path.join(path, "lengths.npy"), mmap_mode="r")
+        offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        if len(words) != len(lengths):
+            raise ValueError(f"tabela corrompida em {path}: {len(words)} palavras e {len(lengths)} tamanhos")
+        return cls(words, lengths, offsets, ids, meta)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return word in self.word_index
+
+    def length(self, word):
+        return int(self.lengths[self.word_index[word]])
+
+    def token_ids(self, word):
+        i = self.word_index[word]
+        return self.ids[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    def get_len_subtoken(self, pair):
+        return self.length(pair[0]), self.length(pair[1])
+
+    def filter_pairs(self, dataset, max_hypo=1, max_hyper=1):
+        new_data = []
+        for row in dataset:
+            len_hypo, len_hyper = self.get_len_subtoken(row[:2])
+            if len_hypo <= max_hypo and len_hyper <= max_hyper:
+                new_data.append(row)
+        return new_data
+
+    def histogram(self, dataset):
+        """ Counter {(len_hypo, len_hyper): N}, mesmo conteúdo de results/subtoken_size """
+        return Counter(self.get_len_subtoken(row[:2]) for row in dataset)
+
+    def buckets(self, dataset):
+        """ Agrupa os pares por (len_hypo, len_hyper) mantendo a ordem original dentro de cada grupo """
+        by_size = {}
+        for row in dataset:
+            by_size.setdefault(self.get_len_subtoken(row[:2]), []).append(row)
+        return by_size
+
+
+def load_or_build(tokenizer, model_name, source_path, root=DEFAULT_TABLE_ROOT, batch_size=2048):
+    """ tabela salva em root, reconstruída se as palavras da fonte ou o vocabulário do tokenizer mudaram """
+    path = table_path(root, model_name, source_name(source_path))
+    words = read_words(source_path)
+    if os.path.isfile(os.path.join(path, "meta.json")):
+        table = WordpieceTable.load(path)
+        if table.meta.get("words_hash") != words_hash(words):
+            logger.info(f"Tabela wordpiece {path} desatualizada: as palavras da fonte mudaram")
+        elif table.meta.get("tokenizer_hash") != tokenizer_hash(tokenizer):
+            logger.info(f"Tabela wordpiece {path} desatualizada: o vocabulário do tokenizer mudou")
+        else:
+            logger.info(f"Carregando tabela wordpiece {path}")
+            return table
+    table = WordpieceTable.build(tokenizer, words, model_name, source_name(source_path), batch_size)
+    table.save(path)
+    logger.info(f"Tabela wordpiece salva em {path}")
+    return table
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_name", type=str, help="path to bert models", required=True)
+    parser.add_argument("-s", "--source", type=str, nargs="+", required=True,
+                        help="dataset dir/file, vocab.txt or frequency list")
+    parser.add_argument("-t", "--table_dir", type=str, default=DEFAULT_TABLE_ROOT, help="root dir of the tables")
+    parser.add_argument("-b", "--batch_size", type=int, default=2048)
+    parser.add_argument("--fast", action="store_true", help="use the fast (Rust) tokenizer")
+    args = parser.parse_args()
+
+    tokenizer = load_tokenizer(args.model_name, args.fast)
+    for source in args.source:
+        table = WordpieceTable.build(tokenizer, read_words(source), args.model_name, source_name(source),
+                                     args.batch_size)
+        path = table_path(args.table_dir, args.model_name, source_name(source))
+        table.save(path)
+        logger.info(f"{path}: {len(table)} palavras, {table.meta['n_ids']} wordpieces")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+"""
+Fila de trabalho em diretório para rodar sweeps (modelos x modos x datasets) em várias máquinas com um sistema de
+arquivos compartilhado, sem nenhum serviço além do próprio sistema de arquivos.
+
+O init divide o sweep em tarefas (fatia do dataset x modo x modelo), uma por arquivo em <fila>/tasks. Cada worker
+pega uma tarefa criando <fila>/locks/<tarefa>.lock com O_CREAT|O_EXCL (só um consegue). O lock é um lease: o
+worker renova o mtime do arquivo a cada lease/3 segundos e um lock com mtime mais velho que --lease é de um worker
+que morreu; outro worker o toma renomeando o arquivo (rename é atômico, só um ganha) e criando um novo. O lock
+guarda um token do dono, e um worker cujo lease foi tomado percebe isso e não renova nem apaga o lock novo. O
+resultado de cada fatia vai para <fila>/shards/<tarefa>.json (gravado num temporário e renomeado), que é também
+a marca de tarefa feita.
+
+Quando todas as fatias de um (modelo, modo, dataset) terminam, quem terminou a última junta o resultado no
+layout de sempre, o mesmo do bert_portuguese.py -b (que o bert-eval.py lê):
+    <output>/<modelo>/<dataset>.json e <output>/<modelo>/info.tsv           (modo bert_score)
+    <output>/<modelo>_<modo>/<dataset>.json ...                                (outros modos)
+
+Os relógios das máquinas entram na conta do lease (mtime do servidor contra time.time() local): use um --lease
+bem maior que a diferença entre eles. Uma fatia pontuada duas vezes (lease tomado de um worker lento que ainda
+estava vivo) dá o mesmo arquivo, então não corrompe nada.
+
+Uso:
+    python work_queue.py init -q work/queue -m neuralmind/bert-base-portuguese-cased neuralmind/bert-large-portuguese-cased \
+        --modes bert_score bert_score_2 -e datasets -o results --shard_size 2000
+    python work_queue.py work -q work/queue                 # em cada máquina (ou --processes 4 numa só)
+    python work_queue.py status -q work/queue
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+
+from dataset_index import append_info, model_output_dir, write_atomic
+from hearst_patterns import PATTERN_SETS
+
+logger = logging.getLogger(__name__)
+
+SWEEP_FILE = "sweep.json"
+
+
+def _read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Lease:
+    """ lock exclusivo em arquivo com expiração pelo mtime; renovado por uma thread enquanto o dono trabalha """
+
+    def __init__(self, path, owner, lease_s):
+        self.path = path
+        self.owner = owner
+        self.lease_s = lease_s
+        # escrito no lock: distingue este lease de um novo lock do mesmo caminho criado por quem o tomou
+        self.token = f"{owner} {uuid.uuid4().hex}"
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire(self):
+        """ True se pegou o lock (novo ou tomado de um dono expirado) """
+        if self._create():
+            return True
+        try:
+            age = time.time() - os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return self._create()
+        if age < self.lease_s:
+            return False
+        # lease vencido: quem conseguir renomear o lock velho fica com a tarefa
+        stale = f"{self.path}.stale-{uuid.uuid4().hex}"
+        try:
+            os.rename(self.path, stale)
+        except FileNotFoundError:
+            return False
+        try:
+            previous = open(stale, encoding="utf-8").read().strip()
+        except OSError:
+            previous = "?"
+        os.remove(stale)
+        logger.warning(f"lease vencido de {os.path.basename(self.path)} ({previous}, {age:.0f}s), retomando")
+        return self._create()
+
+    def _create(self):
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, mode="w") as f_lock:
+            f_lock.write(self.token + "\n")
+        return True
+
+    def owned(self):
+        """ True se o lock no disco ainda é o deste lease """
+        try:
+            with open(self.path, encoding="utf-8") as f_lock:
+                return f_lock.read().strip() == self.token
+        except FileNotFoundError:
+            return False
+
+    def start_heartbeat(self):
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_s / 3):
+            if not self.owned():
+                # outro worker achou o lease vencido e tomou a tarefa: o lock agora é dele
+                self.lost = True
+                return
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                self.lost = True
+                return
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if not self.lost and not self.owned():
+            self.lost = True
+        if not self.lost:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        self.start_heartbeat()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class WorkQueue:
+    def __init__(self, path):
+        self.path = path
+        self.tasks_dir = os.path.join(path, "tasks")
+        self.locks_dir = os.path.join(path, "locks")
+        self.shards_dir = os.path.join(path, "shards")
+        self.merged_dir = os.path.join(path, "merged")
+        self.sweep = _read_json(os.path.join(path, SWEEP_FILE)) if os.path.isfile(os.path.join(path, SWEEP_FILE)) \
+            else None
+
+    @classmethod
+    def create(cls, path, models, modes, eval_path, output_path, patterns="all_en", shard_size=2000, index=None,
+               lease_s=600, batch_tokens=8192, fast_tokenizer=False):
+        """ grava o sweep e uma tarefa por (modelo, modo, dataset, fatia) """
+        from dataset_index import dataset_files, load_eval_file
+
+        for d in ("tasks", "locks", "shards", "merged"):
+            os.makedirs(os.path.join(path, d), exist_ok=True)
+        if os.path.isfile(os.path.join(path, SWEEP_FILE)):
+            raise FileExistsError(f"{path} já tem um sweep")
+        sweep = {"models": models, "modes": modes, "eval_path": eval_path, "index": index,
+                 "output_path": output_path, "patterns": patterns, "shard_size": shard_size, "lease_s": lease_s,
+                 "batch_tokens": batch_tokens, "fast_tokenizer": fast_tokenizer,
+                 "created": time.strftime("%Y-%m-%d %H:%M:%S"), "groups": {}}
+        n_tasks = 0
+        for file_dataset, path_dataset in dataset_files(eval_path, index):
+            with open(path_dataset, encoding="utf-8") as f_in:
+                n_rows = len(load_eval_file(f_in))
+            starts = list(range(0, n_rows, shard_size)) or [0]
+            for model in models:
+                for mode in modes:
+                    group = f"{model.replace('/', '-')}__{mode}__{os.path.splitext(file_dataset)[0]}"
+                    task_ids = []
+                    for i, start in enumerate(starts):
+                        task_id = f"{group}__{i:05d}"
+                        task = {"id": task_id, "group": group, "model": model, "mode": mode,
+                                "dataset": file_dataset, "path": path_dataset, "start": start,
+                                "end": min(start + shard_size, n_rows)}
+                        write_atomic(os.path.join(path, "tasks", task_id + ".json"), json.dumps(task))
+                        task_ids.append(task_id)
+                    sweep["groups"][group] = {"model": model, "mode": mode, "dataset": file_dataset,
+                                              "tasks": task_ids}
+                    n_tasks += len(task_ids)
+        write_atomic(os.path.join(path, SWEEP_FILE), json.dumps(sweep, indent=2))
+        logger.info(f"{n_tasks} tarefas em {len(sweep['groups'])} grupos em {path}")
+        return cls(path)
+
+    def task_ids(self):
+        return sorted(t for g in self.sweep["groups"].values() for t in g["tasks"])
+
+    def is_done(self, task_id):
+        return os.path.isfile(os.path.join(self.shards_dir, task_id + ".json"))
+
+    def is_merged(self, group):
+        return os.path.isfile(os.path.join(self.merged_dir, group + ".done"))
+
+    def lease(self, name, owner):
+        return Lease(os.path.join(self.locks_dir, name + ".lock"), owner, self.sweep["lease_s"])
+
+    def claim(self, owner, prefer_model=None):
+        """ (tarefa, lease) da próxima tarefa livre, dando preferência ao modelo já carregado; None se não há """
+        pending = [t for t in self.task_ids() if not self.is_done(t)]
+        if prefer_model is not None:
+            prefix = prefer_model.replace("/", "-") + "__"
+            pending.sort(key=lambda t: not t.startswith(prefix))
+        for task_id in pending:
+            lease = self.lease(task_id, owner)
+            if lease.acquire():
+                # pode ter terminado entre a listagem e o lock
+                if self.is_done(task_id):
+                    lease.release()
+                    continue
+                return _read_json(os.path.join(self.tasks_dir, task_id + ".json")), lease
+        return None
+
+    def save_shard(self, task, result):
+        write_atomic(os.path.join(self.shards_dir, task["id"] + ".json"), json.dumps(result, ensure_ascii=False))
+
+    def merge(self, group, owner):
+        """ junta as fatias de um grupo completo no layout de resultados; True se juntou agora """
+        info = self.sweep["groups"][group]
+        if self.is_merged(group) or not all(self.is_done(t) for t in info["tasks"]):
+            return False
+        lease = self.lease("merge__" + group, owner)
+        if not lease.acquire():
+            return False
+        with lease:
+            if self.is_merged(group):
+                return False
+            result = {}
+            for task_id in info["tasks"]:
+                result.update(_read_json(os.path.join(self.shards_dir, task_id + ".json")))
+            out_dir = os.path.join(self.sweep["output_path"], model_output_dir(info["model"], info["mode"]))
+            os.makedirs(out_dir, exist_ok=True)
+            dname = os.path.splitext(info["dataset"])[0]
+            write_atomic(os.path.join(out_dir, dname + ".json"), json.dumps(result, ensure_ascii=False))
+            append_info(out_dir, info["model"], info["dataset"], len(result))
+            write_atomic(os.path.join(self.merged_dir, group + ".done"),
+                          json.dumps({"by": owner, "date": time.strftime("%Y-%m-%d %H:%M:%S"), "N": len(result)}))
+        logger.info(f"{group}: {len(result)} pares em {out_dir}")
+        return True
+
+    def merge_all(self, owner):
+        return sum(self.merge(group, owner) for group in self.sweep["groups"])
+
+    def status(self):
+        tasks = self.task_ids()
+        done = sum(self.is_done(t) for t in tasks)
+        now = time.time()
+        running, expired = 0, 0
+        for name in os.listdir(self.locks_dir):
+            if name.endswith(".lock") and not name.startswith("merge__"):
+                try:
+                    age = now - os.stat(os.path.join(self.locks_dir, name)).st_mtime
+                except FileNotFoundError:
+                    continue
+                running += age < self.sweep["lease_s"]
+                expired += age >= self.sweep["lease_s"]
+        merged = sum(self.is_merged(g) for g in self.sweep["groups"])
+        return {"tasks": len(tasks), "done": done, "running": running, "expired_leases": expired,
+                "pending": len(tasks) - done - running, "groups": len(self.sweep["groups"]), "merged": merged}
+
+
+def score_task(cloze, sweep, task):
+    import scoring
+    from dataset_index import load_eval_file
+
+    with open(task["path"], encoding="utf-8") as f_in:
+        rows = load_eval_file(f_in)[task["start"]:task["end"]]
+    return scoring.score(cloze, rows, PATTERN_SETS[sweep["patterns"]], task["mode"], sweep["batch_tokens"])
+
+
+def work(queue_path, poll_s=10.0, max_tasks=None, owner=None):
+    """ pega e pontua tarefas até a fila acabar; devolve quantas fez """
+    from bert_portuguese import ClozeBert
+
+    queue = WorkQueue(queue_path)
+    owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+    sweep = queue.sweep
+    cloze = None
+    n_done = 0
+    while max_tasks is None or n_done < max_tasks:
+        claimed = queue.claim(owner, cloze.model_name if cloze is not None else None)
+        if claimed is None:
+            status = queue.status()
+            if status["done"] == status["tasks"]:
+                queue.merge_all(owner)
+                break
+            # o resto está com outros workers: espera terminarem ou o lease vencer
+            time.sleep(poll_s)
+            continue
+        task, lease = claimed
+        with lease:
+            if cloze is None or cloze.model_name != task["model"]:
+                cloze = None
+                cloze = ClozeBert(task["model"], fast_tokenizer=sweep["fast_tokenizer"])
+                cloze.model_name = task["model"]
+            t0 = time.time()
+            result = score_task(cloze, sweep, task)
+            queue.save_shard(task, result)
+        if lease.lost:
+            logger.warning(f"{task['id']}: lease perdido durante a pontuação (resultado gravado mesmo assim)")
+        n_done += 1
+        logger.info(f"{owner}: {task['id']} ({task['end'] - task['start']} pares) em {time.time() - t0:.1f}s")
+        queue.merge(task["group"], owner)
+    return n_done
+
+
+def _work_process(queue_path, poll_s):
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    work(queue_path, poll_s)
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["init", "work", "status", "merge"])
+    parser.add_argument("-q", "--queue", type=str, help="queue dir (shared filesystem)", required=True)
+    parser.add_argument("-m", "--models", type=str, nargs="+", help="bert models or snapshot dirs (init)")
+    parser.add_argument("--modes", type=str, nargs="+", default=["bert_score"], help="scoring.MODES (init)")
+    parser.add_argument("-e", "--eval_path", type=str, help="path to datasets (init)")
+    parser.add_argument("-i", "--index", type=str, required=False, help="index.json of dataset_index.py (init)")
+    parser.add_argument("-o", "--output_path", type=str, help="path to dir output (init)")
+    parser.add_argument("--patterns", choices=list(PATTERN_SETS), default="all_en",
+                        help="all_en is the list bert_portuguese.py -b uses (init)")
+    parser.add_argument("--shard_size", type=int, default=2000, help="pairs per task (init)")
+    parser.add_argument("--lease", type=float, default=600, help="seconds without heartbeat before a task is "
+                                                                   "reclaimed (init)")
+    parser.add_argument("--batch_tokens", type=int, default=8192)
+    parser.add_argument("--fast_tokenizer", action="store_true", help="use the fast (Rust) tokenizer")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes on this machine (work)")
+    parser.add_argument("--poll", type=float, default=10.0, help="seconds between checks when all tasks are "
+                                                                 "taken (work)")
+    args = parser.parse_args()
+
+    if args.command == "init":
+        from scoring import MODES
+        unknown = set(args.modes) - set(MODES)
+        if unknown:
+            parser.error(f"unknown modes {sorted(unknown)}, choose from {MODES}")
+        WorkQueue.create(args.queue, args.models, args.modes, args.eval_path, args.output_path, args.patterns,
+                         args.shard_size, args.index, args.lease, args.batch_tokens, args.fast_tokenizer)
+    elif args.command == "work":
+        if args.processes == 1:
+            work(args.queue, args.poll)
+        else:
+            processes = [multiprocessing.Process(target=_work_process, args=(args.queue, args.poll))
+                         for _ in range(args.processes)]
+            for p in processes:
+                p.start()
+            for p in processes:
+                p.join()
+    elif args.command == "merge":
+        queue = WorkQueue(args.queue)
+        logger.info(f"{queue.merge_all(f'{socket.gethostname()}:{os.getpid()}')} grupos juntados")
+    print(json.dumps(WorkQueue(args.queue).status()))
+
+
+if __name__ == '__main__':
+    main()